@@ -1,34 +1,131 @@
 import os
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Callable, Optional
+from uuid import uuid4
 
+from fastapi import Header
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncAttrs,
+    AsyncEngine,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 
+from app.database.pool import InstrumentedQueuePool
+from app.database.replicas import ReplicaRouter
+from app.services.cache import shared_cache
+
 
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
 
-DATABASE_URL = (
-    f'postgresql+asyncpg://{os.environ.get("POSTGRES_USER")}:'
-    f'{os.environ.get("POSTGRES_PASSWORD")}@{os.environ.get("DB_HOST")}'
-    f':5432/{os.environ.get("POSTGRES_DB")}'
-)
+def database_url(host: Optional[str]) -> str:
+    return (
+        f'postgresql+asyncpg://{os.environ.get("POSTGRES_USER")}:'
+        f'{os.environ.get("POSTGRES_PASSWORD")}@{host}'
+        f':5432/{os.environ.get("POSTGRES_DB")}'
+    )
+
+
+DATABASE_URL = database_url(os.environ.get("DB_HOST"))
+# Реплики только для чтения (потоковая репликация primary), через запятую.
+DB_REPLICA_HOSTS = [
+    host.strip()
+    for host in os.environ.get("DB_REPLICA_HOSTS", "").split(",")
+    if host.strip()
+]
+
+# Настройки пула соединений. Сумма DB_POOL_SIZE + DB_MAX_OVERFLOW по всем
+# воркерам не должна превышать max_connections Postgres.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+# Размер кэша подготовленных выражений на соединение. 0 - режим pgbouncer
+# (pool_mode=transaction): соседние транзакции соединения попадают в разные
+# серверные сессии, поэтому отключаются оба кэша (SQLAlchemy и asyncpg),
+# а выражения получают уникальные имена.
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+
+
+def _statement_name() -> str:
+    return f"__asyncpg_{uuid4()}__"
+
+
+def connect_args(statement_cache_size: int = DB_STATEMENT_CACHE_SIZE) -> dict:
+    if statement_cache_size > 0:
+        return {"prepared_statement_cache_size": statement_cache_size}
+    return {
+        "prepared_statement_cache_size": 0,
+        "statement_cache_size": 0,
+        "prepared_statement_name_func": _statement_name,
+    }
+
 
-engine = create_async_engine(DATABASE_URL)
+def create_engine(url: str) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args(),
+    )
+
+
+engine = create_engine(DATABASE_URL)
 # engine = create_async_engine("sqlite+aiosqlite:///./app.db")
+read_engines = [create_engine(database_url(host)) for host in DB_REPLICA_HOSTS]
+replica_router = ReplicaRouter(engine, read_engines, shared=shared_cache)
 
 
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
 
-async def get_db() -> AsyncGenerator[AsyncSession, None]:
-    async with AsyncSessionLocal() as session:
-        try:
+def get_replica_router() -> ReplicaRouter:
+    """
+    Зависимость для кода, которому сессия нужна не в каждом запросе.
+    """
+    return replica_router
+
+
+SessionDependency = Callable[..., AsyncGenerator[AsyncSession, None]]
+
+
+def session_dependencies(
+    router: ReplicaRouter,
+) -> tuple[SessionDependency, SessionDependency]:
+    """
+    Создает зависимости сессии записи (primary) и сессии чтения (реплика
+    или primary). Клиент различается по api-key: после его записи чтение
+    идет с primary, пока реплики не догонят.
+    """
+
+    async def get_db(
+        api_key: Optional[str] = Header(None, alias="api-key"),  # noqa: B008
+    ) -> AsyncGenerator[AsyncSession, None]:
+        async with router.write_session(api_key) as session:
+            try:
+                yield session
+                await session.commit()
+            except SQLAlchemyError:
+                await session.rollback()
+                raise
+
+    async def get_read_db(
+        api_key: Optional[str] = Header(None, alias="api-key"),  # noqa: B008
+    ) -> AsyncGenerator[AsyncSession, None]:
+        # Сессия чтения ничего не пишет: коммитить нечего.
+        async with router.read_session(api_key) as session:
             yield session
-            await session.commit()
-        except SQLAlchemyError:
-            await session.rollback()
-            raise
+
+    return get_db, get_read_db
+
+
+get_db, get_read_db = session_dependencies(replica_router)
@@ -0,0 +1,567 @@
+"""
+Версионные миграции схемы. Миграции применяются отдельной командой
+до запуска воркеров; при старте приложение только сверяет версию.
+
+    python -m app.database.migrations upgrade [--seed]
+    python -m app.database.migrations current
+
+Каждая миграция идемпотентна (создает только отсутствующие таблицы,
+колонки и индексы), поэтому ее можно применять как к новой базе, так и к
+базе, созданной до появления миграций через create_all.
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+    bindparam,
+    column,
+    delete,
+    func,
+    insert,
+    inspect,
+    select,
+    table,
+    text,
+    update,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateColumn
+
+# Ключ advisory-блокировки Postgres: миграции из нескольких процессов
+# выполняются строго по очереди.
+MIGRATION_LOCK_KEY = 7_345_001
+# Те же переменные окружения, что читает приложение.
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", "/media")
+HOT_HALF_LIFE = int(os.environ.get("HOT_HALF_LIFE", 6 * 3600))
+# Сколько строк миграция обрабатывает за один запрос.
+BACKFILL_BATCH_SIZE = 5000
+
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[AsyncConnection], Awaitable[None]]
+
+
+# Схема каждой версии записана здесь явно и не зависит от моделей: модели
+# описывают только последнюю версию. Таблицы - в том виде, в котором их
+# создала миграция; колонки и индексы, добавленные позже, - в своих миграциях.
+# Данные миграции заполняют запросами к этим же таблицам, а не кодом сервисов,
+# который, как и модели, следует за последней версией.
+_frozen = MetaData()
+
+_users = Table(
+    "users",
+    _frozen,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("api_key", String, unique=True, index=True),
+    Column("name", String),
+)
+_tweets = Table(
+    "tweets",
+    _frozen,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("content", String),
+    Column("author_id", Integer, ForeignKey("users.id")),
+    Column("created_at", DateTime),
+)
+_likes = Table(
+    "likes",
+    _frozen,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("tweet_id", Integer, ForeignKey("tweets.id")),
+)
+_followers = Table(
+    "followers",
+    _frozen,
+    Column("follower_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("followed_id", Integer, ForeignKey("users.id"), primary_key=True),
+)
+_media = Table(
+    "media",
+    _frozen,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("file_path", String),
+    Column("tweet_id", Integer, ForeignKey("tweets.id"), nullable=True),
+)
+_media_variants = Table(
+    "media_variants",
+    _frozen,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("media_id", Integer, ForeignKey("media.id"), nullable=False),
+    Column("kind", String(16), nullable=False),
+    Column("file_path", String, nullable=False),
+    Column("width", Integer, nullable=False),
+    Column("height", Integer, nullable=False),
+    UniqueConstraint("media_id", "kind"),
+)
+_timelines = Table(
+    "timelines",
+    _frozen,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("tweet_id", Integer, ForeignKey("tweets.id"), primary_key=True),
+)
+_tweet_tags = Table(
+    "tweet_tags",
+    _frozen,
+    Column("tag", String(100), primary_key=True),
+    Column("tweet_id", Integer, ForeignKey("tweets.id"), primary_key=True),
+    Index("ix_tweet_tags_tweet_id", "tweet_id"),
+)
+_tweet_mentions = Table(
+    "tweet_mentions",
+    _frozen,
+    Column("handle", String(100), primary_key=True),
+    Column("tweet_id", Integer, ForeignKey("tweets.id"), primary_key=True),
+    Index("ix_tweet_mentions_tweet_id", "tweet_id"),
+)
+_trending_checkpoints = Table(
+    "trending_checkpoints",
+    _frozen,
+    Column("id", Integer, primary_key=True),
+    Column("saved_at", DateTime, nullable=False),
+    Column("last_tweet_id", Integer, nullable=False),
+    Column("buckets", Text, nullable=False),
+)
+_replication_heartbeat_table = Table(
+    "replication_heartbeat",
+    _frozen,
+    Column("id", Integer, primary_key=True),
+    Column("beat_at", Float, nullable=False),
+)
+# Колонки, которые миграции добавляют к таблицам выше: для заполнения данных.
+_user_counters = table(
+    "users", column("id"), column("followers_count"), column("following_count")
+)
+_tweet_counters = table(
+    "tweets",
+    column("id"),
+    column("created_at", DateTime),
+    column("like_count", Integer),
+    column("hot_score", Float),
+)
+_tweets_fts = table("tweets_fts", column("rowid"), column("content"))
+
+
+def _create_tables(conn: Connection, *tables: Table) -> None:
+    for frozen_table in tables:
+        frozen_table.create(conn, checkfirst=True)
+
+
+def _add_columns(conn: Connection, table: Table, *columns: Column) -> None:
+    existing = {info["name"] for info in inspect(conn).get_columns(table.name)}
+    for new_column in columns:
+        if new_column.name not in existing:
+            ddl = CreateColumn(new_column).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def _create_indexes(
+    conn: Connection, table: str, indexes: dict[str, list[str]], unique: bool = False
+) -> None:
+    existing = {index["name"] for index in inspect(conn).get_indexes(table)}
+    for name, columns in indexes.items():
+        if name not in existing:
+            kind = "UNIQUE INDEX" if unique else "INDEX"
+            conn.execute(
+                text(f"CREATE {kind} {name} ON {table} ({', '.join(columns)})")
+            )
+
+
+def _has_unique(conn: Connection, table: str, columns: list[str]) -> bool:
+    inspector = inspect(conn)
+    unique_columns = [
+        constraint["column_names"]
+        for constraint in inspector.get_unique_constraints(table)
+    ] + [
+        index["column_names"]
+        for index in inspector.get_indexes(table)
+        if index["unique"]
+    ]
+    return columns in unique_columns
+
+
+async def _initial_schema(conn: AsyncConnection) -> None:
+    await conn.run_sync(_create_tables, _users, _tweets, _likes, _followers, _media)
+
+
+def _counter_column(name: str) -> Column:
+    return Column(name, Integer, nullable=False, server_default="0")
+
+
+async def _reconcile_like_counts(conn: AsyncConnection) -> None:
+    actual = (
+        select(func.count(_likes.c.id))
+        .where(_likes.c.tweet_id == _tweet_counters.c.id)
+        .correlate(_tweet_counters)
+        .scalar_subquery()
+    )
+    await conn.execute(
+        update(_tweet_counters)
+        .where(_tweet_counters.c.like_count != actual)
+        .values(like_count=actual)
+    )
+
+
+async def _reconcile_follow_counts(conn: AsyncConnection) -> None:
+    followers = (
+        select(func.count())
+        .where(_followers.c.followed_id == _user_counters.c.id)
+        .correlate(_user_counters)
+        .scalar_subquery()
+    )
+    following = (
+        select(func.count())
+        .where(_followers.c.follower_id == _user_counters.c.id)
+        .correlate(_user_counters)
+        .scalar_subquery()
+    )
+    await conn.execute(
+        update(_user_counters)
+        .where(
+            (_user_counters.c.followers_count != followers)
+            | (_user_counters.c.following_count != following)
+        )
+        .values(followers_count=followers, following_count=following)
+    )
+
+
+async def _columns_before_migrations(conn: AsyncConnection) -> None:
+    # Счетчики, хэши, владельцы медиа, варианты и ленты появились, когда
+    # схему создавал create_all, который не меняет существующие таблицы.
+    await conn.run_sync(
+        _add_columns,
+        _users,
+        _counter_column("followers_count"),
+        _counter_column("following_count"),
+    )
+    await conn.run_sync(_add_columns, _tweets, _counter_column("like_count"))
+    await conn.run_sync(
+        _add_columns,
+        _media,
+        Column("content_hash", String(64), nullable=True),
+        Column("owner_id", Integer, nullable=True),
+    )
+    await conn.run_sync(_create_tables, _media_variants, _timelines)
+    await _reconcile_like_counts(conn)
+    await _reconcile_follow_counts(conn)
+
+
+async def _hot_query_indexes(conn: AsyncConnection) -> None:
+    # Повторные лайки были возможны до уникального ограничения: оставляем первый.
+    if not await conn.run_sync(_has_unique, "likes", ["user_id", "tweet_id"]):
+        first_likes = (
+            select(func.min(_likes.c.id))
+            .group_by(_likes.c.user_id, _likes.c.tweet_id)
+            .subquery()
+        )
+        await conn.execute(
+            delete(_likes).where(_likes.c.id.not_in(select(first_likes)))
+        )
+        if conn.dialect.name == "sqlite":
+            # SQLite не умеет добавлять ограничения к таблице: достаточно индекса.
+            await conn.run_sync(
+                _create_indexes,
+                "likes",
+                {"uq_likes_user_id_tweet_id": ["user_id", "tweet_id"]},
+                True,
+            )
+        else:
+            await conn.execute(
+                text(
+                    "ALTER TABLE likes ADD CONSTRAINT uq_likes_user_id_tweet_id "
+                    "UNIQUE (user_id, tweet_id)"
+                )
+            )
+        await _reconcile_like_counts(conn)
+    await conn.run_sync(
+        _create_indexes,
+        "tweets",
+        {
+            "ix_tweets_like_count_id": ["like_count", "id"],
+            "ix_tweets_author_id_created_at": ["author_id", "created_at"],
+        },
+    )
+    await conn.run_sync(_create_indexes, "likes", {"ix_likes_tweet_id": ["tweet_id"]})
+    await conn.run_sync(
+        _create_indexes,
+        "followers",
+        {"ix_followers_followed_id_follower_id": ["followed_id", "follower_id"]},
+    )
+    await conn.run_sync(
+        _create_indexes,
+        "media",
+        {
+            "ix_media_content_hash": ["content_hash"],
+            "ix_media_tweet_id": ["tweet_id"],
+        },
+    )
+
+
+# Postgres: генерируемая колонка tsvector с конфигурацией simple и индекс GIN.
+# SQLite: таблица FTS5 с rowid = id твита.
+_SEARCH_DDL = {
+    "postgresql": [
+        "ALTER TABLE tweets ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_tweets_search_vector "
+        "ON tweets USING GIN (search_vector)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts "
+        "USING fts5(content, tokenize='unicode61 remove_diacritics 2')",
+    ],
+}
+
+
+async def _full_text_search(conn: AsyncConnection) -> None:
+    # В Postgres добавление генерируемой колонки переписывает таблицу tweets.
+    for ddl in _SEARCH_DDL.get(conn.dialect.name, []):
+        await conn.execute(text(ddl))
+    if conn.dialect.name == "sqlite":
+        await conn.execute(delete(_tweets_fts))
+        await conn.execute(
+            insert(_tweets_fts).from_select(
+                ["rowid", "content"], select(_tweets.c.id, _tweets.c.content)
+            )
+        )
+
+
+_TAG_PATTERN = re.compile(r"#(\w{1,100})")
+_MENTION_PATTERN = re.compile(r"@(\w{1,100})")
+
+
+def _extract(pattern: re.Pattern, content: str) -> list[str]:
+    return list(dict.fromkeys(match.casefold() for match in pattern.findall(content)))
+
+
+async def _tag_index(conn: AsyncConnection) -> None:
+    await conn.run_sync(
+        _create_tables, _tweet_tags, _tweet_mentions, _trending_checkpoints
+    )
+    await conn.execute(delete(_tweet_tags))
+    await conn.execute(delete(_tweet_mentions))
+    result = await conn.stream(select(_tweets.c.id, _tweets.c.content))
+    async for partition in result.partitions(BACKFILL_BATCH_SIZE):
+        tag_rows, mention_rows = [], []
+        for tweet_id, content in partition:
+            tag_rows += [
+                {"tag": tag, "tweet_id": tweet_id}
+                for tag in _extract(_TAG_PATTERN, content)
+            ]
+            mention_rows += [
+                {"handle": handle, "tweet_id": tweet_id}
+                for handle in _extract(_MENTION_PATTERN, content)
+            ]
+        if tag_rows:
+            await conn.execute(insert(_tweet_tags), tag_rows)
+        if mention_rows:
+            await conn.execute(insert(_tweet_mentions), mention_rows)
+
+
+def _hot_score(like_count: int, created_at: datetime) -> float:
+    age = (created_at - datetime(1970, 1, 1)).total_seconds()
+    return math.log2(1 + max(like_count, 0)) + age / HOT_HALF_LIFE
+
+
+async def _hot_scores(conn: AsyncConnection) -> None:
+    await conn.run_sync(
+        _add_columns,
+        _tweets,
+        Column("hot_score", Float, nullable=False, server_default="0"),
+    )
+    await conn.run_sync(
+        _create_indexes, "tweets", {"ix_tweets_hot_score_id": ["hot_score", "id"]}
+    )
+    set_score = (
+        update(_tweet_counters)
+        .where(_tweet_counters.c.id == bindparam("tweet_id"))
+        .values(hot_score=bindparam("score"))
+    )
+    tweets = _tweet_counters.c
+    result = await conn.stream(select(tweets.id, tweets.like_count, tweets.created_at))
+    async for partition in result.partitions(BACKFILL_BATCH_SIZE):
+        await conn.execute(
+            set_score,
+            [
+                {"tweet_id": tweet_id, "score": _hot_score(like_count, created_at)}
+                for tweet_id, like_count, created_at in partition
+            ],
+        )
+
+
+async def _replication_heartbeat(conn: AsyncConnection) -> None:
+    await conn.run_sync(_create_tables, _replication_heartbeat_table)
+
+
+async def _timeline_tweet_index(conn: AsyncConnection) -> None:
+    await conn.run_sync(
+        _create_indexes, "timelines", {"ix_timelines_tweet_id": ["tweet_id"]}
+    )
+
+
+async def _timeline_built_marker(conn: AsyncConnection) -> None:
+    await conn.run_sync(
+        _add_columns, _users, Column("timeline_built_at", DateTime, nullable=True)
+    )
+    # Непустые ленты уже собраны: их не нужно пересобирать при первом чтении.
+    await conn.execute(
+        text(
+            "UPDATE users SET timeline_built_at = CURRENT_TIMESTAMP WHERE EXISTS "
+            "(SELECT 1 FROM timelines WHERE timelines.user_id = users.id)"
+        )
+    )
+
+
+def _rename_media_files(rows: list[tuple[str, str]]) -> None:
+    for content_hash, file_path in rows:
+        legacy = os.path.join(MEDIA_ROOT, os.path.basename(file_path))
+        target = os.path.join(MEDIA_ROOT, content_hash)
+        if legacy == target or not os.path.exists(legacy):
+            continue
+        if os.path.exists(target):
+            os.remove(legacy)
+        else:
+            os.replace(legacy, target)
+
+
+async def _media_files_by_hash(conn: AsyncConnection) -> None:
+    # Файлы назывались <hash><ext>: одинаковые байты с разными расширениями
+    # лежали в разных файлах. Схема не меняется, переименовываются файлы.
+    result = await conn.execute(
+        text(
+            "SELECT DISTINCT content_hash, file_path FROM media "
+            "WHERE content_hash IS NOT NULL"
+        )
+    )
+    await asyncio.to_thread(_rename_media_files, [tuple(row) for row in result])
+
+
+MIGRATIONS = [
+    Migration(1, "initial schema", _initial_schema),
+    Migration(2, "columns added before migrations", _columns_before_migrations),
+    Migration(3, "indexes for feed, profile and like queries", _hot_query_indexes),
+    Migration(4, "full-text search over tweets", _full_text_search),
+    Migration(5, "hashtag and mention index, trending checkpoint", _tag_index),
+    Migration(6, "time-decayed hot score for the feed", _hot_scores),
+    Migration(7, "replication heartbeat for replica lag", _replication_heartbeat),
+    Migration(8, "timeline index for tweet deletes", _timeline_tweet_index),
+    Migration(9, "timeline built marker on users", _timeline_built_marker),
+    Migration(10, "media files named by content hash alone", _media_files_by_hash),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def _current_version(conn: AsyncConnection) -> Optional[int]:
+    has_table = await conn.run_sync(
+        lambda sync_conn: inspect(sync_conn).has_table(schema_version.name)
+    )
+    if not has_table:
+        return None
+    return await conn.scalar(select(func.max(schema_version.c.version)))
+
+
+async def current_version(engine: AsyncEngine) -> Optional[int]:
+    async with engine.connect() as conn:
+        return await _current_version(conn)
+
+
+async def upgrade(engine: AsyncEngine) -> list[int]:
+    """
+    Применяет недостающие миграции, каждую в своей транзакции.
+    Возвращает номера примененных миграций.
+    """
+    applied = []
+    for migration in MIGRATIONS:
+        async with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                await conn.execute(
+                    text("SELECT pg_advisory_xact_lock(:key)"),
+                    {"key": MIGRATION_LOCK_KEY},
+                )
+            await conn.run_sync(_metadata.create_all)
+            version = await _current_version(conn)
+            if version is not None and version >= migration.version:
+                continue
+            await migration.upgrade(conn)
+            await conn.execute(
+                schema_version.insert().values(
+                    version=migration.version, description=migration.description
+                )
+            )
+            applied.append(migration.version)
+    return applied
+
+
+async def verify(engine: AsyncEngine) -> int:
+    """
+    Проверяет, что схема базы соответствует коду. Не выполняет DDL.
+    """
+    version = await current_version(engine)
+    if version is None or version < LATEST_VERSION:
+        raise SchemaOutOfDate(
+            f"Database schema version is {version}, expected {LATEST_VERSION}. "
+            "Run: python -m app.database.migrations upgrade"
+        )
+    return version
+
+
+if __name__ == "__main__":
+    from app.database.database import AsyncSessionLocal, engine
+    from app.database.utils import populate_database
+    from app.models.user import User
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=["upgrade", "current"])
+    parser.add_argument(
+        "--seed", action="store_true", help="заполнить пустую базу демо-данными"
+    )
+    args = parser.parse_args()
+
+    async def main() -> None:
+        if args.command == "current":
+            print(f"Schema version: {await current_version(engine)}")
+            return
+        applied = await upgrade(engine)
+        print(f"Applied migrations: {applied or 'none'}")
+        if args.seed:
+            async with AsyncSessionLocal() as session:
+                if await session.scalar(select(func.count(User.id))) == 0:
+                    await populate_database(session)
+        await engine.dispose()
+
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import time
+from typing import Optional, cast
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util.queue import AsyncAdaptedQueue
+
+from app.services.metrics import Histogram, metric_header, render_histogram
+
+
+class _InstrumentedQueue(AsyncAdaptedQueue):
+    """
+    Очередь свободных соединений пула. Измеряется только блокирующая
+    выдача: пул ждет ее, когда лимит соединений исчерпан. Выдача без
+    ожидания и открытие нового соединения сюда не попадают.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_histogram = Histogram()
+        self.waiting = 0
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        if not block:
+            return super().get(block, timeout)
+        started = time.perf_counter()
+        # Свободное соединение выдается сразу: ожидающим считаем только
+        # того, кому его не хватило.
+        waiting = int(self.empty())
+        self.waiting += waiting
+        try:
+            return super().get(block, timeout)
+        finally:
+            self.waiting -= waiting
+            self.wait_histogram.observe(time.perf_counter() - started)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, который измеряет ожидание свободного соединения,
+    считает таймауты выдачи и ожидающих соединения в данный момент.
+    """
+
+    _queue_class = _InstrumentedQueue
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeouts = 0
+
+    @property
+    def _queue(self) -> _InstrumentedQueue:
+        return cast(_InstrumentedQueue, self._pool)
+
+    @property
+    def wait_histogram(self) -> Histogram:
+        return self._queue.wait_histogram
+
+    @property
+    def waiting(self) -> int:
+        return self._queue.waiting
+
+    def _do_get(self):
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def recreate(self):
+        pool = super().recreate()
+        pool._queue.wait_histogram = self.wait_histogram
+        pool.timeouts = self.timeouts
+        return pool
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "max_overflow": self._max_overflow,
+            "timeout": self._timeout,
+            "recycle": self._recycle,
+            "pre_ping": self._pre_ping,
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": self.overflow(),
+            "waiting": self.waiting,
+            "timeouts": self.timeouts,
+            "wait_seconds": self.wait_histogram.snapshot(),
+        }
+
+    def render_metrics(self) -> str:
+        """
+        Возвращает состояние пула в текстовом формате Prometheus.
+        """
+        lines = []
+        for name, kind, help_text, value in (
+            ("db_pool_size", "gauge", "Configured pool size.", self.size()),
+            ("db_pool_checked_out", "gauge", "Connections in use.", self.checkedout()),
+            ("db_pool_overflow", "gauge", "Overflow connections.", self.overflow()),
+            ("db_pool_waiting", "gauge", "Checkouts waiting.", self.waiting),
+            ("db_pool_timeouts_total", "counter", "Checkout timeouts.", self.timeouts),
+        ):
+            lines += metric_header(name, kind, help_text)
+            lines.append(f"{name} {value}")
+        lines += metric_header(
+            "db_pool_wait_seconds", "histogram", "Time waiting for a free connection."
+        )
+        lines += render_histogram("db_pool_wait_seconds", self.wait_histogram)
+        return "\n".join(lines) + "\n"
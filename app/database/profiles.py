@@ -0,0 +1,109 @@
+import os
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import load_only, selectinload
+
+from app.models.follow import Follower  # noqa: F401 (нужен для настройки User)
+from app.models.like import Like
+from app.models.media import Media
+from app.models.media_variant import MediaVariant
+from app.models.tweet import Tweet
+from app.models.user import User
+from app.services.media_pipeline import FEED_VARIANT
+
+# В строгом режиме запрос, превысивший бюджет своего профиля, завершается ошибкой.
+QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "0") == "1"
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@dataclass(frozen=True)
+class LoaderProfile:
+    """
+    Именованный набор опций загрузки связей и допустимое число SQL-запросов
+    на весь HTTP-запрос (включая аутентификацию).
+    """
+
+    name: str
+    options: tuple[Any, ...]
+    max_queries: int
+
+
+@dataclass
+class QueryStats:
+    profile: LoaderProfile
+    count: int = 0
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in (
+        LoaderProfile(
+            name="principal",
+            options=(load_only(User.id, User.name),),
+            max_queries=7,
+        ),
+        LoaderProfile(
+            name="feed_item",
+            options=(
+                selectinload(Tweet.author).load_only(User.id, User.name),
+                selectinload(Tweet.media)
+                .load_only(Media.id, Media.file_path)
+                .selectinload(Media.variants.and_(MediaVariant.kind == FEED_VARIANT))
+                .load_only(MediaVariant.id, MediaVariant.file_path),
+                selectinload(Tweet.likes)
+                .load_only(Like.id, Like.user_id)
+                .selectinload(Like.user)
+                .load_only(User.id, User.name),
+            ),
+            max_queries=12,
+        ),
+        LoaderProfile(
+            name="profile",
+            options=(load_only(User.id, User.name),),
+            max_queries=4,
+        ),
+    )
+}
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "query_stats", default=None
+)
+
+
+def loader_profile(
+    name: str,
+) -> Callable[[], AsyncGenerator[LoaderProfile, None]]:
+    """
+    Зависимость, через которую маршрут выбирает профиль загрузки.
+    Подключается первым параметром, чтобы в бюджет попала и аутентификация.
+    """
+    profile = PROFILES[name]
+
+    async def dependency() -> AsyncGenerator[LoaderProfile, None]:
+        _current_stats.set(QueryStats(profile=profile))
+        try:
+            yield profile
+        finally:
+            _current_stats.set(None)
+
+    return dependency
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _current_stats.get()
+    if stats is None:
+        return
+    stats.count += 1
+    if QUERY_BUDGET_STRICT and stats.count > stats.profile.max_queries:
+        raise QueryBudgetExceeded(
+            f"Profile '{stats.profile.name}' allows {stats.profile.max_queries} "
+            f"queries per request, got {stats.count}: {statement}"
+        )
@@ -0,0 +1,266 @@
+"""
+Маршрутизация чтения между primary и репликами.
+
+Отставание реплик измеряется через строку-пульс: фоновая задача раз в
+DB_REPLICA_PROBE_INTERVAL секунд пишет на primary текущее время и читает его
+с каждой реплики. Если реплика видит пульс со временем t, на ней есть все,
+что было закоммичено на primary до t.
+
+Чтение пользователя идет на реплику, только если она видит пульс новее
+его последней записи (read-your-writes) и отстает не больше
+DB_REPLICA_MAX_LAG секунд; иначе - на primary. Время последней записи
+хранится в общем кэше, чтобы его учитывали все воркеры.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional, Sequence
+
+from sqlalchemy import Column, Float, Integer, MetaData, Table, event, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import ORMExecuteState, Session
+
+from app.services.cache import SharedCache
+
+# Реплика, отстающая сильнее, не получает запросов.
+DB_REPLICA_MAX_LAG = float(os.environ.get("DB_REPLICA_MAX_LAG", 5))
+DB_REPLICA_PROBE_INTERVAL = float(os.environ.get("DB_REPLICA_PROBE_INTERVAL", 1))
+# Для скольких последних писавших клиентов помним время записи.
+READ_YOUR_WRITES_MAX_KEYS = int(os.environ.get("READ_YOUR_WRITES_MAX_KEYS", 100000))
+
+_metadata = MetaData()
+heartbeat = Table(
+    "replication_heartbeat",
+    _metadata,
+    Column("id", Integer, primary_key=True),
+    Column("beat_at", Float, nullable=False),
+)
+
+_ROUTER_KEY = "replica_router"
+_WRITER_KEY = "replica_writer"
+_WROTE_KEY = "replica_wrote"
+_WRITTEN_AT_KEY = "replica_written_at"
+_LAST_WRITE_KEY = "replica_last_write"
+_PRIMARY_KEY = "replica_primary"
+_SYNCED_AT_KEY = "replica_synced_at"
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    """
+    Выдает сессии записи (всегда primary) и сессии чтения (самая свежая
+    подходящая реплика или primary). Время последней записи клиента
+    фиксируется после коммита сессии записи, в которой были изменения, и
+    до ответа клиенту сохраняется в общем кэше shared: следующий запрос
+    клиента может прийти в другой воркер.
+    """
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: Sequence[AsyncEngine] = (),
+        max_lag: float = DB_REPLICA_MAX_LAG,
+        max_keys: int = READ_YOUR_WRITES_MAX_KEYS,
+        clock: Callable[[], float] = time.time,
+        shared: Optional[SharedCache] = None,
+    ) -> None:
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.max_keys = max_keys
+        self.clock = clock
+        self.shared = shared
+        self._sessions = {
+            engine: async_sessionmaker(engine, expire_on_commit=False)
+            for engine in [primary, *self.replicas]
+        }
+        # Время последнего пульса, который видит реплика, по ее номеру.
+        self._synced_at: dict[int, float] = {}
+        self._writes: OrderedDict[str, float] = OrderedDict()
+        self._turn = itertools.count()
+
+    def record_write(self, writer: str) -> float:
+        written_at = self._writes[writer] = self.clock()
+        self._writes.move_to_end(writer)
+        while len(self._writes) > self.max_keys:
+            self._writes.popitem(last=False)
+        return written_at
+
+    @staticmethod
+    def _shared_key(client: str) -> str:
+        return "written_at:" + hashlib.sha256(client.encode()).hexdigest()
+
+    async def share_write(self, writer: str, written_at: float) -> None:
+        """
+        Сохраняет время записи клиента для других воркеров. Запись старше
+        max_lag уже видна на любой реплике, которая получает чтения.
+        """
+        if self.shared is not None:
+            ttl = max(self.max_lag, 1.0)
+            await self.shared.set(self._shared_key(writer), written_at, ttl)
+
+    async def last_write(self, reader: Optional[str]) -> float:
+        """
+        Время последней записи клиента в этом или другом воркере.
+        """
+        if not reader:
+            return -math.inf
+        written_at = self._writes.get(reader, -math.inf)
+        if self.shared is not None:
+            shared = await self.shared.get(self._shared_key(reader))
+            if shared is not None:
+                written_at = max(written_at, shared)
+        return written_at
+
+    def observe(self, replica: int, synced_at: float) -> None:
+        self._synced_at[replica] = synced_at
+
+    def choose(
+        self, reader: Optional[str], written_at: Optional[float] = None
+    ) -> Optional[int]:
+        """
+        Возвращает номер реплики для чтения или None, если читать нужно с primary.
+        written_at - время последней записи клиента, если оно уже известно.
+        """
+        now = self.clock()
+        if written_at is None:
+            written_at = self._writes.get(reader, -math.inf) if reader else -math.inf
+        fresh = [
+            replica
+            for replica, synced_at in self._synced_at.items()
+            if synced_at > written_at and now - synced_at <= self.max_lag
+        ]
+        if not fresh:
+            return None
+        return fresh[next(self._turn) % len(fresh)]
+
+    @asynccontextmanager
+    async def write_session(self, writer: Optional[str]) -> AsyncIterator[AsyncSession]:
+        async with self._sessions[self.primary]() as session:
+            session.info[_ROUTER_KEY] = self
+            session.info[_WRITER_KEY] = writer
+            try:
+                yield session
+            finally:
+                written_at = session.info.pop(_WRITTEN_AT_KEY, None)
+                if writer and written_at is not None:
+                    await self.share_write(writer, written_at)
+
+    @asynccontextmanager
+    async def read_session(self, reader: Optional[str]) -> AsyncIterator[AsyncSession]:
+        last_write = await self.last_write(reader)
+        replica = self.choose(reader, last_write)
+        engine = self.primary if replica is None else self.replicas[replica]
+        async with self._sessions[engine]() as session:
+            session.info[_PRIMARY_KEY] = self.primary
+            session.info[_LAST_WRITE_KEY] = last_write
+            if replica is not None:
+                session.info[_SYNCED_AT_KEY] = self._synced_at[replica]
+            yield session
+
+    async def heartbeat(self) -> None:
+        async with self.primary.begin() as conn:
+            beat = self.clock()
+            result = await conn.execute(
+                update(heartbeat).where(heartbeat.c.id == 1).values(beat_at=beat)
+            )
+            if result.rowcount == 0:
+                await conn.execute(heartbeat.insert().values(id=1, beat_at=beat))
+
+    async def probe(self) -> None:
+        for replica, engine in enumerate(self.replicas):
+            try:
+                async with engine.connect() as conn:
+                    synced_at = await conn.scalar(select(heartbeat.c.beat_at))
+            except SQLAlchemyError:
+                logger.exception("Replica %s is unavailable", engine.url)
+                self._synced_at.pop(replica, None)
+                continue
+            if synced_at is not None:
+                self.observe(replica, synced_at)
+
+    async def run(self, interval: float = DB_REPLICA_PROBE_INTERVAL) -> None:
+        """
+        Фоновая задача: пишет пульс на primary и измеряет отставание реплик.
+        """
+        while True:
+            try:
+                await self.heartbeat()
+            except SQLAlchemyError:
+                logger.exception("Failed to write replication heartbeat")
+            await self.probe()
+            await asyncio.sleep(interval)
+
+    def stats(self) -> list[dict]:
+        now = self.clock()
+        return [
+            {
+                "url": engine.url.render_as_string(hide_password=True),
+                "lag_seconds": (
+                    round(now - self._synced_at[replica], 3)
+                    if replica in self._synced_at
+                    else None
+                ),
+                "pool": engine.pool.stats() if hasattr(engine.pool, "stats") else None,
+            }
+            for replica, engine in enumerate(self.replicas)
+        ]
+
+
+def primary_bind(db: AsyncSession) -> dict:
+    """
+    Аргументы bind_arguments для запросов, которые должны читать primary
+    даже в сессии чтения: заполнение кэшей процесса.
+    """
+    primary: Optional[AsyncEngine] = db.info.get(_PRIMARY_KEY)
+    return {} if primary is None else {"bind": primary.sync_engine}
+
+
+def synced_at(db: AsyncSession) -> float:
+    """
+    Время, до которого данные сессии гарантированно полны: для реплики -
+    ее последний пульс, для primary - бесконечность.
+    """
+    return db.info.get(_SYNCED_AT_KEY, math.inf)
+
+
+def written_at(db: AsyncSession) -> float:
+    """
+    Время последней записи клиента сессии чтения в любом воркере.
+    """
+    return db.info.get(_LAST_WRITE_KEY, -math.inf)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_write(state: ORMExecuteState) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info[_WROTE_KEY] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_flush(session: Session, flush_context) -> None:
+    session.info[_WROTE_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _record_write(session: Session) -> None:
+    if not session.info.pop(_WROTE_KEY, False):
+        return
+    router: Optional[ReplicaRouter] = session.info.get(_ROUTER_KEY)
+    writer: Optional[str] = session.info.get(_WRITER_KEY)
+    if router is not None and writer:
+        session.info[_WRITTEN_AT_KEY] = router.record_write(writer)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_write(session: Session) -> None:
+    session.info.pop(_WROTE_KEY, None)
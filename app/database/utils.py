@@ -6,6 +6,11 @@ from app.models.like import Like
 from app.models.media import Media
 from app.models.tweet import Tweet
 from app.models.user import User
+from app.services.counters import reconcile_follow_counts, reconcile_like_counts
+from app.services.ranking import rescore_all
+from app.services.search import rebuild_index
+from app.services.tags import rebuild_tags
+from app.services.timeline import rebuild_all_timelines
 
 
 async def populate_database(db: AsyncSession):
@@ -23,7 +28,7 @@ async def populate_database(db: AsyncSession):
 
         tweet1 = Tweet(content="Hello, world!", author_id=user1.id)
         tweet2 = Tweet(content="This is my first tweet!", author_id=user2.id)
-        tweet3 = Tweet(content="Python is awesome!", author_id=user3.id)
+        tweet3 = Tweet(content="Python is awesome! #python", author_id=user3.id)
         tweet4 = Tweet(content="And Me again!", author_id=user4.id)
 
         db.add_all([tweet1, tweet2, tweet3, tweet4])
@@ -53,6 +58,14 @@ async def populate_database(db: AsyncSession):
         follow5 = Follower(follower_id=user1.id, followed_id=user4.id)
 
         db.add_all([follow1, follow2, follow3, follow4, follow5])
+        await db.flush()
+
+        await reconcile_like_counts(db)
+        await reconcile_follow_counts(db)
+        await rebuild_all_timelines(db)
+        await rebuild_index(db)
+        await rebuild_tags(db)
+        await rescore_all(db)
         await db.commit()
 
         print("Database populated successfully!")
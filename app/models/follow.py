@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.database.database import Base
@@ -6,6 +6,9 @@ from app.database.database import Base
 
 class Follower(Base):
     __tablename__ = "followers"
+    __table_args__ = (
+        Index("ix_followers_followed_id_follower_id", "followed_id", "follower_id"),
+    )
 
     follower_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
     followed_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
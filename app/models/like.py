@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database.database import Base
@@ -6,16 +6,20 @@ from app.database.database import Base
 
 class Like(Base):
     __tablename__ = "likes"
+    __table_args__ = (
+        UniqueConstraint("user_id", "tweet_id", name="uq_likes_user_id_tweet_id"),
+        Index("ix_likes_tweet_id", "tweet_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     tweet_id: Mapped[int] = mapped_column(ForeignKey("tweets.id"))
 
     user: Mapped["User"] = relationship(  # type: ignore # noqa
-        "User", back_populates="likes", lazy="selectin"
+        "User", back_populates="likes", lazy="raise"
     )
     tweet: Mapped["Tweet"] = relationship(  # type: ignore # noqa
-        "Tweet", back_populates="likes", lazy="selectin"
+        "Tweet", back_populates="likes", lazy="raise"
     )
 
     def __repr__(self):
@@ -9,10 +9,20 @@ class Media(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     file_path: Mapped[str] = mapped_column(String)
-    tweet_id: Mapped[int] = mapped_column(ForeignKey("tweets.id"), nullable=True)
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=True, index=True)
+    tweet_id: Mapped[int] = mapped_column(
+        ForeignKey("tweets.id"), nullable=True, index=True
+    )
+    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=True)
 
     tweet: Mapped["Tweet"] = relationship(  # type: ignore # noqa
-        "Tweet", back_populates="media", lazy="selectin"
+        "Tweet", back_populates="media", lazy="raise"
+    )
+    variants: Mapped[list["MediaVariant"]] = relationship(  # type: ignore # noqa
+        "MediaVariant",
+        back_populates="media",
+        lazy="raise",
+        cascade="all, delete-orphan",
     )
 
     def __repr__(self):
@@ -0,0 +1,23 @@
+from sqlalchemy import ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from app.database.database import Base
+
+
+class MediaVariant(Base):
+    __tablename__ = "media_variants"
+    __table_args__ = (UniqueConstraint("media_id", "kind"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    media_id: Mapped[int] = mapped_column(ForeignKey("media.id"))
+    kind: Mapped[str] = mapped_column(String(16))
+    file_path: Mapped[str] = mapped_column(String)
+    width: Mapped[int] = mapped_column(Integer)
+    height: Mapped[int] = mapped_column(Integer)
+
+    media: Mapped["Media"] = relationship(  # type: ignore # noqa
+        "Media", back_populates="variants", lazy="raise"
+    )
+
+    def __repr__(self):
+        return f"<MediaVariant(media_id={self.media_id}, kind={self.kind})>"
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database.database import Base
+
+# Совпадает с ограничением длины в app.services.tags.
+TAG_MAX_LENGTH = 100
+
+
+class TweetTag(Base):
+    """
+    Инвертированный индекс хэштегов: тег -> id твитов.
+    """
+
+    __tablename__ = "tweet_tags"
+    __table_args__ = (Index("ix_tweet_tags_tweet_id", "tweet_id"),)
+
+    tag: Mapped[str] = mapped_column(String(TAG_MAX_LENGTH), primary_key=True)
+    tweet_id: Mapped[int] = mapped_column(ForeignKey("tweets.id"), primary_key=True)
+
+    def __repr__(self):
+        return f"<TweetTag(tag={self.tag}, tweet_id={self.tweet_id})>"
+
+
+class TweetMention(Base):
+    """
+    Упоминания @имя в твитах: имя -> id твитов.
+    """
+
+    __tablename__ = "tweet_mentions"
+    __table_args__ = (Index("ix_tweet_mentions_tweet_id", "tweet_id"),)
+
+    handle: Mapped[str] = mapped_column(String(TAG_MAX_LENGTH), primary_key=True)
+    tweet_id: Mapped[int] = mapped_column(ForeignKey("tweets.id"), primary_key=True)
+
+    def __repr__(self):
+        return f"<TweetMention(handle={self.handle}, tweet_id={self.tweet_id})>"
+
+
+class TrendingCheckpoint(Base):
+    """
+    Снимок счетчиков трендов (одна строка), чтобы после перезапуска
+    не пересчитывать окно по твитам.
+    """
+
+    __tablename__ = "trending_checkpoints"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    saved_at: Mapped[datetime] = mapped_column(DateTime)
+    last_tweet_id: Mapped[int] = mapped_column(Integer)
+    buckets: Mapped[str] = mapped_column(Text)
@@ -0,0 +1,16 @@
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database.database import Base
+
+
+class TimelineEntry(Base):
+    __tablename__ = "timelines"
+    # Удаление твита убирает его из всех лент.
+    __table_args__ = (Index("ix_timelines_tweet_id", "tweet_id"),)
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    tweet_id: Mapped[int] = mapped_column(ForeignKey("tweets.id"), primary_key=True)
+
+    def __repr__(self):
+        return f"<TimelineEntry(user_id={self.user_id}, tweet_id={self.tweet_id})>"
@@ -1,6 +1,15 @@
 from datetime import datetime
 
-from sqlalchemy import DateTime, ForeignKey, String
+from sqlalchemy import (
+    DDL,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    event,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database.database import Base
@@ -8,21 +17,65 @@ from app.database.database import Base
 
 class Tweet(Base):
     __tablename__ = "tweets"
+    __table_args__ = (
+        Index("ix_tweets_like_count_id", "like_count", "id"),
+        Index("ix_tweets_author_id_created_at", "author_id", "created_at"),
+        Index("ix_tweets_hot_score_id", "hot_score", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     content: Mapped[str] = mapped_column(String)
     author_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    like_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # Оценка для ленты order=hot, ведет app.services.ranking.
+    hot_score: Mapped[float] = mapped_column(Float, default=0, server_default="0")
 
     author: Mapped["User"] = relationship(  # type: ignore # noqa
-        "User", back_populates="tweets", lazy="selectin"
+        "User", back_populates="tweets", lazy="raise"
     )
     media: Mapped[list["Media"]] = relationship(  # type: ignore # noqa
-        "Media", back_populates="tweet", lazy="selectin", cascade="all, delete-orphan"
+        "Media", back_populates="tweet", lazy="raise", cascade="all, delete-orphan"
     )
     likes: Mapped[list["Like"]] = relationship(  # type: ignore # noqa
-        "Like", back_populates="tweet", lazy="selectin", cascade="all, delete-orphan"
+        "Like", back_populates="tweet", lazy="raise", cascade="all, delete-orphan"
     )
 
     def __repr__(self):
         return f"<Tweet(id={self.id}, author_id={self.author_id})>"
+
+
+# Полнотекстовый поиск по content. Postgres: генерируемая колонка tsvector
+# (обновляется вместе со строкой) и индекс GIN; конфигурация simple - без
+# стемминга, для твитов на любом языке. SQLite: таблица FTS5 с rowid = id
+# твита, которую ведет app.services.search.
+TS_CONFIG = "simple"
+FTS_TABLE = "tweets_fts"
+
+SEARCH_DDL = {
+    "postgresql": [
+        DDL(
+            "ALTER TABLE tweets ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{TS_CONFIG}', content)) STORED"
+        ),
+        DDL(
+            "CREATE INDEX IF NOT EXISTS ix_tweets_search_vector "
+            "ON tweets USING GIN (search_vector)"
+        ),
+    ],
+    "sqlite": [
+        DDL(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            "USING fts5(content, tokenize='unicode61 remove_diacritics 2')"
+        ),
+    ],
+}
+
+for _dialect, _statements in SEARCH_DDL.items():
+    for _ddl in _statements:
+        event.listen(Tweet.__table__, "after_create", _ddl.execute_if(dialect=_dialect))
+event.listen(
+    Tweet.__table__,
+    "after_drop",
+    DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}").execute_if(dialect="sqlite"),
+)
@@ -1,4 +1,6 @@
-from sqlalchemy import String
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database.database import Base
@@ -10,12 +12,16 @@ class User(Base):
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     api_key: Mapped[str] = mapped_column(String, unique=True, index=True)
     name: Mapped[str] = mapped_column(String)
+    followers_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    following_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # Когда лента пользователя была собрана; до этого ее собирает первое чтение.
+    timeline_built_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
 
     tweets: Mapped[list["Tweet"]] = relationship(  # type: ignore # noqa
-        "Tweet", back_populates="author", lazy="selectin", cascade="all, delete-orphan"
+        "Tweet", back_populates="author", lazy="raise", cascade="all, delete-orphan"
     )
     likes: Mapped[list["Like"]] = relationship(  # type: ignore # noqa
-        "Like", back_populates="user", lazy="selectin", cascade="all, delete-orphan"
+        "Like", back_populates="user", lazy="raise", cascade="all, delete-orphan"
     )
     following: Mapped[list["User"]] = relationship(
         "User",
@@ -23,7 +29,7 @@ class User(Base):
         primaryjoin="User.id == Follower.follower_id",
         secondaryjoin="User.id == Follower.followed_id",
         back_populates="followers",
-        lazy="selectin",
+        lazy="raise",
     )
     followers: Mapped[list["User"]] = relationship(
         "User",
@@ -31,7 +37,7 @@ class User(Base):
         primaryjoin="User.id == Follower.followed_id",
         secondaryjoin="User.id == Follower.follower_id",
         back_populates="following",
-        lazy="selectin",
+        lazy="raise",
     )
 
     def __repr__(self):
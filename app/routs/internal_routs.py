@@ -0,0 +1,64 @@
+import os
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.database.database import engine, replica_router
+from app.services.admission import admission_controller
+from app.services.cache import shared_cache
+from app.services.metrics import metrics_registry
+
+# Токен служебных маршрутов (Authorization: Bearer <token>). Пустой токен
+# отключает маршруты: порт приложения может быть доступен не только nginx.
+INTERNAL_TOKEN = os.environ.get("INTERNAL_TOKEN", "")
+
+
+def require_internal_token(
+    authorization: Optional[str] = Header(None),  # noqa: B008
+) -> None:
+    """
+    Пропускает запрос только с токеном INTERNAL_TOKEN.
+    """
+    if not INTERNAL_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(
+        token.encode(), INTERNAL_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid internal token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+router = APIRouter(tags=["Internal"], dependencies=[Depends(require_internal_token)])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/internal/pool", response_model=dict)
+async def get_pool_stats():
+    """
+    Возвращает текущее состояние пула соединений с базой данных,
+    гистограмму ожидания соединения, отставание реплик, счетчики
+    общего кэша и состояние допуска запросов.
+    """
+    stats = engine.pool.stats()  # type: ignore[attr-defined]
+    stats["max_connections"] = stats["size"] + stats["max_overflow"]
+    stats["replicas"] = replica_router.stats()
+    stats["cache"] = shared_cache.stats()
+    stats["admission"] = admission_controller.stats()
+    return stats
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Возвращает метрики запросов по маршрутам и пула соединений
+    в текстовом формате Prometheus.
+    """
+    content = metrics_registry.render() + engine.pool.render_metrics()  # type: ignore
+    return PlainTextResponse(content, media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,41 +1,112 @@
-import os
+from typing import Callable, Coroutine
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.routing import APIRoute
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from starlette.responses import Response
+from starlette.types import Message, Receive
 
 from app.database.database import get_db
 from app.models.media import Media
 from app.schemas.media_schemas import MediaUploadResponse
+from app.services.auth import Principal, get_current_user_from_api_key
+from app.services.media_pipeline import media_pipeline
+from app.services.media_storage import (
+    InvalidUpload,
+    MediaTooLarge,
+    save_upload,
+    upload_limit,
+)
 
-router = APIRouter(prefix="/api/medias", tags=["Media"])
 
+def _limited_receive(receive: Receive, limit: int) -> Receive:
+    received = 0
 
-@router.post("/", response_model=MediaUploadResponse)
+    async def limited() -> Message:
+        nonlocal received
+        message = await receive()
+        received += len(message.get("body", b""))
+        if received > limit:
+            raise HTTPException(status_code=413, detail="Request body is too large")
+        return message
+
+    return limited
+
+
+class UploadRoute(APIRoute):
+    """
+    Маршрут загрузки: тело сверх upload_limit() отклоняется до разбора
+    формы - сразу по Content-Length, а без него (chunked) - как только
+    прочитанная часть тела превысит лимит.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[None, None, Response]]:
+        handler = super().get_route_handler()
+
+        async def limited_handler(request: Request) -> Response:
+            limit = upload_limit()
+            content_length = request.headers.get("content-length", "")
+            if content_length.isdigit() and int(content_length) > limit:
+                raise HTTPException(status_code=413, detail="Request body is too large")
+            return await handler(
+                Request(request.scope, _limited_receive(request.receive, limit))
+            )
+
+        return limited_handler
+
+
+router = APIRouter(prefix="/api/medias", tags=["Media"], route_class=UploadRoute)
+
+
+# Форма читается потоком в save_upload, поэтому в схеме OpenAPI
+# поле file описано вручную.
+UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+                "required": ["file"],
+            }
+        }
+    },
+}
+
+
+@router.post(
+    "/",
+    response_model=MediaUploadResponse,
+    openapi_extra={"requestBody": UPLOAD_REQUEST_BODY},
+)
 async def upload_media(
-    file: UploadFile = File(...),  # noqa: B008
+    request: Request,
     db: AsyncSession = Depends(get_db),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
-    Загружает медиафайл и возвращает его ID.
+    Загружает медиафайл из поля file формы и возвращает его ID.
     """
     try:
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="Filename is required")
-
-        MEDIA_ROOT = "/media"
-        os.makedirs(MEDIA_ROOT, exist_ok=True)
-        file_path = os.path.join(MEDIA_ROOT, file.filename)
-
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-
-        new_media = Media(file_path=f"/media/{file.filename}")
-        db.add(new_media)
-        await db.commit()
+        async with save_upload(db, request) as stored:
+            new_media = Media(
+                file_path=stored.file_path,
+                content_hash=stored.content_hash,
+                owner_id=current_user.id,
+            )
+            db.add(new_media)
+            await db.commit()
         await db.refresh(new_media)
+        media_pipeline.submit(
+            new_media.id, stored, async_sessionmaker(db.bind), current_user.id
+        )
 
         return {"result": True, "media_id": new_media.id}
+    except MediaTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except SQLAlchemyError as e:
         await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
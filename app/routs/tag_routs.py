@@ -0,0 +1,86 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.database import get_read_db
+from app.database.profiles import LoaderProfile, loader_profile
+from app.models.tweet import Tweet
+from app.schemas.tag_schemas import TrendingResponse
+from app.schemas.tweet_schemas import FeedResponse
+from app.services.auth import Principal, get_current_user_from_api_key
+from app.services.like_buffer import like_buffer
+from app.services.pagination import decode_cursor, encode_cursor
+from app.services.responses import TrustedJSONResponse, feed_item
+from app.services.tags import normalize_tag, tagged_tweet_ids, top_trending
+
+TAG_PAGE_SIZE = int(os.environ.get("TAG_PAGE_SIZE", 20))
+TAG_MAX_PAGE_SIZE = int(os.environ.get("TAG_MAX_PAGE_SIZE", 200))
+TRENDING_SIZE = int(os.environ.get("TRENDING_SIZE", 10))
+TRENDING_MAX_SIZE = int(os.environ.get("TRENDING_MAX_SIZE", 100))
+
+router = APIRouter(prefix="/api/tags", tags=["Tags"])
+
+
+@router.get("/trending", response_model=TrendingResponse)
+async def get_trending(
+    limit: int = Query(TRENDING_SIZE, ge=1, le=TRENDING_MAX_SIZE),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
+):
+    """
+    Возвращает самые частые хэштеги за скользящее окно. Счетчики ведутся
+    при публикации и удалении твитов в общем кэше воркеров (или в памяти
+    единственного воркера), твиты не читаются.
+    """
+    tags = await top_trending(limit)
+    return TrustedJSONResponse(
+        {
+            "result": True,
+            "tags": [{"tag": tag, "count": count} for tag, count in tags],
+        }
+    )
+
+
+@router.get("/{tag}", response_model=FeedResponse)
+async def get_tagged_tweets(
+    tag: str,
+    loader: LoaderProfile = Depends(loader_profile("feed_item")),  # noqa: B008
+    limit: int = Query(TAG_PAGE_SIZE, ge=1, le=TAG_MAX_PAGE_SIZE),  # noqa: B008
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
+):
+    """
+    Возвращает твиты с хэштегом от новых к старым. Пагинация курсорная:
+    cursor из ответа указывает на последний показанный твит.
+    """
+    try:
+        before_id = decode_cursor(cursor, int)[0] if cursor else None
+        tweet_ids = await tagged_tweet_ids(db, normalize_tag(tag), limit + 1, before_id)
+        next_cursor = None
+        if len(tweet_ids) > limit:
+            tweet_ids = tweet_ids[:limit]
+            next_cursor = encode_cursor(tweet_ids[-1])
+
+        tweets: dict[int, Tweet] = {}
+        if tweet_ids:
+            result = await db.execute(
+                select(Tweet).options(*loader.options).filter(Tweet.id.in_(tweet_ids))
+            )
+            tweets = {tweet.id: tweet for tweet in result.scalars()}
+
+        items = [
+            feed_item(tweets[tweet_id]) for tweet_id in tweet_ids if tweet_id in tweets
+        ]
+        like_buffer.overlay(current_user.id, current_user.name, items)
+        return TrustedJSONResponse(
+            {"result": True, "tweets": items, "next_cursor": next_cursor}
+        )
+
+    except HTTPException as http_exc:
+        raise http_exc
+
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,23 +1,46 @@
-from typing import Optional
+import os
+from typing import Literal, Optional, Sequence
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func, select
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from sqlalchemy import and_, delete, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import InstrumentedAttribute
 
-from app.database.database import get_db
-from app.models.follow import Follower
+from app.database.database import get_db, get_read_db
+from app.database.profiles import LoaderProfile, loader_profile
 from app.models.like import Like
 from app.models.media import Media
+from app.models.media_variant import MediaVariant
 from app.models.tweet import Tweet
-from app.models.user import User
 from app.schemas.tweet_schemas import (
     FeedResponse,
     LikeResponse,
+    TweetBatchCreate,
+    TweetBatchResponse,
     TweetCreate,
     TweetResponse,
 )
-from app.services.auth import get_current_user_from_api_key
+from app.services import media_storage, search, tags, timeline
+from app.services.auth import Principal, get_current_user_from_api_key
+from app.services.cache import shared_cache
+from app.services.like_buffer import like_buffer
+from app.services.likes import add_like, remove_like
+from app.services.pagination import decode_cursor, encode_cursor
+from app.services.responses import TrustedJSONResponse, feed_item
+from app.services.tweets import create_tweets
+from app.services.versions import (
+    etag_headers,
+    feed_etag,
+    is_not_modified,
+    not_modified_response,
+    touch_authors,
+)
+
+FEED_PAGE_SIZE = int(os.environ.get("FEED_PAGE_SIZE", 50))
+FEED_MAX_PAGE_SIZE = int(os.environ.get("FEED_MAX_PAGE_SIZE", 200))
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", 20))
+# Страницы ленты хранятся в общем кэше под своим ETag.
+FEED_CACHE_TTL = float(os.environ.get("FEED_CACHE_TTL", 30))
 
 router = APIRouter(prefix="/api/tweets", tags=["Tweets"])
 
@@ -26,49 +49,84 @@ router = APIRouter(prefix="/api/tweets", tags=["Tweets"])
 async def post_tweet(
     tweet_data: TweetCreate,
     db: AsyncSession = Depends(get_db),  # noqa: B008
-    current_user: User = Depends(get_current_user_from_api_key),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
     Создает новый твит.
     """
     try:
-        new_tweet = Tweet(content=tweet_data.tweet_data, author_id=current_user.id)
-        db.add(new_tweet)
-        await db.flush()
-        if tweet_data.tweet_media_ids:
-            for media_id in tweet_data.tweet_media_ids:
-                media_result = await db.execute(
-                    select(Media).filter(Media.id == media_id)
-                )
-                media: Optional[Media] = media_result.scalars().first()
-                if media:
-                    media.tweet_id = new_tweet.id
-        tweet_id = new_tweet.id
+        (tweet_id,) = await create_tweets(db, current_user.id, [tweet_data])
         await db.commit()
         return {"result": True, "tweet_id": tweet_id}
+    except HTTPException as http_exc:
+        await db.rollback()
+        raise http_exc
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=401, detail=str(e))
 
 
+@router.post("/batch", response_model=TweetBatchResponse)
+async def post_tweets_batch(
+    batch: TweetBatchCreate,
+    db: AsyncSession = Depends(get_db),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
+):
+    """
+    Создает несколько твитов с медиа в одной транзакции (импорт, отложенные посты).
+    """
+    try:
+        tweet_ids = await create_tweets(db, current_user.id, batch.tweets)
+        await db.commit()
+        return {"result": True, "tweet_ids": tweet_ids}
+    except HTTPException as http_exc:
+        await db.rollback()
+        raise http_exc
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.delete("/{tweet_id}", response_model=dict)
 async def delete_tweet(
     tweet_id: int,
     db: AsyncSession = Depends(get_db),  # noqa: B008
-    current_user: User = Depends(get_current_user_from_api_key),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
     Удаляет твит, если он принадлежит текущему пользователю.
     """
     try:
-        tweet_result = await db.execute(select(Tweet).filter(Tweet.id == tweet_id))
-        tweet: Optional[Tweet] = tweet_result.scalars().first()
-        if not tweet or tweet.author_id != current_user.id:
+        tweet = (
+            await db.execute(
+                select(Tweet.author_id, Tweet.created_at).filter(Tweet.id == tweet_id)
+            )
+        ).one_or_none()
+        if tweet is None or tweet.author_id != current_user.id:
             raise HTTPException(
                 status_code=403, detail="You can only delete your own tweets"
             )
-        await db.delete(tweet)
+        await timeline.remove_tweet(db, tweet_id)
+        await search.unindex_tweets(db, [tweet_id])
+        await tags.unindex_tags(db, tweet_id, tweet.created_at)
+        await db.execute(delete(Like).where(Like.tweet_id == tweet_id))
+        await db.execute(
+            delete(MediaVariant).where(
+                MediaVariant.media_id.in_(
+                    select(Media.id).where(Media.tweet_id == tweet_id)
+                )
+            )
+        )
+        released_media = await db.execute(
+            delete(Media)
+            .where(Media.tweet_id == tweet_id)
+            .returning(Media.content_hash, Media.file_path)
+        )
+        released = [tuple(row) for row in released_media.all()]
+        await db.execute(delete(Tweet).where(Tweet.id == tweet_id))
+        touch_authors(db, tweet.author_id)
         await db.commit()
+        await media_storage.release_files(db, released)
         return {"result": True}
 
     except HTTPException as http_exc:
@@ -83,30 +141,23 @@ async def delete_tweet(
 async def like_tweet(
     tweet_id: int,
     db: AsyncSession = Depends(get_db),  # noqa: B008
-    current_user: User = Depends(get_current_user_from_api_key),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
-    Добавляет лайк к твиту.
+    Добавляет лайк к твиту. Повторный лайк ничего не меняет (changed=false).
+    В режиме отложенной записи лайк подтверждается из буфера воркера.
     """
+    if like_buffer.enabled:
+        return {
+            "result": True,
+            "changed": await like_buffer.add(db, current_user.id, tweet_id, True),
+        }
     try:
-        tweet_result = await db.execute(select(Tweet).filter(Tweet.id == tweet_id))
-        tweet: Optional[Tweet] = tweet_result.scalars().first()
-        if not tweet:
+        changed = await add_like(db, current_user.id, tweet_id)
+        if changed is None:
             raise HTTPException(status_code=404, detail="Tweet not found")
-
-        existing_like_result = await db.execute(
-            select(Like).filter(
-                Like.tweet_id == tweet_id, Like.user_id == current_user.id
-            )
-        )
-        existing_like: Optional[Like] = existing_like_result.scalars().first()
-        if existing_like:
-            raise HTTPException(status_code=400, detail="You already liked this tweet")
-
-        new_like = Like(user_id=current_user.id, tweet_id=tweet_id)
-        db.add(new_like)
         await db.commit()
-        return {"result": True}
+        return {"result": True, "changed": changed}
 
     except HTTPException as http_exc:
         raise http_exc
@@ -120,78 +171,189 @@ async def like_tweet(
 async def unlike_tweet(
     tweet_id: int,
     db: AsyncSession = Depends(get_db),  # noqa: B008
-    current_user: User = Depends(get_current_user_from_api_key),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
-    Удаляет лайк с твита.
+    Удаляет лайк с твита. Снятие отсутствующего лайка ничего не меняет (changed=false).
     """
+    if like_buffer.enabled:
+        return {
+            "result": True,
+            "changed": await like_buffer.add(db, current_user.id, tweet_id, False),
+        }
     try:
-        like_result = await db.execute(
-            select(Like).filter(
-                Like.tweet_id == tweet_id, Like.user_id == current_user.id
-            )
-        )
-        like: Optional[Like] = like_result.scalars().first()
-        if not like:
-            raise HTTPException(status_code=404, detail="Like not found")
-
-        await db.delete(like)
+        changed = await remove_like(db, current_user.id, tweet_id)
         await db.commit()
-        return {"result": True}
+        return {"result": True, "changed": changed}
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
+async def _feed_page(
+    db: AsyncSession,
+    loader: LoaderProfile,
+    user_id: int,
+    limit: int,
+    cursor: Optional[str],
+    order: str,
+) -> dict:
+    """
+    Читает страницу ленты из базы: элементы без буферизованных лайков
+    и курсор следующей страницы.
+    """
+    if order == "recent":
+        before_id = decode_cursor(cursor, int)[0] if cursor else None
+        feed_condition = await timeline.feed_condition(db, user_id, before_id=before_id)
+        sort_keys = [Tweet.id.desc()]
+    else:
+        rank: InstrumentedAttribute = (
+            Tweet.hot_score if order == "hot" else Tweet.like_count
+        )
+        feed_condition = await timeline.feed_condition(db, user_id)
+        sort_keys = [rank.desc(), Tweet.id.desc()]
+        if cursor:
+            last_rank, last_id = decode_cursor(cursor, float, int)
+            feed_condition = and_(
+                feed_condition,
+                or_(
+                    rank < last_rank,
+                    and_(rank == last_rank, Tweet.id < last_id),
+                ),
+            )
+
+    tweets_query = (
+        select(Tweet)
+        .options(*loader.options)
+        .filter(feed_condition)
+        .order_by(*sort_keys)
+        .limit(limit + 1)
+    )
+
+    tweets_result = await db.execute(tweets_query)
+    tweets: Sequence[Tweet] = tweets_result.scalars().all()
+
+    next_cursor = None
+    if len(tweets) > limit:
+        tweets = tweets[:limit]
+        last_tweet = tweets[-1]
+        if order == "recent":
+            next_cursor = encode_cursor(last_tweet.id)
+        elif order == "hot":
+            next_cursor = encode_cursor(last_tweet.hot_score, last_tweet.id)
+        else:
+            next_cursor = encode_cursor(last_tweet.like_count, last_tweet.id)
+
+    return {
+        "tweets": [feed_item(tweet) for tweet in tweets],
+        "next_cursor": next_cursor,
+    }
+
+
 @router.get("/", response_model=FeedResponse)
 async def get_feed(
-    db: AsyncSession = Depends(get_db),  # noqa: B008
-    current_user: User = Depends(get_current_user_from_api_key),  # noqa: B008
+    loader: LoaderProfile = Depends(loader_profile("feed_item")),  # noqa: B008
+    limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),  # noqa: B008
+    cursor: Optional[str] = None,
+    order: Literal["likes", "recent", "hot"] = "likes",
+    if_none_match: Optional[str] = Header(None),  # noqa: B008
+    db: AsyncSession = Depends(get_read_db),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
     Возвращает ленту твитов от пользователей, на которых подписан текущий пользователь,
-    отсортированную по количеству лайков (включая твиты без лайков).
+    отсортированную по количеству лайков (включая твиты без лайков), по времени
+    или по "горячести" - лайкам с затуханием по возрасту, посчитанным заранее.
+    Порядки likes и hot ранжируют только окно ленты - FEED_WINDOW_SIZE
+    последних твитов (сортировкой окна, а не по индексу): более старые твиты
+    в них не попадают, сколько бы лайков у них ни было. Порядок recent
+    листает ленту до конца.
+    Пагинация курсорная: cursor из ответа указывает на последний показанный твит.
+    Ответ помечается ETag; при совпадении If-None-Match возвращается 304
+    без запроса ленты, иначе страница берется из общего кэша под этим ETag.
     """
     try:
-        following = await db.execute(
-            select(Follower.followed_id).filter(Follower.follower_id == current_user.id)
+        etag = await feed_etag(
+            db,
+            current_user.id,
+            order,
+            limit,
+            cursor,
+            like_buffer.user_mark(current_user.id),
         )
-        following_ids = [row[0] for row in following.fetchall()]
-        following_ids.append(current_user.id)
+        if etag is not None and is_not_modified(if_none_match, etag):
+            return not_modified_response(etag)
 
-        tweets_query = (
-            select(
-                Tweet,
-                func.count(Like.id).label("like_count"),
+        if etag is None:
+            page = await _feed_page(db, loader, current_user.id, limit, cursor, order)
+        else:
+            page = await shared_cache.get_or_load(
+                f"feed:{etag}",
+                lambda: _feed_page(db, loader, current_user.id, limit, cursor, order),
+                FEED_CACHE_TTL,
             )
-            .outerjoin(Tweet.likes)
-            .options(
-                selectinload(Tweet.author),
-                selectinload(Tweet.media),
-                selectinload(Tweet.likes).selectinload(Like.user),
-            )
-            # .filter(Tweet.author_id.in_(following_ids))
-            .group_by(Tweet.id)
-            .order_by(func.count(Like.id).desc())
+
+        items = page["tweets"]
+        like_buffer.overlay(current_user.id, current_user.name, items)
+        return TrustedJSONResponse(
+            {"result": True, "tweets": items, "next_cursor": page["next_cursor"]},
+            headers=etag_headers(etag),
         )
 
-        tweets_result = await db.execute(tweets_query)
-        tweets_with_likes = tweets_result.all()
-
-        feed = [
-            {
-                "id": tweet.id,
-                "content": tweet.content,
-                "attachments": [media.file_path for media in tweet.media],
-                "author": {"id": tweet.author.id, "name": tweet.author.name},
-                "likes": [
-                    {"user_id": like.user_id, "name": like.user.name}
-                    for like in tweet.likes
-                ],
-            }
-            for tweet, _ in tweets_with_likes
+    except HTTPException as http_exc:
+        raise http_exc
+
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/search", response_model=FeedResponse)
+async def search_tweets(
+    loader: LoaderProfile = Depends(loader_profile("feed_item")),  # noqa: B008
+    q: str = Query(..., min_length=1, max_length=200),  # noqa: B008
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),  # noqa: B008
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
+):
+    """
+    Ищет твиты, содержащие все слова запроса, по полнотекстовому индексу.
+    Результаты упорядочены по релевантности; пагинация курсорная.
+    """
+    try:
+        terms = search.search_terms(q)
+        after = None
+        if cursor:
+            last_score, last_id = decode_cursor(cursor, float, int)
+            after = (float(last_score), int(last_id))
+
+        found = (
+            await search.search_tweet_ids(db, terms, limit + 1, after) if terms else []
+        )
+        next_cursor = None
+        if len(found) > limit:
+            found = found[:limit]
+            next_cursor = encode_cursor(found[-1][1], found[-1][0])
+
+        tweets: dict[int, Tweet] = {}
+        if found:
+            result = await db.execute(
+                select(Tweet)
+                .options(*loader.options)
+                .filter(Tweet.id.in_([tweet_id for tweet_id, _ in found]))
+            )
+            tweets = {tweet.id: tweet for tweet in result.scalars()}
+
+        items = [
+            feed_item(tweets[tweet_id]) for tweet_id, _ in found if tweet_id in tweets
         ]
+        like_buffer.overlay(current_user.id, current_user.name, items)
+        return TrustedJSONResponse(
+            {"result": True, "tweets": items, "next_cursor": next_cursor}
+        )
+
+    except HTTPException as http_exc:
+        raise http_exc
 
-        return {"result": True, "tweets": feed}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,56 +1,114 @@
-from typing import Optional, Sequence
+import os
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.database import get_db
+from app.database.database import get_db, get_read_db
+from app.database.profiles import LoaderProfile, loader_profile
 from app.models.follow import Follower
 from app.models.user import User
-from app.schemas.user_schemas import FollowResponse, UserResponse
-from app.services.auth import get_current_user_from_api_key
+from app.schemas.user_schemas import FollowResponse, UserListResponse, UserResponse
+from app.services import timeline
+from app.services.auth import Principal, get_current_user_from_api_key
+from app.services.cache import shared_cache
+from app.services.counters import increment_follow_counts
+from app.services.follow_graph import follow_graph
+from app.services.follows import PROFILE_PREVIEW_SIZE, Direction, follow_page
+from app.services.pagination import decode_cursor, encode_cursor
+from app.services.responses import TrustedJSONResponse
+from app.services.versions import (
+    etag_headers,
+    is_not_modified,
+    not_modified_response,
+    profile_etag,
+    touch_users,
+)
+
+FOLLOW_PAGE_SIZE = int(os.environ.get("FOLLOW_PAGE_SIZE", 100))
+FOLLOW_MAX_PAGE_SIZE = int(os.environ.get("FOLLOW_MAX_PAGE_SIZE", 1000))
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", 60))
 
 router = APIRouter(prefix="/api/users", tags=["Users"])
 
 
+async def build_profile(db: AsyncSession, user_id: int) -> Optional[dict]:
+    """
+    Собирает профиль: заголовок со счетчиками читается одним запросом,
+    подписчики и подписки - ограниченными первыми страницами.
+    Полные списки отдают /followers и /following.
+    """
+    header = (
+        await db.execute(
+            select(
+                User.id, User.name, User.followers_count, User.following_count
+            ).where(User.id == user_id)
+        )
+    ).one_or_none()
+    if header is None:
+        return None
+
+    return {
+        "id": header.id,
+        "name": header.name,
+        "followers_count": header.followers_count,
+        "following_count": header.following_count,
+        "following": await follow_page(db, user_id, "following", PROFILE_PREVIEW_SIZE),
+        "followers": await follow_page(db, user_id, "followers", PROFILE_PREVIEW_SIZE),
+    }
+
+
+async def cached_profile(
+    db: AsyncSession, user_id: int, etag: Optional[str]
+) -> Optional[dict]:
+    """
+    Возвращает профиль из общего кэша под его ETag. Без ETag (реплика
+    отстает) профиль собирается из базы и не кэшируется.
+    """
+    if etag is None:
+        return await build_profile(db, user_id)
+    return await shared_cache.get_or_load(
+        f"profile:{etag}", lambda: build_profile(db, user_id), PROFILE_CACHE_TTL
+    )
+
+
 @router.post("/{user_id}/follow", response_model=FollowResponse)
 async def follow_user(
     user_id: int,
+    loader: LoaderProfile = Depends(loader_profile("principal")),  # noqa: B008
     db: AsyncSession = Depends(get_db),  # noqa: B008
-    current_user: User = Depends(get_current_user_from_api_key),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
     Подписывается на пользователя.
     """
     try:
         user_to_follow: Optional[User] = (
-            (await db.execute(select(User).filter(User.id == user_id)))
-            .scalars()
-            .first()
-        )
-        if not user_to_follow:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        existing_follow = (
             (
                 await db.execute(
-                    select(Follower).filter(
-                        Follower.follower_id == current_user.id,
-                        Follower.followed_id == user_id,
-                    )
+                    select(User).options(*loader.options).filter(User.id == user_id)
                 )
             )
             .scalars()
             .first()
         )
-        if existing_follow:
+        if not user_to_follow:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        if await follow_graph.is_following(db, current_user.id, user_id):
             raise HTTPException(
                 status_code=400, detail="You are already following this user"
             )
 
         new_follow = Follower(follower_id=current_user.id, followed_id=user_id)
         db.add(new_follow)
+        await db.flush()
+        await increment_follow_counts(db, current_user.id, user_id, 1)
+        await timeline.backfill_author(db, current_user.id, user_id)
+        touch_users(db, current_user.id, user_id)
         await db.commit()
+        follow_graph.add(current_user.id, user_id)
         return {"result": True}
     except Exception as e:
         await db.rollback()
@@ -61,18 +119,25 @@ async def follow_user(
 async def unfollow_user(
     user_id: int,
     db: AsyncSession = Depends(get_db),  # noqa: B008
-    current_user: User = Depends(get_current_user_from_api_key),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
     Отписывается от пользователя.
     """
     try:
-        await db.execute(
-            delete(Follower).where(
+        deleted = await db.execute(
+            delete(Follower)
+            .where(
                 Follower.follower_id == current_user.id, Follower.followed_id == user_id
             )
+            .returning(Follower.followed_id)
         )
+        if deleted.scalar_one_or_none() is not None:
+            await increment_follow_counts(db, current_user.id, user_id, -1)
+        await timeline.remove_author(db, current_user.id, user_id)
+        touch_users(db, current_user.id, user_id)
         await db.commit()
+        follow_graph.remove(current_user.id, user_id)
         return Response(
             content='{"result": true}',
             media_type="application/json",
@@ -85,48 +150,27 @@ async def unfollow_user(
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_profile(
-    db: AsyncSession = Depends(get_db),  # noqa: B008
-    current_user: User = Depends(get_current_user_from_api_key),  # noqa: B008
+    loader: LoaderProfile = Depends(loader_profile("profile")),  # noqa: B008
+    if_none_match: Optional[str] = Header(None),  # noqa: B008
+    db: AsyncSession = Depends(get_read_db),  # noqa: B008
+    current_user: Principal = Depends(get_current_user_from_api_key),  # noqa: B008
 ):
     """
     Возвращает информацию о текущем пользователе.
+    При совпадении If-None-Match с ETag профиля возвращает 304.
     """
     try:
-        followers: Sequence[User] = (
-            (
-                await db.execute(
-                    select(User)
-                    .join(Follower, Follower.followed_id == User.id)
-                    .filter(Follower.follower_id == current_user.id)
-                )
-            )
-            .scalars()
-            .all()
-        )
+        etag = profile_etag(db, current_user.id)
+        if etag is not None and is_not_modified(if_none_match, etag):
+            return not_modified_response(etag)
 
-        following: Sequence[User] = (
-            (
-                await db.execute(
-                    select(User)
-                    .join(Follower, Follower.follower_id == User.id)
-                    .filter(Follower.followed_id == current_user.id)
-                )
-            )
-            .scalars()
-            .all()
+        user_profile = await cached_profile(db, current_user.id, etag)
+        if user_profile is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return TrustedJSONResponse(
+            {"result": True, "user": user_profile},
+            headers=etag_headers(etag),
         )
-
-        user_profile = {
-            "id": current_user.id,
-            "name": current_user.name,
-            "following": [
-                {"id": follower.id, "name": follower.name} for follower in followers
-            ],
-            "followers": [
-                {"id": follow.id, "name": follow.name} for follow in following
-            ],
-        }
-        return {"result": True, "user": user_profile}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -134,54 +178,76 @@ async def get_current_user_profile(
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user_profile_by_id(
     user_id: int,
-    db: AsyncSession = Depends(get_db),  # noqa: B008
+    loader: LoaderProfile = Depends(loader_profile("profile")),  # noqa: B008
+    if_none_match: Optional[str] = Header(None),  # noqa: B008
+    db: AsyncSession = Depends(get_read_db),  # noqa: B008
 ):
     """
     Возвращает информацию о произвольном пользователе по его ID.
+    При совпадении If-None-Match с ETag профиля возвращает 304.
     """
     try:
-        user: Optional[User] = (
-            (await db.execute(select(User).filter(User.id == user_id)))
-            .scalars()
-            .first()
+        etag = profile_etag(db, user_id)
+        if etag is not None and is_not_modified(if_none_match, etag):
+            return not_modified_response(etag)
+
+        user_profile = await cached_profile(db, user_id, etag)
+        if user_profile is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return TrustedJSONResponse(
+            {"result": True, "user": user_profile},
+            headers=etag_headers(etag),
         )
-        if not user:
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _follow_list(
+    db: AsyncSession,
+    user_id: int,
+    direction: Direction,
+    limit: int,
+    cursor: Optional[str],
+) -> TrustedJSONResponse:
+    after_id = decode_cursor(cursor, int)[0] if cursor else None
+    if after_id is None:
+        exists = await db.scalar(select(User.id).where(User.id == user_id))
+        if exists is None:
             raise HTTPException(status_code=404, detail="User not found")
 
-        followers: Sequence[User] = (
-            (
-                await db.execute(
-                    select(User)
-                    .join(Follower, Follower.followed_id == User.id)
-                    .filter(Follower.follower_id == user_id)
-                )
-            )
-            .scalars()
-            .all()
-        )
+    users = await follow_page(db, user_id, direction, limit + 1, after_id)
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1]["id"])
+    return TrustedJSONResponse(
+        {"result": True, "users": users, "next_cursor": next_cursor}
+    )
 
-        following: Sequence[User] = (
-            (
-                await db.execute(
-                    select(User)
-                    .join(Follower, Follower.follower_id == User.id)
-                    .filter(Follower.followed_id == user_id)
-                )
-            )
-            .scalars()
-            .all()
-        )
 
-        user_profile = {
-            "id": user.id,
-            "name": user.name,
-            "following": [
-                {"id": follower.id, "name": follower.name} for follower in followers
-            ],
-            "followers": [
-                {"id": follow.id, "name": follow.name} for follow in following
-            ],
-        }
-        return {"result": True, "user": user_profile}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+@router.get("/{user_id}/followers", response_model=UserListResponse)
+async def get_followers(
+    user_id: int,
+    loader: LoaderProfile = Depends(loader_profile("profile")),  # noqa: B008
+    limit: int = Query(FOLLOW_PAGE_SIZE, ge=1, le=FOLLOW_MAX_PAGE_SIZE),  # noqa: B008
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),  # noqa: B008
+):
+    """
+    Возвращает подписчиков пользователя по возрастанию id с курсорной пагинацией.
+    """
+    return await _follow_list(db, user_id, "followers", limit, cursor)
+
+
+@router.get("/{user_id}/following", response_model=UserListResponse)
+async def get_following(
+    user_id: int,
+    loader: LoaderProfile = Depends(loader_profile("profile")),  # noqa: B008
+    limit: int = Query(FOLLOW_PAGE_SIZE, ge=1, le=FOLLOW_MAX_PAGE_SIZE),  # noqa: B008
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),  # noqa: B008
+):
+    """
+    Возвращает подписки пользователя по возрастанию id с курсорной пагинацией.
+    """
+    return await _follow_list(db, user_id, "following", limit, cursor)
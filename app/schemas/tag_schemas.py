@@ -0,0 +1,25 @@
+from typing import List
+
+from pydantic import BaseModel, ConfigDict
+
+
+class TrendingTag(BaseModel):
+    tag: str
+    count: int
+
+
+class TrendingResponse(BaseModel):
+    result: bool
+    tags: List[TrendingTag]
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "result": True,
+                "tags": [
+                    {"tag": "python", "count": 42},
+                    {"tag": "fastapi", "count": 7},
+                ],
+            }
+        }
+    )
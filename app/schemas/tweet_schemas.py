@@ -1,6 +1,6 @@
 from typing import List, Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class TweetCreate(BaseModel):
@@ -23,12 +23,46 @@ class TweetResponse(BaseModel):
     )
 
 
+class TweetBatchCreate(BaseModel):
+    tweets: List[TweetCreate] = Field(min_length=1, max_length=100)
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "tweets": [
+                    {"tweet_data": "Hello, world!", "tweet_media_ids": [1]},
+                    {"tweet_data": "Second tweet", "tweet_media_ids": []},
+                ]
+            }
+        }
+    )
+
+
+class TweetBatchResponse(BaseModel):
+    result: bool
+    tweet_ids: List[int]
+
+    model_config = ConfigDict(
+        json_schema_extra={"example": {"result": True, "tweet_ids": [1, 2]}}
+    )
+
+
+class AuthorInFeed(BaseModel):
+    id: int
+    name: str
+
+
+class LikeInFeed(BaseModel):
+    user_id: int
+    name: str
+
+
 class TweetInFeed(BaseModel):
     id: int
     content: str
     attachments: Optional[List[str]] = None
-    author: dict
-    likes: List[dict]
+    author: AuthorInFeed
+    likes: List[LikeInFeed]
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -46,6 +80,7 @@ class TweetInFeed(BaseModel):
 class FeedResponse(BaseModel):
     result: bool
     tweets: List[TweetInFeed]
+    next_cursor: Optional[str] = None
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -60,6 +95,7 @@ class FeedResponse(BaseModel):
                         "likes": [{"user_id": 2, "name": "Bob"}],
                     }
                 ],
+                "next_cursor": "WzEsMV0",
             }
         }
     )
@@ -67,5 +103,8 @@ class FeedResponse(BaseModel):
 
 class LikeResponse(BaseModel):
     result: bool
+    changed: bool
 
-    model_config = ConfigDict(json_schema_extra={"example": {"result": True}})
+    model_config = ConfigDict(
+        json_schema_extra={"example": {"result": True, "changed": True}}
+    )
@@ -1,19 +1,28 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel, ConfigDict
 
 
+class UserShort(BaseModel):
+    id: int
+    name: str
+
+
 class UserProfile(BaseModel):
     id: int
     name: str
-    followers: List[dict]
-    following: List[dict]
+    followers_count: int
+    following_count: int
+    followers: List[UserShort]
+    following: List[UserShort]
 
     model_config = ConfigDict(
         json_schema_extra={
             "example": {
                 "id": 1,
                 "name": "Alice",
+                "followers_count": 1,
+                "following_count": 1,
                 "followers": [{"id": 2, "name": "Bob"}],
                 "following": [{"id": 3, "name": "Charlie"}],
             }
@@ -32,6 +41,8 @@ class UserResponse(BaseModel):
                 "user": {
                     "id": 1,
                     "name": "Alice",
+                    "followers_count": 1,
+                    "following_count": 1,
                     "followers": [{"id": 2, "name": "Bob"}],
                     "following": [{"id": 3, "name": "Charlie"}],
                 },
@@ -44,3 +55,19 @@ class FollowResponse(BaseModel):
     result: bool
 
     model_config = ConfigDict(json_schema_extra={"example": {"result": True}})
+
+
+class UserListResponse(BaseModel):
+    result: bool
+    users: List[UserShort]
+    next_cursor: Optional[str] = None
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "result": True,
+                "users": [{"id": 2, "name": "Bob"}],
+                "next_cursor": None,
+            }
+        }
+    )
@@ -0,0 +1,269 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.database.database import engine, read_engines
+from app.services.auth import auth_cache
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+# Одновременно выполняемые запросы одного маршрута и сколько запрос может
+# ждать свободного места, прежде чем получить 503.
+ADMISSION_CONCURRENCY = int(os.environ.get("ADMISSION_CONCURRENCY", 64))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 1))
+# То же для дорогих маршрутов: их отклоняем раньше и первыми.
+ADMISSION_EXPENSIVE_CONCURRENCY = int(
+    os.environ.get("ADMISSION_EXPENSIVE_CONCURRENCY", 8)
+)
+ADMISSION_EXPENSIVE_QUEUE_TIMEOUT = float(
+    os.environ.get("ADMISSION_EXPENSIVE_QUEUE_TIMEOUT", 0.2)
+)
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+# Лимит запросов на пользователя: скорость пополнения (в секунду) и запас.
+RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", 20))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 40))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+# Счетчики адресов клиентов с еще не проверенными api-key - отдельная
+# таблица, чтобы перебор ключей не вытеснял счетчики пользователей.
+RATE_LIMIT_MAX_ADDRESSES = int(os.environ.get("RATE_LIMIT_MAX_ADDRESSES", 10000))
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    concurrency: int
+    queue_timeout: float
+    # Дорогие маршруты не ждут в очереди, пока пул соединений занят.
+    expensive: bool = False
+
+
+DEFAULT_LIMIT = RouteLimit(ADMISSION_CONCURRENCY, ADMISSION_QUEUE_TIMEOUT)
+EXPENSIVE_LIMIT = RouteLimit(
+    ADMISSION_EXPENSIVE_CONCURRENCY, ADMISSION_EXPENSIVE_QUEUE_TIMEOUT, expensive=True
+)
+
+# Маршруты по (методу, шаблону пути); остальные получают DEFAULT_LIMIT.
+ROUTE_LIMITS = {
+    ("GET", "/api/tweets/"): EXPENSIVE_LIMIT,
+    ("GET", "/api/tweets/search"): EXPENSIVE_LIMIT,
+    ("POST", "/api/medias/"): EXPENSIVE_LIMIT,
+}
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты по ключу: у каждого ключа запас до burst токенов,
+    пополняемый со скоростью rate в секунду. Ключи хранятся в LRU; вытесненный
+    ключ начинает с полным запасом.
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE_LIMIT_RATE,
+        burst: float = RATE_LIMIT_BURST,
+        max_keys: int = RATE_LIMIT_MAX_KEYS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def take(self, key: str, cost: float = 1) -> float:
+        """
+        Списывает cost токенов. Возвращает 0, если запрос разрешен, иначе -
+        через сколько секунд токенов хватит.
+        """
+        now = self.clock()
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class _Gate:
+    def __init__(self, limit: RouteLimit):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit.concurrency)
+        self.active = 0
+        self.queued = 0
+        self.shed = 0
+
+
+def _rate_limit_key(api_key: str, scope: Scope) -> tuple[bool, str]:
+    """
+    Ключ лимита частоты: пользователь, если этот воркер уже проверил его
+    api-key, иначе адрес клиента. Возвращает (проверен ли ключ, ключ).
+    """
+    principal = auth_cache.peek(api_key)
+    if principal is not None:
+        return True, f"user:{principal.id}"
+    client = scope.get("client")
+    return False, f"address:{client[0] if client else ''}"
+
+
+def _pool_saturated() -> bool:
+    """
+    Проверяет, ждут ли запросы свободного соединения в пуле primary или
+    какой-либо реплики (чтения дорогих маршрутов идут на реплики).
+    """
+    return any(
+        pool.waiting > 0  # type: ignore[attr-defined]
+        for pool in (engine.pool, *(replica.pool for replica in read_engines))
+    )
+
+
+class AdmissionController:
+    """
+    Допуск запросов до чтения тела и обращения к базе:
+
+    - запросы одного пользователя сверх его лимита частоты получают 429;
+      запросы с непроверенным api-key считаются по адресу клиента;
+    - дорогие маршруты сразу получают 503, пока запросы ждут соединения
+      из пула;
+    - у каждого маршрута ограничено число одновременных запросов; запрос,
+      не дождавшийся места за queue_timeout, получает 503.
+
+    Ответы 429 и 503 содержат Retry-After. Дешевые маршруты (например, чтения,
+    которым хватает кэша аутентификации) продолжают обслуживаться, пока
+    дорогие отклоняются.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[dict[tuple[str, str], RouteLimit]] = None,
+        default: RouteLimit = DEFAULT_LIMIT,
+        rate_limiter: Optional[TokenBucket] = None,
+        address_limiter: Optional[TokenBucket] = None,
+        pool_saturated: Callable[[], bool] = _pool_saturated,
+        enabled: bool = ADMISSION_ENABLED,
+    ):
+        self.limits = ROUTE_LIMITS if limits is None else limits
+        self.default = default
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.address_limiter = address_limiter or TokenBucket(
+            max_keys=RATE_LIMIT_MAX_ADDRESSES
+        )
+        self.pool_saturated = pool_saturated
+        self.enabled = enabled
+        self.rate_limited = 0
+        self._gates: dict[tuple[str, str], _Gate] = {}
+
+    def _gate(self, method: str, path: str) -> _Gate:
+        gate = self._gates.get((method, path))
+        if gate is None:
+            limit = self.limits.get((method, path), self.default)
+            gate = self._gates[(method, path)] = _Gate(limit)
+        return gate
+
+    async def __call__(
+        self, app: ASGIApp, path: str, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        api_key = dict(scope["headers"]).get(b"api-key")
+        if api_key is not None:
+            known, key = _rate_limit_key(api_key.decode("latin-1"), scope)
+            limiter = self.rate_limiter if known else self.address_limiter
+            wait = limiter.take(key)
+            if wait > 0:
+                self.rate_limited += 1
+                response = _reject(429, "Too many requests", math.ceil(wait))
+                await response(scope, receive, send)
+                return
+
+        gate = self._gate(scope["method"], path)
+        if gate.limit.expensive and self.pool_saturated():
+            gate.shed += 1
+            await _reject(503, "Server is overloaded")(scope, receive, send)
+            return
+
+        gate.queued += 1
+        try:
+            await asyncio.wait_for(gate.semaphore.acquire(), gate.limit.queue_timeout)
+        except asyncio.TimeoutError:
+            gate.shed += 1
+            await _reject(503, "Server is overloaded")(scope, receive, send)
+            return
+        finally:
+            gate.queued -= 1
+
+        gate.active += 1
+        try:
+            await app(scope, receive, send)
+        finally:
+            gate.active -= 1
+            gate.semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rate_limited": self.rate_limited,
+            "routes": {
+                f"{method} {path}": {
+                    "concurrency": gate.limit.concurrency,
+                    "active": gate.active,
+                    "queued": gate.queued,
+                    "shed": gate.shed,
+                }
+                for (method, path), gate in self._gates.items()
+            },
+        }
+
+
+def _reject(
+    status: int, detail: str, retry_after: int = ADMISSION_RETRY_AFTER
+) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status,
+        headers={"Retry-After": str(max(1, retry_after))},
+    )
+
+
+admission_controller = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    ASGI-middleware, которое передает HTTP-запросы известных маршрутов
+    контроллеру допуска.
+    """
+
+    def __init__(
+        self, app: ASGIApp, controller: AdmissionController = admission_controller
+    ):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = None
+        if scope["type"] == "http" and self.controller.enabled:
+            path = self._route_path(scope)
+        if path is None:
+            await self.app(scope, receive, send)
+            return
+        await self.controller(self.app, path, scope, receive, send)
+
+    @staticmethod
+    def _route_path(scope: Scope) -> Optional[str]:
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                # Метрики учтут отклоненный запрос под его маршрутом.
+                scope["route"] = route
+                return route.path
+        return None
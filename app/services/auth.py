@@ -1,24 +1,162 @@
-from typing import Optional
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
 
 from fastapi import Depends, Header, HTTPException
-from sqlalchemy import select
+from sqlalchemy import event, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.database import get_db
+from app.database.database import get_replica_router
+from app.database.replicas import ReplicaRouter
 from app.models.user import User
+from app.services.cache import shared_cache
+from app.services.versions import version_tracker
+
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 300))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    Облегченное представление аутентифицированного пользователя.
+    """
+
+    id: int
+    name: str
+
+
+class AuthCache:
+    """
+    Ограниченный LRU-кэш api-key -> Principal с временем жизни записей.
+    """
+
+    def __init__(
+        self,
+        max_size: int = AUTH_CACHE_SIZE,
+        ttl: float = AUTH_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[str, tuple[Principal, float]] = OrderedDict()
+        self._keys_by_user: dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, api_key: str) -> Optional[Principal]:
+        entry = self._entries.get(api_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        principal, expires_at = entry
+        if expires_at <= self.clock():
+            self.invalidate(api_key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(api_key)
+        self.hits += 1
+        return principal
+
+    def peek(self, api_key: str) -> Optional[Principal]:
+        """
+        Возвращает пользователя без учета в статистике и в порядке LRU.
+        """
+        entry = self._entries.get(api_key)
+        if entry is None or entry[1] <= self.clock():
+            return None
+        return entry[0]
+
+    def set(self, api_key: str, principal: Principal) -> None:
+        self.invalidate_user(principal.id)
+        self._entries[api_key] = (principal, self.clock() + self.ttl)
+        self._entries.move_to_end(api_key)
+        self._keys_by_user[principal.id] = api_key
+        while len(self._entries) > self.max_size:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._keys_by_user.pop(evicted.id, None)
+
+    def invalidate(self, api_key: str) -> None:
+        entry = self._entries.pop(api_key, None)
+        if entry is not None:
+            self._keys_by_user.pop(entry[0].id, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        api_key = self._keys_by_user.pop(user_id, None)
+        if api_key is not None:
+            self._entries.pop(api_key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+auth_cache = AuthCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target: User) -> None:
+    auth_cache.invalidate_user(target.id)
+
+
+@shared_cache.on_event
+def _invalidate_remote_changes(event: Optional[dict]) -> None:
+    # Переименование или удаление пользователя в другом воркере меняет
+    # глобальную версию; какой это пользователь, событие не сообщает.
+    if event is None or event.get("everything") is not None:
+        auth_cache.clear()
+
+
+async def _load_principal(db: AsyncSession, api_key: str) -> dict:
+    result = await db.execute(
+        select(User.id, User.name).filter(User.api_key == api_key)
+    )
+    row = result.one_or_none()
+
+    if not row:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    return {"id": row.id, "name": row.name}
 
 
 async def get_current_user_from_api_key(
     api_key: str = Header(..., alias="api-key"),  # noqa: B008
-    db: AsyncSession = Depends(get_db),  # noqa: B008
-) -> Optional[User]:
+    router: ReplicaRouter = Depends(get_replica_router),  # noqa: B008
+) -> Principal:
     """
     Аутентифицирует пользователя по api-key.
+    При попадании в кэш процесса не выполняется ни одного обращения к общему
+    кэшу или базе данных, при попадании в общий кэш воркеров - к базе.
+    Сессия чтения открывается только при промахе обоих кэшей.
     """
-    result = await db.execute(select(User).filter(User.api_key == api_key))
-    user: Optional[User] = result.scalars().one_or_none()
+    principal = auth_cache.get(api_key)
+    if principal is not None:
+        return principal
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid API key")
+    # Общий кэш воркеров; ключ меняется вместе с глобальной версией, которую
+    # сдвигают изменения пользователей. Версия у воркеров общая, поэтому
+    # запись одного воркера находят все. Сам api-key в ключ не попадает.
+    digest = hashlib.sha256(api_key.encode()).hexdigest()
+
+    async def load() -> dict:
+        async with router.read_session(api_key) as db:
+            return await _load_principal(db, api_key)
 
-    return user
+    cached = await shared_cache.get_or_load(
+        f"auth:{version_tracker.global_version}:{digest}", load, AUTH_CACHE_TTL
+    )
+    principal = Principal(id=cached["id"], name=cached["name"])
+    auth_cache.set(api_key, principal)
+    return principal
@@ -0,0 +1,623 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from typing import Any, Awaitable, Callable, Coroutine, Optional, Union
+from urllib.parse import urlsplit
+
+from pydantic_core import from_json, to_json
+
+# Пустой адрес - кэш в памяти процесса (один воркер); redis://host:port/db -
+# общий кэш воркеров на сервере с протоколом Redis.
+CACHE_URL = os.environ.get("CACHE_URL", "")
+CACHE_MEMORY_SIZE = int(os.environ.get("CACHE_MEMORY_SIZE", 10000))
+# Сколько ждать ответа сервера кэша, прежде чем читать из базы в обход кэша.
+CACHE_TIMEOUT = float(os.environ.get("CACHE_TIMEOUT", 0.5))
+CACHE_RECONNECT_DELAY = float(os.environ.get("CACHE_RECONNECT_DELAY", 1))
+CACHE_KEY_PREFIX = "twitter:"
+INVALIDATION_CHANNEL = CACHE_KEY_PREFIX + "invalidation"
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Optional[bytes]], None]
+
+
+class CacheError(Exception):
+    pass
+
+
+class CacheBackend(ABC):
+    """
+    Хранилище кэша: строки байт с временем жизни и канал сообщений
+    между воркерами.
+    """
+
+    # Общее ли хранилище для нескольких процессов: только тогда нужны
+    # сообщения об изменениях.
+    shared = False
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None: ...
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None: ...
+
+    @abstractmethod
+    async def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        """
+        Записывает значение, только если ключа еще нет. Возвращает True,
+        если записало. Без ttl запись не истекает.
+        """
+
+    @abstractmethod
+    async def increment_scores(
+        self, key: str, deltas: dict[str, int], ttl: float
+    ) -> None:
+        """
+        Прибавляет deltas к именованным счетчикам ключа и продлевает его жизнь.
+        """
+
+    @abstractmethod
+    async def top_scores(self, keys: list[str], limit: int) -> list[tuple[str, int]]:
+        """
+        Суммирует счетчики ключей и возвращает не больше limit положительных
+        сумм: по убыванию, при равенстве - по имени.
+        """
+
+    @abstractmethod
+    async def publish(self, channel: str, message: bytes) -> None: ...
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        """
+        Доставляет сообщения канала в handler, пока задачу не отменят.
+        handler(None) вызывается при каждом (пере)подключении: сообщения,
+        отправленные до него, могли быть потеряны.
+        """
+
+    async def close(self) -> None:
+        return None
+
+
+class MemoryBackend(CacheBackend):
+    """
+    LRU-кэш в памяти процесса с временем жизни записей.
+    """
+
+    def __init__(
+        self,
+        max_size: int = CACHE_MEMORY_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.clock = clock
+        self._entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._scores: dict[str, tuple[Counter[str], float]] = {}
+        self._handlers: dict[str, list[Handler]] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._entries[key] = (value, self.clock() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+            self._scores.pop(key, None)
+
+    async def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, math.inf if ttl is None else ttl)
+        return True
+
+    def _live_scores(self, key: str) -> Optional[Counter[str]]:
+        entry = self._scores.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= self.clock():
+            del self._scores[key]
+            return None
+        return entry[0]
+
+    async def increment_scores(
+        self, key: str, deltas: dict[str, int], ttl: float
+    ) -> None:
+        scores = self._live_scores(key) or Counter()
+        scores.update(deltas)
+        self._scores[key] = (scores, self.clock() + ttl)
+
+    async def top_scores(self, keys: list[str], limit: int) -> list[tuple[str, int]]:
+        totals: Counter[str] = Counter()
+        for key in keys:
+            totals.update(self._live_scores(key) or {})
+        positive = [(name, total) for name, total in totals.items() if total > 0]
+        return heapq.nsmallest(limit, positive, key=lambda item: (-item[1], item[0]))
+
+    async def publish(self, channel: str, message: bytes) -> None:
+        for handler in self._handlers.get(channel, []):
+            handler(message)
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        handlers = self._handlers.setdefault(channel, [])
+        handlers.append(handler)
+        handler(None)
+        try:
+            await asyncio.Future()
+        finally:
+            handlers.remove(handler)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def encode_command(*args: Union[str, bytes, int, float]) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """
+    Читает один ответ протокола RESP2. Ошибка сервера возвращается
+    (а не выбрасывается), чтобы не сбить очередь ответов соединения.
+    """
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Cache server closed the connection")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload
+    if kind == b"-":
+        return CacheError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        if int(payload) < 0:
+            return None
+        return (await reader.readexactly(int(payload) + 2))[:-2]
+    if kind == b"*":
+        if int(payload) < 0:
+            return None
+        return [await read_reply(reader) for _ in range(int(payload))]
+    raise ConnectionError(f"Unexpected reply from cache server: {line!r}")
+
+
+class _Connection:
+    """
+    Соединение с конвейером: команды отправляются не дожидаясь ответов
+    на предыдущие, ответы сопоставляются с командами по порядку.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.closed = False
+        self._waiters: deque[asyncio.Future] = deque()
+        self._reader_task = asyncio.create_task(self._read_replies(reader))
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                reply = await read_reply(reader)
+                waiter = self._waiters.popleft()
+                # Команда, не дождавшаяся ответа, уже отменена.
+                if not waiter.done():
+                    waiter.set_result(reply)
+        except (OSError, EOFError, IndexError, ValueError) as error:
+            self.close(error)
+
+    def send(self, *args: Union[str, bytes, int, float]) -> asyncio.Future:
+        if self.closed:
+            raise CacheError("Cache connection is closed")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.writer.write(encode_command(*args))
+        return waiter
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        self.closed = True
+        self.writer.close()
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(CacheError(f"Cache connection lost: {error}"))
+        if self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+
+
+class RedisBackend(CacheBackend):
+    """
+    Клиент сервера с протоколом Redis (RESP2) на потоках asyncio:
+    строки (GET, SET, DEL), сортированные множества для счетчиков
+    (ZINCRBY, ZUNIONSTORE, ZRANGE), PUBLISH и SUBSCRIBE. Команды идут
+    конвейером по одному соединению, подписка держит отдельное.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, timeout: float = CACHE_TIMEOUT):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.database = int(parts.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._connection: Optional[_Connection] = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _open(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+            handshake: list[tuple[str, Union[str, int]]] = []
+            if self.password:
+                handshake.append(("AUTH", self.password))
+            if self.database:
+                handshake.append(("SELECT", self.database))
+            for command in handshake:
+                writer.write(encode_command(*command))
+                reply = await asyncio.wait_for(read_reply(reader), self.timeout)
+                if isinstance(reply, CacheError):
+                    writer.close()
+                    raise reply
+        except (OSError, EOFError, asyncio.TimeoutError) as error:
+            raise CacheError(f"Cache server is unavailable: {error!r}") from error
+        return reader, writer
+
+    async def execute(self, *args: Union[str, bytes, int, float]) -> Any:
+        return (await self.execute_many(args))[0]
+
+    async def execute_many(
+        self, *commands: tuple[Union[str, bytes, int, float], ...]
+    ) -> list[Any]:
+        """
+        Отправляет команды подряд, без чужих команд между ними (поэтому
+        MULTI ... EXEC можно отправить одним вызовом), и возвращает ответы.
+        """
+        async with self._connect_lock:
+            if self._connection is None or self._connection.closed:
+                self._connection = _Connection(*await self._open())
+            connection = self._connection
+        waiters = [connection.send(*args) for args in commands]
+        try:
+            replies = await asyncio.wait_for(asyncio.gather(*waiters), self.timeout)
+        except asyncio.TimeoutError as error:
+            # Сервер не отвечает: следующая команда откроет новое соединение.
+            connection.close(error)
+            raise CacheError(f"Cache command {commands[0][0]!r} timed out") from error
+        for reply in replies:
+            if isinstance(reply, CacheError):
+                raise reply
+        return replies
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.execute("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.execute("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.execute("DEL", *keys)
+
+    async def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        expiry = () if ttl is None else ("PX", max(1, int(ttl * 1000)))
+        return await self.execute("SET", key, value, "NX", *expiry) is not None
+
+    async def increment_scores(
+        self, key: str, deltas: dict[str, int], ttl: float
+    ) -> None:
+        # Счетчики хранятся с обратным знаком: ZRANGE по возрастанию дает
+        # наибольшие суммы первыми, а равные - по имени.
+        await self.execute_many(
+            *(("ZINCRBY", key, -delta, name) for name, delta in deltas.items()),
+            ("PEXPIRE", key, max(1, int(ttl * 1000))),
+        )
+
+    async def top_scores(self, keys: list[str], limit: int) -> list[tuple[str, int]]:
+        if not keys:
+            return []
+        union = keys[-1] + ":top"
+        replies = await self.execute_many(
+            ("MULTI",),
+            ("ZUNIONSTORE", union, len(keys), *keys),
+            ("ZRANGE", union, "-inf", "(0", "BYSCORE", "LIMIT", 0, limit, "WITHSCORES"),
+            ("DEL", union),
+            ("EXEC",),
+        )
+        _, ranked, _ = replies[-1]
+        if isinstance(ranked, CacheError):
+            raise ranked
+        return [
+            (name.decode(), -int(float(score)))
+            for name, score in zip(ranked[::2], ranked[1::2])
+        ]
+
+    async def publish(self, channel: str, message: bytes) -> None:
+        await self.execute("PUBLISH", channel, message)
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        while True:
+            try:
+                reader, writer = await self._open()
+            except CacheError:
+                logger.warning("Cannot subscribe to %s, retrying", channel)
+                await asyncio.sleep(CACHE_RECONNECT_DELAY)
+                continue
+            try:
+                writer.write(encode_command("SUBSCRIBE", channel))
+                while True:
+                    reply = await read_reply(reader)
+                    if not isinstance(reply, list) or len(reply) != 3:
+                        continue
+                    if reply[0] == b"subscribe":
+                        handler(None)
+                    elif reply[0] == b"message":
+                        handler(reply[2])
+            except (OSError, EOFError, ValueError):
+                logger.warning("Lost subscription to %s, reconnecting", channel)
+            finally:
+                writer.close()
+            await asyncio.sleep(CACHE_RECONNECT_DELAY)
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class SharedCache:
+    """
+    Кэш готовых ответов поверх хранилища и шина событий об изменениях.
+
+    Промах кэша загружается один раз на процесс: параллельные запросы того
+    же ключа ждут первого (single-flight). Значения - JSON, каждый вызов
+    получает свою копию. Ошибки хранилища не ломают запрос: данные берутся
+    из загрузчика, как без кэша.
+
+    Ключи записей строятся из версий данных, поэтому устаревшая запись не
+    удаляется, а перестает запрашиваться. Воркеры узнают о чужих изменениях
+    из событий канала INVALIDATION_CHANNEL.
+    """
+
+    def __init__(self, backend: CacheBackend, channel: str = INVALIDATION_CHANNEL):
+        self.backend = backend
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._handlers: list[Callable[[Optional[dict]], None]] = []
+        self._tasks: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def get_or_load(
+        self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float
+    ) -> Any:
+        """
+        Возвращает значение из кэша или результат loader(). None не
+        кэшируется: отсутствующие данные могут появиться без смены версий.
+        """
+        key = CACHE_KEY_PREFIX + key
+        try:
+            cached = await self.backend.get(key)
+        except CacheError:
+            self.errors += 1
+            cached = None
+        if cached is not None:
+            self.hits += 1
+            return from_json(cached)
+        return from_json(await self._load_once(key, loader, ttl))
+
+    async def get(self, key: str) -> Any:
+        """
+        Возвращает значение ключа или None, если его нет или хранилище
+        недоступно.
+        """
+        try:
+            cached = await self.backend.get(CACHE_KEY_PREFIX + key)
+        except CacheError:
+            self.errors += 1
+            return None
+        return None if cached is None else from_json(cached)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            await self.backend.set(CACHE_KEY_PREFIX + key, to_json(value), ttl)
+        except CacheError:
+            self.errors += 1
+
+    def set_soon(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Записывает значение в фоне. Вызывается из синхронных обработчиков
+        коммита.
+        """
+        self.spawn(self.set(key, value, ttl))
+
+    async def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """
+        Записывает значение, только если ключа еще нет. При недоступном
+        хранилище возвращает False.
+        """
+        try:
+            return await self.backend.add(CACHE_KEY_PREFIX + key, to_json(value), ttl)
+        except CacheError:
+            self.errors += 1
+            return False
+
+    async def increment_scores(
+        self, key: str, deltas: dict[str, int], ttl: float
+    ) -> None:
+        try:
+            await self.backend.increment_scores(CACHE_KEY_PREFIX + key, deltas, ttl)
+        except CacheError:
+            self.errors += 1
+            logger.warning("Failed to update counters %s", key)
+
+    def increment_scores_soon(
+        self, key: str, deltas: dict[str, int], ttl: float
+    ) -> None:
+        """
+        Обновляет счетчики в фоне. Вызывается из синхронных обработчиков
+        коммита.
+        """
+        self.spawn(self.increment_scores(key, deltas, ttl))
+
+    async def top_scores(self, keys: list[str], limit: int) -> list[tuple[str, int]]:
+        """
+        Возвращает наибольшие суммы счетчиков ключей или пустой список,
+        если хранилище недоступно.
+        """
+        try:
+            return await self.backend.top_scores(
+                [CACHE_KEY_PREFIX + key for key in keys], limit
+            )
+        except CacheError:
+            self.errors += 1
+            return []
+
+    async def _load_once(
+        self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float
+    ) -> bytes:
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Отменили загружавший запрос, а не этот: загружаем сами.
+                if not inflight.cancelled():
+                    raise
+                return await self._load_once(key, loader, ttl)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+            encoded = to_json(value)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Ошибку получат ожидающие; если их нет, она не должна попасть в лог.
+            future.exception()
+            raise
+        else:
+            future.set_result(encoded)
+        finally:
+            del self._inflight[key]
+
+        if value is not None:
+            try:
+                await self.backend.set(key, encoded, ttl)
+            except CacheError:
+                self.errors += 1
+        return encoded
+
+    def on_event(
+        self, handler: Callable[[Optional[dict]], None]
+    ) -> Callable[[Optional[dict]], None]:
+        """
+        Регистрирует обработчик событий других воркеров. None означает, что
+        события могли быть потеряны и локальные копии нужно сбросить.
+        """
+        self._handlers.append(handler)
+        return handler
+
+    def _dispatch(self, message: Optional[bytes]) -> None:
+        event = None
+        if message is not None:
+            event = from_json(message)
+            if event.get("origin") == self.origin:
+                return
+        for handler in self._handlers:
+            handler(event)
+
+    def publish_soon(self, event: dict) -> None:
+        """
+        Отправляет событие другим воркерам в фоне. Вызывается из
+        синхронных обработчиков коммита.
+        """
+        if self.backend.shared:
+            self.spawn(self._publish({**event, "origin": self.origin}))
+
+    def spawn(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        """
+        Запускает работу с хранилищем в фоне; close() дождется ее.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            coroutine.close()
+            return
+        task = loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _publish(self, event: dict) -> None:
+        try:
+            await self.backend.publish(self.channel, to_json(event))
+        except CacheError:
+            self.errors += 1
+            logger.warning("Failed to publish cache invalidation event")
+
+    async def run(self) -> None:
+        """
+        Фоновая задача: получает события других воркеров.
+        """
+        await self.backend.subscribe(self.channel, self._dispatch)
+
+    async def drain(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    async def close(self) -> None:
+        await self.drain()
+        await self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "inflight": len(self._inflight),
+        }
+
+
+def create_backend(url: str) -> CacheBackend:
+    if not url:
+        return MemoryBackend()
+    if urlsplit(url).scheme != "redis":
+        raise ValueError(f"Unsupported cache URL: {url}")
+    return RedisBackend(url)
+
+
+shared_cache = SharedCache(create_backend(CACHE_URL))
@@ -0,0 +1,132 @@
+from typing import Optional
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.follow import Follower
+from app.models.like import Like
+from app.models.tweet import Tweet
+from app.models.user import User
+from app.services.versions import touch_all
+
+
+async def increment_like_count(
+    db: AsyncSession, tweet_id: int, delta: int
+) -> Optional[int]:
+    """
+    Атомарно изменяет счетчик лайков твита одним UPDATE.
+    Возвращает id автора твита.
+    """
+    result = await db.execute(
+        update(Tweet)
+        .where(Tweet.id == tweet_id)
+        .values(like_count=Tweet.like_count + delta)
+        .returning(Tweet.author_id)
+    )
+    return result.scalar_one_or_none()
+
+
+async def apply_like_deltas(db: AsyncSession, deltas: dict[int, int]) -> list[int]:
+    """
+    Изменяет счетчики лайков нескольких твитов одним UPDATE с CASE.
+    Возвращает id авторов измененных твитов.
+    """
+    deltas = {tweet_id: delta for tweet_id, delta in deltas.items() if delta}
+    if not deltas:
+        return []
+    result = await db.execute(
+        update(Tweet)
+        .where(Tweet.id.in_(deltas))
+        .values(like_count=Tweet.like_count + case(deltas, value=Tweet.id))
+        .returning(Tweet.author_id)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars().all())
+
+
+async def reconcile_like_counts(db: AsyncSession) -> int:
+    """
+    Пересчитывает счетчики лайков всех твитов по таблице likes.
+    Возвращает количество исправленных твитов.
+    """
+    actual = (
+        select(func.count(Like.id))
+        .where(Like.tweet_id == Tweet.id)
+        .correlate(Tweet)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(Tweet)
+        .where(Tweet.like_count != actual)
+        .values(like_count=actual)
+        .execution_options(synchronize_session=False)
+    )
+    touch_all(db)
+    return result.rowcount  # type: ignore[attr-defined]
+
+
+async def increment_follow_counts(
+    db: AsyncSession, follower_id: int, followed_id: int, delta: int
+) -> None:
+    """
+    Атомарно изменяет счетчики подписчиков и подписок обоих пользователей
+    одним UPDATE.
+    """
+    await db.execute(
+        update(User)
+        .where(User.id.in_([follower_id, followed_id]))
+        .values(
+            followers_count=User.followers_count
+            + case((User.id == followed_id, delta), else_=0),
+            following_count=User.following_count
+            + case((User.id == follower_id, delta), else_=0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def reconcile_follow_counts(db: AsyncSession) -> int:
+    """
+    Пересчитывает счетчики подписчиков и подписок по таблице followers.
+    Возвращает количество исправленных пользователей.
+    """
+    followers = (
+        select(func.count())
+        .where(Follower.followed_id == User.id)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    following = (
+        select(func.count())
+        .where(Follower.follower_id == User.id)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(User)
+        .where(
+            (User.followers_count != followers) | (User.following_count != following)
+        )
+        .values(followers_count=followers, following_count=following)
+        .execution_options(synchronize_session=False)
+    )
+    touch_all(db)
+    return result.rowcount  # type: ignore[attr-defined]
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    from app.database.database import AsyncSessionLocal
+    from app.services.ranking import rescore_all
+
+    async def main() -> None:
+        async with AsyncSessionLocal() as session:
+            fixed = await reconcile_like_counts(session)
+            fixed_users = await reconcile_follow_counts(session)
+            await rescore_all(session)
+            await session.commit()
+            print(f"Like counters fixed: {fixed}")
+            print(f"Follow counters fixed: {fixed_users}")
+
+    asyncio.run(main())
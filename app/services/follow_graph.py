@@ -0,0 +1,157 @@
+import os
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Sequence
+
+from sqlalchemy import ColumnElement, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.replicas import primary_bind
+from app.models.follow import Follower
+
+# Сколько списков смежности (по каждому направлению) держим в памяти.
+FOLLOW_GRAPH_MAX_USERS = int(os.environ.get("FOLLOW_GRAPH_MAX_USERS", 100000))
+
+# 32-битные идентификаторы, как у Integer-ключей в базе.
+ID_TYPECODE = "i"
+
+
+class _Adjacency:
+    """
+    LRU-набор отсортированных массивов идентификаторов для одного направления.
+    """
+
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self.lists: OrderedDict[int, array] = OrderedDict()
+
+    def get(self, user_id: int):
+        ids = self.lists.get(user_id)
+        if ids is not None:
+            self.lists.move_to_end(user_id)
+        return ids
+
+    def put(self, user_id: int, ids: array) -> None:
+        self.lists[user_id] = ids
+        self.lists.move_to_end(user_id)
+        while len(self.lists) > self.max_users:
+            self.lists.popitem(last=False)
+
+    def add(self, user_id: int, other_id: int) -> None:
+        ids = self.lists.get(user_id)
+        if ids is not None and not _contains(ids, other_id):
+            insort(ids, other_id)
+
+    def remove(self, user_id: int, other_id: int) -> None:
+        ids = self.lists.get(user_id)
+        if ids is not None and _contains(ids, other_id):
+            del ids[bisect_left(ids, other_id)]
+
+    def memory_bytes(self) -> int:
+        return sum(ids.buffer_info()[1] * ids.itemsize for ids in self.lists.values())
+
+
+def _contains(ids: Sequence[int], user_id: int) -> bool:
+    position = bisect_left(ids, user_id)
+    return position < len(ids) and ids[position] == user_id
+
+
+class FollowGraph:
+    """
+    Граф подписок в памяти процесса: для каждого пользователя хранит
+    отсортированные массивы подписок и подписчиков. Списки загружаются
+    из таблицы followers при первом обращении и обновляются при
+    подписке и отписке. Граф нужен проверке подписки, пересборке лент и
+    ETag ленты; списки в профилях строятся SQL-запросами
+    (app.services.follows), число подписчиков - User.followers_count.
+    """
+
+    def __init__(self, max_users: int = FOLLOW_GRAPH_MAX_USERS):
+        self._following = _Adjacency(max_users)
+        self._followers = _Adjacency(max_users)
+        self.hits = 0
+        self.misses = 0
+
+    async def following(self, db: AsyncSession, user_id: int) -> array:
+        """
+        Возвращает отсортированные id пользователей, на которых подписан user_id.
+        """
+        return await self._load(
+            db,
+            self._following,
+            user_id,
+            Follower.followed_id,
+            Follower.follower_id == user_id,
+        )
+
+    async def followers(self, db: AsyncSession, user_id: int) -> array:
+        """
+        Возвращает отсортированные id подписчиков user_id.
+        """
+        return await self._load(
+            db,
+            self._followers,
+            user_id,
+            Follower.follower_id,
+            Follower.followed_id == user_id,
+        )
+
+    async def is_following(
+        self, db: AsyncSession, follower_id: int, followed_id: int
+    ) -> bool:
+        return _contains(await self.following(db, follower_id), followed_id)
+
+    async def _load(
+        self,
+        db: AsyncSession,
+        adjacency: _Adjacency,
+        user_id: int,
+        column,
+        condition: ColumnElement[bool],
+    ) -> array:
+        ids = adjacency.get(user_id)
+        if ids is not None:
+            self.hits += 1
+            return ids
+        self.misses += 1
+        # Кэш живет дольше запроса и обновляется только событиями подписки,
+        # поэтому загружается с primary, а не с отстающей реплики.
+        result = await db.execute(
+            select(column).where(condition).order_by(column),
+            bind_arguments=primary_bind(db),
+        )
+        ids = array(ID_TYPECODE, result.scalars().all())
+        adjacency.put(user_id, ids)
+        return ids
+
+    def add(self, follower_id: int, followed_id: int) -> None:
+        self._following.add(follower_id, followed_id)
+        self._followers.add(followed_id, follower_id)
+
+    def remove(self, follower_id: int, followed_id: int) -> None:
+        self._following.remove(follower_id, followed_id)
+        self._followers.remove(followed_id, follower_id)
+
+    def evict(self, user_id: int) -> None:
+        self._following.lists.pop(user_id, None)
+        self._followers.lists.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._following.lists.clear()
+        self._followers.lists.clear()
+
+    def stats(self) -> dict:
+        return {
+            "following_lists": len(self._following.lists),
+            "follower_lists": len(self._followers.lists),
+            "edges": sum(len(ids) for ids in self._following.lists.values())
+            + sum(len(ids) for ids in self._followers.lists.values()),
+            "memory_bytes": self._following.memory_bytes()
+            + self._followers.memory_bytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+follow_graph = FollowGraph()
@@ -0,0 +1,44 @@
+import os
+from typing import Literal, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.follow import Follower
+from app.models.user import User
+
+# Сколько подписчиков и подписок показывается прямо в профиле.
+PROFILE_PREVIEW_SIZE = int(os.environ.get("PROFILE_PREVIEW_SIZE", 20))
+
+Direction = Literal["followers", "following"]
+
+
+async def follow_page(
+    db: AsyncSession,
+    user_id: int,
+    direction: Direction,
+    limit: int,
+    after_id: Optional[int] = None,
+) -> list[dict]:
+    """
+    Возвращает до limit подписчиков или подписок пользователя по возрастанию id,
+    начиная после after_id. Страница читается по индексу followers
+    (followed_id, follower_id) или по первичному ключу (follower_id, followed_id).
+    """
+    if direction == "followers":
+        owner, other = Follower.followed_id, Follower.follower_id
+    else:
+        owner, other = Follower.follower_id, Follower.followed_id
+
+    query = (
+        select(User.id, User.name)
+        .join(Follower, other == User.id)
+        .where(owner == user_id)
+        .order_by(other)
+        .limit(limit)
+    )
+    if after_id is not None:
+        query = query.where(other > after_id)
+
+    result = await db.execute(query)
+    return [{"id": row.id, "name": row.name} for row in result]
@@ -0,0 +1,115 @@
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.metrics import MetricsRegistry, metrics_registry
+
+# Добавлять ли к ответам заголовок Server-Timing (app и db).
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+
+# Запросы, не совпавшие ни с одним маршрутом, учитываются под одной меткой.
+UNMATCHED_ROUTE = "<unmatched>"
+
+_QUERY_STARTED = "metrics_query_started"
+
+
+@dataclass
+class RequestStats:
+    statements: int = 0
+    db_time: float = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats.get() is not None:
+        conn.info.setdefault(_QUERY_STARTED, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats.get()
+    started = conn.info.get(_QUERY_STARTED)
+    if stats is None or not started:
+        return
+    stats.statements += 1
+    stats.db_time += time.perf_counter() - started.pop()
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware, которое для каждого HTTP-запроса замеряет задержку,
+    число и суммарное время SQL-выражений и размер тела ответа и
+    записывает их в реестр по шаблону пути маршрута.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        registry: MetricsRegistry = metrics_registry,
+        server_timing: bool = SERVER_TIMING,
+    ):
+        self.app = app
+        self.registry = registry
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        response_bytes = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", self._server_timing(started, stats)),
+                    ]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            route = scope.get("route")
+            self.registry.observe(
+                scope["method"],
+                getattr(route, "path", UNMATCHED_ROUTE),
+                status,
+                time.perf_counter() - started,
+                stats.statements,
+                stats.db_time,
+                response_bytes,
+            )
+
+    @staticmethod
+    def _server_timing(started: float, stats: RequestStats) -> bytes:
+        app_ms = (time.perf_counter() - started) * 1000
+        db_ms = stats.db_time * 1000
+        return (
+            f'app;dur={app_ms:.1f}, db;dur={db_ms:.1f};desc="{stats.statements} queries"'
+        ).encode()
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from itertools import count
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.like import Like
+from app.models.tweet import Tweet
+from app.services.counters import apply_like_deltas
+from app.services.likes import insert_ignoring_conflicts
+from app.services.ranking import mark_for_scoring
+from app.services.versions import touch_authors
+
+# Режим отложенной записи лайков: маршруты подтверждают намерение из буфера
+# в памяти воркера, запись в базу идет пачками.
+LIKE_BUFFER_ENABLED = os.environ.get("LIKE_BUFFER_ENABLED", "0") == "1"
+# Интервал сброса буфера в секундах и размер, при котором сброс идет сразу.
+LIKE_BUFFER_INTERVAL = float(os.environ.get("LIKE_BUFFER_INTERVAL", 0.2))
+LIKE_BUFFER_MAX_SIZE = int(os.environ.get("LIKE_BUFFER_MAX_SIZE", 5000))
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    """
+    Буфер намерений "лайк" и "снять лайк". Для каждой пары (пользователь,
+    твит) хранится только последнее намерение, поэтому повторы и пары
+    лайк/снятие схлопываются. Сброс пишет все намерения одним INSERT ...
+    ON CONFLICT DO NOTHING, одним DELETE и одним UPDATE счетчиков.
+
+    Лайки к несуществующим твитам отбрасываются при сбросе. Пока намерение
+    не записано, его видит только автор: маршруты чтения накладывают его
+    на ответ через overlay().
+
+    Буфер у каждого воркера свой. До сброса (не дольше interval секунд)
+    другие воркеры намерения не видят: там лента не показывает лайк, а
+    changed вычисляется по записанному в базе.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = LIKE_BUFFER_ENABLED,
+        interval: float = LIKE_BUFFER_INTERVAL,
+        max_size: int = LIKE_BUFFER_MAX_SIZE,
+    ) -> None:
+        self.enabled = enabled
+        self.interval = interval
+        self.max_size = max_size
+        self._pending: dict[tuple[int, int], bool] = {}
+        self._flushing: dict[tuple[int, int], bool] = {}
+        # Метка последнего намерения пользователя - часть ETag его ленты.
+        self._marks: dict[int, int] = {}
+        self._sequence = count(1)
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def state(self, user_id: int, tweet_id: int) -> Optional[bool]:
+        """
+        Возвращает незаписанное намерение пользователя (True - лайк,
+        False - снятие) или None.
+        """
+        key = (user_id, tweet_id)
+        return self._pending.get(key, self._flushing.get(key))
+
+    async def add(
+        self, db: AsyncSession, user_id: int, tweet_id: int, liked: bool
+    ) -> bool:
+        """
+        Запоминает намерение. Возвращает True, если оно отличается от
+        текущего состояния: незаписанного намерения пользователя для этого
+        твита, а без него - лайка в базе. Намерение, совпадающее с
+        состоянием, не запоминается.
+        """
+        previous = self.state(user_id, tweet_id)
+        if previous is None:
+            persisted = await db.scalar(
+                select(Like.id).where(
+                    Like.user_id == user_id, Like.tweet_id == tweet_id
+                )
+            )
+            # Пока шел запрос, намерение мог оставить параллельный запрос.
+            previous = self.state(user_id, tweet_id)
+            if previous is None:
+                previous = persisted is not None
+        if previous is liked:
+            return False
+        self._pending[(user_id, tweet_id)] = liked
+        self._marks[user_id] = next(self._sequence)
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+        return True
+
+    def user_mark(self, user_id: int) -> int:
+        return self._marks.get(user_id, 0)
+
+    def overlay(self, user_id: int, user_name: str, items: Iterable[dict]) -> None:
+        """
+        Накладывает незаписанные лайки пользователя на элементы ленты.
+        """
+        if not self._pending and not self._flushing:
+            return
+        for item in items:
+            liked = self.state(user_id, item["id"])
+            if liked is None:
+                continue
+            likes = [like for like in item["likes"] if like["user_id"] != user_id]
+            if liked:
+                likes.append({"user_id": user_id, "name": user_name})
+            item["likes"] = likes
+
+    def clear(self) -> None:
+        self._pending.clear()
+        self._flushing.clear()
+        self._marks.clear()
+
+    async def _write(
+        self, db: AsyncSession, intents: dict[tuple[int, int], bool]
+    ) -> None:
+        deltas: Counter[int] = Counter()
+        liked = [key for key, value in intents.items() if value]
+        unliked = [key for key, value in intents.items() if not value]
+
+        if liked:
+            existing = set(
+                (
+                    await db.execute(
+                        select(Tweet.id).where(
+                            Tweet.id.in_({tweet_id for _, tweet_id in liked})
+                        )
+                    )
+                ).scalars()
+            )
+            rows = [
+                {"user_id": user_id, "tweet_id": tweet_id}
+                for user_id, tweet_id in liked
+                if tweet_id in existing
+            ]
+            if rows:
+                inserted = await db.execute(
+                    insert_ignoring_conflicts(db, Like)
+                    .values(rows)
+                    .on_conflict_do_nothing(index_elements=["user_id", "tweet_id"])
+                    .returning(Like.tweet_id)
+                )
+                deltas.update(inserted.scalars().all())
+        if unliked:
+            deleted = await db.execute(
+                delete(Like)
+                .where(tuple_(Like.user_id, Like.tweet_id).in_(unliked))
+                .returning(Like.tweet_id)
+            )
+            deltas.subtract(deleted.scalars().all())
+
+        touch_authors(db, *await apply_like_deltas(db, deltas))
+        mark_for_scoring(db, *deltas)
+
+    async def flush(self, session_factory: async_sessionmaker) -> int:
+        """
+        Записывает накопленные намерения одной транзакцией.
+        Возвращает их число.
+        """
+        async with self._lock:
+            self._full.clear()
+            if not self._pending:
+                return 0
+            self._flushing, self._pending = self._pending, {}
+            intents = self._flushing
+            try:
+                async with session_factory() as session:
+                    await self._write(session, intents)
+                    await session.commit()
+            except (SQLAlchemyError, asyncio.CancelledError) as error:
+                # Незаписанные намерения возвращаются, если их не перекрыли новые;
+                # запись идемпотентна, поэтому повтор после коммита безопасен.
+                for key, value in intents.items():
+                    self._pending.setdefault(key, value)
+                if isinstance(error, asyncio.CancelledError):
+                    raise
+                logger.exception("Failed to flush %s buffered likes", len(intents))
+            finally:
+                self._flushing = {}
+            written = {user_id for user_id, _ in intents}
+            pending = {user_id for user_id, _ in self._pending}
+            for user_id in written - pending:
+                self._marks.pop(user_id, None)
+            return len(intents)
+
+    async def run(self, session_factory: async_sessionmaker) -> None:
+        """
+        Фоновая задача: сбрасывает буфер раз в interval секунд или сразу,
+        как только он заполнен.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush(session_factory)
+
+
+like_buffer = LikeBuffer()
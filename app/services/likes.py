@@ -0,0 +1,71 @@
+from typing import Any, Optional
+
+from sqlalchemy import delete, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.like import Like
+from app.models.tweet import Tweet
+from app.services.counters import increment_like_count
+from app.services.ranking import mark_for_scoring
+from app.services.versions import touch_authors
+
+# Диалекты, в которых есть INSERT ... ON CONFLICT DO NOTHING.
+ON_CONFLICT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def insert_ignoring_conflicts(db: AsyncSession, table: Any) -> Any:
+    """
+    Возвращает INSERT с поддержкой ON CONFLICT для диалекта текущей сессии.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect not in ON_CONFLICT_INSERTS:
+        supported = ", ".join(sorted(ON_CONFLICT_INSERTS))
+        raise ValueError(
+            f"Database dialect {dialect!r} is not supported, use one of: {supported}"
+        )
+    return ON_CONFLICT_INSERTS[dialect](table)
+
+
+async def add_like(db: AsyncSession, user_id: int, tweet_id: int) -> Optional[bool]:
+    """
+    Ставит лайк одним INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    Возвращает True, если лайк добавлен, False, если он уже был,
+    и None, если твита не существует.
+    """
+    statement = (
+        insert_ignoring_conflicts(db, Like)
+        .from_select(
+            ["user_id", "tweet_id"],
+            select(literal(user_id), Tweet.id).where(Tweet.id == tweet_id),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "tweet_id"])
+        .returning(Like.id)
+    )
+    inserted = (await db.execute(statement)).scalar_one_or_none()
+    if inserted is not None:
+        touch_authors(db, await increment_like_count(db, tweet_id, 1))
+        mark_for_scoring(db, tweet_id)
+        return True
+
+    # Сюда попадаем только при повторном лайке или несуществующем твите.
+    exists = await db.scalar(select(Tweet.id).where(Tweet.id == tweet_id))
+    return False if exists is not None else None
+
+
+async def remove_like(db: AsyncSession, user_id: int, tweet_id: int) -> bool:
+    """
+    Снимает лайк одним DELETE ... RETURNING. Возвращает True, если лайк был.
+    """
+    deleted = (
+        await db.execute(
+            delete(Like)
+            .where(Like.user_id == user_id, Like.tweet_id == tweet_id)
+            .returning(Like.id)
+        )
+    ).scalar_one_or_none()
+    if deleted is None:
+        return False
+    touch_authors(db, await increment_like_count(db, tweet_id, -1))
+    mark_for_scoring(db, tweet_id)
+    return True
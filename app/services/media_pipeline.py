@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.media import Media
+from app.models.media_variant import MediaVariant
+from app.services import media_storage
+from app.services.versions import touch_authors
+
+logger = logging.getLogger(__name__)
+
+# Максимальная сторона варианта в пикселях; None - исходный размер.
+VARIANT_SIZES: dict[str, Optional[int]] = {
+    "thumbnail": 200,
+    "feed": 1080,
+    "original": None,
+}
+FEED_VARIANT = "feed"
+VARIANT_FORMAT = "JPEG"
+VARIANT_QUALITY = int(os.environ.get("MEDIA_VARIANT_QUALITY", 85))
+MEDIA_WORKERS = int(os.environ.get("MEDIA_WORKERS", 2))
+# Сколько изображений может ждать обработки; остальные остаются без вариантов.
+MEDIA_QUEUE_DEPTH = int(os.environ.get("MEDIA_QUEUE_DEPTH", 32))
+
+
+def variant_filename(content_hash: str, kind: str) -> str:
+    return f"{content_hash}_{kind}.jpg"
+
+
+def render_variants(
+    source_path: str, media_root: str, content_hash: str
+) -> list[tuple[str, str, int, int]]:
+    """
+    Генерирует уменьшенные и перекодированные варианты изображения.
+    Выполняется в отдельном процессе; возвращает (kind, filename, width, height).
+    """
+    variants = []
+    with Image.open(source_path) as source:
+        source.load()
+        for kind, max_side in VARIANT_SIZES.items():
+            filename = variant_filename(content_hash, kind)
+            path = os.path.join(media_root, filename)
+            if os.path.exists(path):
+                with Image.open(path) as existing:
+                    width, height = existing.size
+            else:
+                image = source.convert("RGB")
+                if max_side is not None:
+                    image.thumbnail((max_side, max_side))
+                temp_path = f"{path}.part"
+                try:
+                    image.save(
+                        temp_path,
+                        format=VARIANT_FORMAT,
+                        quality=VARIANT_QUALITY,
+                        optimize=True,
+                    )
+                    os.replace(temp_path, path)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+                width, height = image.size
+            variants.append((kind, filename, width, height))
+    return variants
+
+
+def _remove_variants(media_root: str, filenames: list[str]) -> None:
+    for filename in filenames:
+        path = os.path.join(media_root, filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def _save_variants(
+    session: AsyncSession,
+    media_id: int,
+    variants: list[tuple[str, str, int, int]],
+    owner_id: Optional[int],
+) -> bool:
+    """
+    Записывает варианты, если медиа еще существует. Строка Media
+    блокируется до коммита, чтобы удаление не проскочило между проверкой
+    и вставкой.
+    """
+    exists = await session.scalar(
+        select(Media.id).where(Media.id == media_id).with_for_update()
+    )
+    if exists is None:
+        return False
+    await session.execute(
+        insert(MediaVariant),
+        [
+            {
+                "media_id": media_id,
+                "kind": kind,
+                "file_path": media_storage.media_url(filename),
+                "width": width,
+                "height": height,
+            }
+            for kind, filename, width, height in variants
+        ],
+    )
+    # Вложение в ленте переключится на вариант: меняется ETag автора.
+    touch_authors(session, owner_id)
+    await session.commit()
+    return True
+
+
+async def _discard_variants(session: AsyncSession, content_hash: str) -> None:
+    """
+    Удаляет файлы вариантов, на которые не ссылается ни одна запись
+    MediaVariant (те же файлы могут принадлежать другому медиа с тем же
+    содержимым).
+    """
+    filenames = [variant_filename(content_hash, kind) for kind in VARIANT_SIZES]
+    referenced = set(
+        await session.scalars(
+            select(MediaVariant.file_path).where(
+                MediaVariant.file_path.in_(
+                    [media_storage.media_url(filename) for filename in filenames]
+                )
+            )
+        )
+    )
+    await run_in_threadpool(
+        _remove_variants,
+        media_storage.MEDIA_ROOT,
+        [
+            filename
+            for filename in filenames
+            if media_storage.media_url(filename) not in referenced
+        ],
+    )
+
+
+class MediaPipeline:
+    """
+    Фоновая генерация вариантов изображений в пуле процессов.
+    Пул и очередь ограничены: при переполнении загрузка проходит без
+    вариантов, и лента отдает исходный файл.
+    """
+
+    def __init__(
+        self, workers: int = MEDIA_WORKERS, queue_depth: int = MEDIA_QUEUE_DEPTH
+    ):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.dropped = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def submit(
+        self,
+        media_id: int,
+        stored: media_storage.StoredMedia,
+        session_factory: async_sessionmaker[AsyncSession],
+        owner_id: Optional[int] = None,
+    ) -> bool:
+        """
+        Ставит изображение в очередь обработки. Возвращает False, если очередь полна.
+        """
+        if len(self._tasks) >= self.queue_depth:
+            self.dropped += 1
+            logger.warning("Media queue is full, skipping variants for %s", media_id)
+            return False
+        task = asyncio.create_task(
+            self._process(media_id, stored, session_factory, owner_id)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _process(
+        self,
+        media_id: int,
+        stored: media_storage.StoredMedia,
+        session_factory: async_sessionmaker[AsyncSession],
+        owner_id: Optional[int],
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        variants: list[tuple[str, str, int, int]] = []
+        try:
+            variants = await loop.run_in_executor(
+                self.executor,
+                render_variants,
+                media_storage.media_path(stored.file_path),
+                media_storage.MEDIA_ROOT,
+                stored.content_hash,
+            )
+        except (OSError, ValueError, RuntimeError, Image.DecompressionBombError):
+            logger.exception("Failed to build variants for media %s", media_id)
+
+        async with session_factory() as session:
+            # Под блокировкой содержимого release_files не удалит файлы
+            # между проверкой медиа и вставкой вариантов.
+            try:
+                async with media_storage.content_lock(session, stored.content_hash):
+                    if variants and await _save_variants(
+                        session, media_id, variants, owner_id
+                    ):
+                        return
+            except SQLAlchemyError:
+                logger.exception("Failed to save variants for media %s", media_id)
+
+            # Медиа удалено или варианты не сохранились: файлы никому не нужны.
+            try:
+                async with media_storage.content_lock(session, stored.content_hash):
+                    await _discard_variants(session, stored.content_hash)
+            except (OSError, SQLAlchemyError):
+                logger.exception("Failed to discard variants for media %s", media_id)
+
+    async def drain(self) -> None:
+        """
+        Дожидается завершения всех поставленных задач.
+        """
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def shutdown(self) -> None:
+        await self.drain()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+media_pipeline = MediaPipeline()
@@ -0,0 +1,324 @@
+import asyncio
+import glob
+import hashlib
+import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, BinaryIO, Iterable, NamedTuple, Optional
+from weakref import WeakValueDictionary
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.media import Media
+
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", "/media")
+MEDIA_URL_PREFIX = "/media"
+# Совпадает с client_max_body_size в server/nginx.conf.
+MEDIA_MAX_SIZE = int(os.environ.get("MEDIA_MAX_SIZE", 20 * 1024 * 1024))
+# Части тела копятся до этого размера и пишутся на диск одним вызовом.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 64 * 1024))
+# Запас на заголовки и границы multipart сверх размера самого файла.
+MEDIA_FORM_OVERHEAD = 64 * 1024
+
+
+# Блокировки содержимого по хэшу; освобожденные удаляются сами.
+_content_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+class StoredMedia(NamedTuple):
+    file_path: str
+    content_hash: str
+
+
+def _discard(buffer: BinaryIO, path: str) -> None:
+    buffer.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _publish(temp_path: str, final_path: str) -> None:
+    # Файл с тем же содержимым уже лежит на диске: повторно не сохраняем.
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, final_path)
+
+
+def upload_limit() -> int:
+    """
+    Наибольший допустимый размер тела запроса загрузки.
+    """
+    return MEDIA_MAX_SIZE + MEDIA_FORM_OVERHEAD
+
+
+def media_url(filename: str) -> str:
+    return f"{MEDIA_URL_PREFIX}/{filename}"
+
+
+def is_content_hash(name: str) -> bool:
+    return len(name) == 64 and all(char in "0123456789abcdef" for char in name)
+
+
+def media_path(url: str) -> str:
+    """
+    Путь к файлу медиа на диске. Исходные файлы хранятся под одним хэшем
+    содержимого: одинаковые байты с разными расширениями - один файл.
+    Расширение остается в URL (записи Media), по нему nginx выбирает
+    Content-Type.
+    """
+    name = os.path.basename(url)
+    stem = os.path.splitext(name)[0]
+    return os.path.join(MEDIA_ROOT, stem if is_content_hash(stem) else name)
+
+
+@asynccontextmanager
+async def content_lock(db: AsyncSession, content_hash: str) -> AsyncIterator[None]:
+    """
+    Блокировка содержимого: публикация файла вместе с коммитом записи Media
+    и удаление файла после подсчета ссылок не пересекаются. В процессе -
+    asyncio.Lock, между воркерами - advisory-блокировка Postgres, которая
+    держится до конца транзакции сессии.
+    """
+    lock = _content_locks.get(content_hash)
+    if lock is None:
+        lock = _content_locks[content_hash] = asyncio.Lock()
+    async with lock:
+        try:
+            await _lock_transaction(db, content_hash)
+            yield
+        finally:
+            # Транзакция, не закоммиченная внутри блока, освобождает блокировку.
+            if db.in_transaction():
+                await db.rollback()
+
+
+async def _lock_transaction(db: AsyncSession, content_hash: str) -> None:
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"),
+            {"key": int(content_hash[:15], 16)},
+        )
+
+
+class _FilePart:
+    """
+    Приемник части формы с файлом: пишет ее во временный файл в MEDIA_ROOT
+    вне event loop и считает хэш по ходу записи.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.temp_path = os.path.join(MEDIA_ROOT, f".{uuid.uuid4().hex}.part")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self._chunks: list[bytes] = []
+        self._buffered = 0
+        self._buffer: Optional[BinaryIO] = None
+
+    async def open(self) -> None:
+        await run_in_threadpool(os.makedirs, MEDIA_ROOT, exist_ok=True)
+        self._buffer = await run_in_threadpool(open, self.temp_path, "wb")
+
+    async def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > MEDIA_MAX_SIZE:
+            raise MediaTooLarge(f"File exceeds {MEDIA_MAX_SIZE} bytes")
+        self.digest.update(data)
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered >= UPLOAD_CHUNK_SIZE:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        assert self._buffer is not None
+        chunks, self._chunks, self._buffered = self._chunks, [], 0
+        await run_in_threadpool(self._buffer.writelines, chunks)
+
+    async def close(self) -> None:
+        assert self._buffer is not None
+        await self._flush()
+        await run_in_threadpool(self._buffer.close)
+
+    async def discard(self) -> None:
+        if self._buffer is not None:
+            await run_in_threadpool(_discard, self._buffer, self.temp_path)
+
+
+async def _receive(request: Request, field: str) -> _FilePart:
+    """
+    Читает тело multipart/form-data потоком и пишет поле field сразу
+    во временный файл; остальные поля пропускаются.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise InvalidUpload("Expected multipart/form-data with a boundary")
+
+    # Парсер синхронный: события копятся в списке и обрабатываются после
+    # каждого куска тела.
+    events: list[tuple[str, Any]] = []
+    header_field, header_value = bytearray(), bytearray()
+    headers: dict[bytes, bytes] = {}
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        header_value.extend(data[start:end])
+
+    def on_header_end() -> None:
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished() -> None:
+        events.append(("headers", dict(headers)))
+        headers.clear()
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        events.append(("data", data[start:end]))
+
+    def on_part_end() -> None:
+        events.append(("end", None))
+
+    parser = MultipartParser(
+        options[b"boundary"],
+        {
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        },
+    )
+
+    received: Optional[_FilePart] = None
+    writing = False
+
+    async def handle_events() -> None:
+        nonlocal received, writing
+        for kind, value in events:
+            if kind == "headers":
+                _, disposition = parse_options_header(value.get(b"content-disposition"))
+                filename = disposition.get(b"filename")
+                if (
+                    received is None
+                    and disposition.get(b"name") == field.encode()
+                    and filename is not None
+                ):
+                    received = _FilePart(os.path.basename(filename.decode()))
+                    await received.open()
+                    writing = True
+            elif kind == "data" and writing:
+                assert received is not None
+                await received.write(value)
+            elif kind == "end" and writing:
+                assert received is not None
+                await received.close()
+                writing = False
+        events.clear()
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await handle_events()
+        parser.finalize()
+        await handle_events()
+        if writing:
+            raise InvalidUpload("Multipart body ended inside the file")
+    except MultipartParseError as error:
+        if received is not None:
+            await received.discard()
+        raise InvalidUpload(f"Malformed multipart body: {error}") from error
+    except BaseException:
+        if received is not None:
+            await received.discard()
+        raise
+
+    if received is None:
+        raise InvalidUpload(f"Field {field!r} with a file is required")
+    if not received.filename:
+        await received.discard()
+        raise InvalidUpload("Filename is required")
+    return received
+
+
+@asynccontextmanager
+async def save_upload(
+    db: AsyncSession, request: Request, field: str = "file"
+) -> AsyncIterator[StoredMedia]:
+    """
+    Сохраняет файл из поля field формы запроса в MEDIA_ROOT под именем -
+    SHA-256 содержимого. Тело читается потоком прямо из запроса (размер
+    тела ограничивает маршрут загрузки): байты файла пишутся во временный
+    файл вне event loop, хэш считается по ходу записи, после чего файл
+    атомарно переименовывается (или отбрасывается, если такой уже есть).
+    Каждый байт попадает на диск один раз.
+
+    Запись Media коммитится внутри блока, под блокировкой содержимого:
+    иначе release_files мог бы удалить файл, который она уже использует.
+    Если блок завершается ошибкой, опубликованный файл удаляется, когда на
+    его содержимое не ссылается ни одна запись Media.
+    """
+    received = await _receive(request, field)
+    content_hash = received.digest.hexdigest()
+    extension = os.path.splitext(received.filename)[1].lower()
+    path = os.path.join(MEDIA_ROOT, content_hash)
+    async with content_lock(db, content_hash):
+        await run_in_threadpool(_publish, received.temp_path, path)
+        try:
+            yield StoredMedia(
+                file_path=media_url(f"{content_hash}{extension}"),
+                content_hash=content_hash,
+            )
+        except BaseException:
+            # Откат снимает advisory-блокировку: берем ее снова до подсчета.
+            await db.rollback()
+            await _lock_transaction(db, content_hash)
+            await _remove_unreferenced(db, content_hash, path)
+            raise
+
+
+async def release_files(
+    db: AsyncSession, released: Iterable[tuple[Optional[str], str]]
+) -> None:
+    """
+    Удаляет файлы удаленных медиа (вместе с вариантами), на которые больше
+    не ссылается ни одна запись Media (счетчик ссылок считается по индексу
+    content_hash). Вызывается после коммита удаления; подсчет и удаление
+    идут под блокировкой содержимого.
+    """
+    for content_hash, file_path in set(released):
+        if content_hash is None:
+            continue
+        async with content_lock(db, content_hash):
+            await _remove_unreferenced(db, content_hash, media_path(file_path))
+
+
+async def _remove_unreferenced(db: AsyncSession, content_hash: str, path: str) -> None:
+    references = await db.scalar(
+        select(func.count()).where(Media.content_hash == content_hash)
+    )
+    if not references:
+        await run_in_threadpool(_remove_files, path, content_hash)
+
+
+def _remove_files(path: str, content_hash: str) -> None:
+    # Вместе с исходным файлом удаляются его варианты (<hash>_<kind>.jpg).
+    variants = glob.glob(os.path.join(MEDIA_ROOT, f"{content_hash}_*"))
+    for file_path in [path, *variants]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
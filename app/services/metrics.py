@@ -0,0 +1,150 @@
+import math
+from bisect import bisect_left
+from typing import Sequence
+
+# Границы корзин в секундах: от миллисекунды до десятков секунд.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с фиксированными корзинами в духе Prometheus:
+    счетчики корзин накопительные, последняя корзина - +Inf.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        result, total = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": {
+                "+Inf" if math.isinf(bound) else str(bound): count
+                for bound, count in self.cumulative()
+            },
+        }
+
+
+# Корзины для числа SQL-выражений на запрос и размера ответа в байтах.
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RouteMetrics:
+    """
+    Метрики одного маршрута: задержка, число и время SQL-выражений,
+    размер ответа и количество ответов по статусам.
+    """
+
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.db_statements = Histogram(STATEMENT_BUCKETS)
+        self.db_time = Histogram()
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.responses: dict[int, int] = {}
+
+
+class MetricsRegistry:
+    """
+    Метрики запросов по маршрутам (method + шаблон пути) в памяти процесса.
+    """
+
+    def __init__(self) -> None:
+        self.routes: dict[tuple[str, str], RouteMetrics] = {}
+
+    def observe(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        latency: float,
+        statements: int,
+        db_time: float,
+        response_bytes: int,
+    ) -> None:
+        metrics = self.routes.get((method, route))
+        if metrics is None:
+            metrics = self.routes[(method, route)] = RouteMetrics()
+        metrics.latency.observe(latency)
+        metrics.db_statements.observe(statements)
+        metrics.db_time.observe(db_time)
+        metrics.response_bytes.observe(response_bytes)
+        metrics.responses[status] = metrics.responses.get(status, 0) + 1
+
+    def clear(self) -> None:
+        self.routes.clear()
+
+    def render(self) -> str:
+        """
+        Возвращает метрики в текстовом формате Prometheus.
+        """
+        lines: list[str] = []
+        lines += metric_header(
+            "http_requests_total", "counter", "Responses by route and status."
+        )
+        for (method, route), metrics in sorted(self.routes.items()):
+            for status, count in sorted(metrics.responses.items()):
+                labels = _labels(method=method, route=route, status=str(status))
+                lines.append(f"http_requests_total{{{labels}}} {count}")
+
+        for name, attribute, help_text in (
+            ("http_request_duration_seconds", "latency", "Request latency."),
+            (
+                "http_request_db_statements",
+                "db_statements",
+                "SQL statements per request.",
+            ),
+            ("http_request_db_seconds", "db_time", "Time spent in SQL per request."),
+            ("http_response_size_bytes", "response_bytes", "Response body size."),
+        ):
+            lines += metric_header(name, "histogram", help_text)
+            for (method, route), metrics in sorted(self.routes.items()):
+                histogram = getattr(metrics, attribute)
+                lines += render_histogram(name, histogram, method=method, route=route)
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(
+        '{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+
+
+def metric_header(name: str, kind: str, help_text: str) -> list[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+def render_histogram(name: str, histogram: Histogram, **labels: str) -> list[str]:
+    prefix = _labels(**labels)
+    separator = "," if prefix else ""
+    lines = [
+        f'{name}_bucket{{{prefix}{separator}le="{_format_bound(bound)}"}} {count}'
+        for bound, count in histogram.cumulative()
+    ]
+    lines.append(f"{name}_sum{{{prefix}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{prefix}}} {histogram.count}")
+    return lines
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,47 @@
+import base64
+import json
+import math
+from datetime import datetime
+from typing import Any
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Кодирует ключ сортировки последней записи страницы в непрозрачный курсор.
+    Даты кодируются в ISO-формате.
+    """
+    raw = json.dumps(
+        values, separators=(",", ":"), default=lambda value: value.isoformat()
+    ).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _coerce(value: Any, kind: type) -> Any:
+    # bool - подкласс int, но в ключе сортировки не встречается.
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if kind is int and isinstance(value, int):
+        return value
+    if kind is float and isinstance(value, (int, float)) and math.isfinite(value):
+        return value
+    if kind is datetime and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    raise ValueError(value)
+
+
+def decode_cursor(cursor: str, *kinds: type) -> list[Any]:
+    """
+    Декодирует курсор, проверяя количество и типы значений в ключе
+    сортировки: int - идентификатор, float - любое число, datetime - дата
+    в ISO-формате.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(kinds):
+            raise ValueError(values)
+        return [_coerce(value, kind) for value, kind in zip(values, kinds)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import event, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+from app.models.tweet import Tweet
+from app.services.versions import touch_authors
+
+# Период полураспада "горячести": вдвое больше лайков окупают столько секунд возраста.
+HOT_HALF_LIFE = int(os.environ.get("HOT_HALF_LIFE", 6 * 3600))
+# Свежесть оценок: как часто фоновая задача пересчитывает измененные твиты.
+HOT_SCORE_INTERVAL = float(os.environ.get("HOT_SCORE_INTERVAL", 5))
+# Сколько твитов пересчитывается одним запросом.
+HOT_SCORE_BATCH_SIZE = int(os.environ.get("HOT_SCORE_BATCH_SIZE", 1000))
+# Твиты моложе окна пересчитываются при старте: отметки об изменениях
+# живут в памяти и теряются при перезапуске.
+HOT_WINDOW = int(os.environ.get("HOT_WINDOW", 7 * 86400))
+
+_EPOCH = datetime(1970, 1, 1)
+_PENDING_KEY = "pending_hot_scores"
+
+logger = logging.getLogger(__name__)
+
+
+def hot_score(like_count: int, created_at: datetime) -> float:
+    """
+    Оценка для ленты order=hot: log2(1 + лайки) плюс время создания в
+    периодах полураспада. Порядок по ней совпадает с порядком по
+    (1 + лайки) * 2^(-возраст / HOT_HALF_LIFE), но значение не зависит
+    от текущего времени, поэтому пересчитывать нужно только твиты с новыми
+    лайками, а лента читает готовую колонку по индексу.
+    """
+    age = (created_at - _EPOCH).total_seconds()
+    return math.log2(1 + max(like_count, 0)) + age / HOT_HALF_LIFE
+
+
+class HotScorer:
+    """
+    Фоновый пересчет Tweet.hot_score. Лайки отмечают твиты после коммита,
+    задача раз в HOT_SCORE_INTERVAL секунд пересчитывает отмеченные
+    твиты пачками по HOT_SCORE_BATCH_SIZE.
+    """
+
+    def __init__(self) -> None:
+        self._dirty: set[int] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def mark(self, tweet_ids: Iterable[int]) -> None:
+        self._dirty.update(tweet_ids)
+
+    def clear(self) -> None:
+        self._dirty.clear()
+
+    async def score(self, db: AsyncSession, tweet_ids: Iterable[int]) -> None:
+        rows = (
+            await db.execute(
+                select(
+                    Tweet.id, Tweet.like_count, Tweet.created_at, Tweet.author_id
+                ).where(Tweet.id.in_(list(tweet_ids)))
+            )
+        ).all()
+        if not rows:
+            return
+        await db.execute(
+            update(Tweet),
+            [
+                {"id": row.id, "hot_score": hot_score(row.like_count, row.created_at)}
+                for row in rows
+            ],
+        )
+        # Порядок ленты order=hot изменился: ETag авторов должен смениться.
+        touch_authors(db, *{row.author_id for row in rows})
+
+    async def run_once(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: int = HOT_SCORE_BATCH_SIZE,
+    ) -> int:
+        """
+        Пересчитывает одну пачку отмеченных твитов. Возвращает ее размер.
+        """
+        batch = [self._dirty.pop() for _ in range(min(batch_size, len(self._dirty)))]
+        if not batch:
+            return 0
+        try:
+            async with session_factory() as session:
+                await self.score(session, batch)
+                await session.commit()
+        except SQLAlchemyError:
+            self._dirty.update(batch)
+            logger.exception("Failed to update hot scores")
+        return len(batch)
+
+    async def run(
+        self,
+        session_factory: async_sessionmaker,
+        interval: float = HOT_SCORE_INTERVAL,
+        batch_size: int = HOT_SCORE_BATCH_SIZE,
+    ) -> None:
+        while True:
+            while self._dirty:
+                await self.run_once(session_factory, batch_size)
+                await asyncio.sleep(0)
+            await asyncio.sleep(interval)
+
+
+hot_scorer = HotScorer()
+
+
+def mark_for_scoring(db: AsyncSession, *tweet_ids: Optional[int]) -> None:
+    """
+    Отмечает твиты, чьи лайки изменила текущая транзакция.
+    Оценки пересчитаются после коммита.
+    """
+    pending = db.info.setdefault(_PENDING_KEY, set())
+    pending.update(tweet_id for tweet_id in tweet_ids if tweet_id is not None)
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_committed(session: Session) -> None:
+    hot_scorer.mark(session.info.pop(_PENDING_KEY, ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+async def mark_recent(db: AsyncSession, window: int = HOT_WINDOW) -> int:
+    """
+    Отмечает для пересчета все твиты моложе окна. Возвращает их число.
+    """
+    since = datetime.utcnow() - timedelta(seconds=window)
+    result = await db.execute(select(Tweet.id).where(Tweet.created_at >= since))
+    tweet_ids = result.scalars().all()
+    hot_scorer.mark(tweet_ids)
+    return len(tweet_ids)
+
+
+async def rescore_all(db: AsyncSession, batch_size: int = HOT_SCORE_BATCH_SIZE) -> None:
+    """
+    Пересчитывает оценки всех твитов (после массовой загрузки или миграции).
+    """
+    tweet_ids = (await db.execute(select(Tweet.id))).scalars().all()
+    for start in range(0, len(tweet_ids), batch_size):
+        end = start + batch_size
+        await hot_scorer.score(db, tweet_ids[start:end])
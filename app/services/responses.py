@@ -0,0 +1,38 @@
+from typing import Any
+
+from fastapi.responses import Response
+from pydantic_core import to_json
+
+from app.models.tweet import Tweet
+
+
+class TrustedJSONResponse(Response):
+    """
+    JSON-ответ для данных, собранных из доверенных внутренних источников
+    по форме response_model маршрута: повторная валидация и jsonable-
+    преобразование пропускаются, сериализация выполняется в pydantic-core.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def feed_item(tweet: Tweet) -> dict[str, Any]:
+    """
+    Собирает элемент ленты (форма TweetInFeed) из твита, загруженного
+    с профилем feed_item.
+    """
+    return {
+        "id": tweet.id,
+        "content": tweet.content,
+        "attachments": [
+            next((variant.file_path for variant in media.variants), media.file_path)
+            for media in tweet.media
+        ],
+        "author": {"id": tweet.author.id, "name": tweet.author.name},
+        "likes": [
+            {"user_id": like.user_id, "name": like.user.name} for like in tweet.likes
+        ],
+    }
@@ -0,0 +1,94 @@
+import re
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import (
+    ColumnElement,
+    and_,
+    column,
+    delete,
+    func,
+    insert,
+    literal_column,
+    or_,
+    select,
+    table,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tweet import FTS_TABLE, TS_CONFIG, Tweet
+
+_fts = table(FTS_TABLE, column("rowid"), column("content"))
+_search_vector: ColumnElement = literal_column("tweets.search_vector")
+
+
+def search_terms(query: str) -> list[str]:
+    return re.findall(r"\w+", query.lower())
+
+
+def _dialect(db: AsyncSession) -> str:
+    return db.get_bind().dialect.name
+
+
+async def index_tweets(db: AsyncSession, tweets: Iterable[tuple[int, str]]) -> None:
+    """
+    Добавляет новые твиты в поисковый индекс. В Postgres индекс ведет
+    генерируемая колонка, поэтому действие нужно только для SQLite.
+    """
+    rows = [{"rowid": tweet_id, "content": content} for tweet_id, content in tweets]
+    if rows and _dialect(db) == "sqlite":
+        await db.execute(insert(_fts), rows)
+
+
+async def unindex_tweets(db: AsyncSession, tweet_ids: Sequence[int]) -> None:
+    if tweet_ids and _dialect(db) == "sqlite":
+        await db.execute(delete(_fts).where(_fts.c.rowid.in_(tweet_ids)))
+
+
+async def rebuild_index(db: AsyncSession) -> None:
+    """
+    Пересобирает индекс SQLite по таблице tweets (после массовой загрузки).
+    """
+    if _dialect(db) == "sqlite":
+        await db.execute(delete(_fts))
+        await db.execute(
+            insert(_fts).from_select(
+                ["rowid", "content"], select(Tweet.id, Tweet.content)
+            )
+        )
+
+
+async def search_tweet_ids(
+    db: AsyncSession,
+    terms: Sequence[str],
+    limit: int,
+    after: Optional[tuple[float, int]] = None,
+) -> list[tuple[int, float]]:
+    """
+    Возвращает (id, score) твитов, содержащих все термы, по убыванию
+    релевантности, затем id. after - (score, id) последнего показанного твита.
+    """
+    if _dialect(db) == "postgresql":
+        ts_query = func.plainto_tsquery(TS_CONFIG, " ".join(terms))
+        score: ColumnElement[float] = func.ts_rank_cd(_search_vector, ts_query)
+        query = select(Tweet.id, score.label("score")).where(
+            _search_vector.op("@@")(ts_query)
+        )
+    else:
+        match = " ".join(f'"{term}"' for term in terms)
+        score = -func.bm25(literal_column(FTS_TABLE))
+        query = (
+            select(Tweet.id, score.label("score"))
+            .select_from(_fts)
+            .join(Tweet, Tweet.id == _fts.c.rowid)
+            .where(literal_column(FTS_TABLE).op("MATCH")(match))
+        )
+
+    if after is not None:
+        last_score, last_id = after
+        query = query.where(
+            or_(score < last_score, and_(score == last_score, Tweet.id < last_id))
+        )
+    result = await db.execute(
+        query.order_by(score.desc(), Tweet.id.desc()).limit(limit)
+    )
+    return [(row.id, row.score) for row in result]
@@ -0,0 +1,377 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+from app.models.tag import TAG_MAX_LENGTH, TrendingCheckpoint, TweetMention, TweetTag
+from app.models.tweet import Tweet
+from app.services.cache import SharedCache, shared_cache
+
+# Окно трендов и шаг его скольжения, в секундах.
+TRENDING_WINDOW = int(os.environ.get("TRENDING_WINDOW", 3600))
+TRENDING_BUCKET = int(os.environ.get("TRENDING_BUCKET", 60))
+# Как часто счетчики трендов сохраняются в базу.
+TRENDING_CHECKPOINT_INTERVAL = int(os.environ.get("TRENDING_CHECKPOINT_INTERVAL", 60))
+
+TAG_PATTERN = re.compile(rf"#(\w{{1,{TAG_MAX_LENGTH}}})")
+MENTION_PATTERN = re.compile(rf"@(\w{{1,{TAG_MAX_LENGTH}}})")
+
+_CHECKPOINT_ID = 1
+_EPOCH = datetime(1970, 1, 1)
+_PENDING_KEY = "pending_trending"
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_tag(tag: str) -> str:
+    return tag.lstrip("#@").casefold()
+
+
+def _extract(pattern: re.Pattern, content: str) -> list[str]:
+    return list(dict.fromkeys(match.casefold() for match in pattern.findall(content)))
+
+
+def extract_tags(content: str) -> list[str]:
+    """
+    Возвращает хэштеги твита без '#', в нижнем регистре, без повторов.
+    """
+    return _extract(TAG_PATTERN, content)
+
+
+def extract_mentions(content: str) -> list[str]:
+    return _extract(MENTION_PATTERN, content)
+
+
+class _SlidingWindow:
+    """
+    Окно трендов, разбитое на интервалы по bucket секунд.
+    """
+
+    def __init__(self, window: int = TRENDING_WINDOW, bucket: int = TRENDING_BUCKET):
+        self.window = window
+        self.bucket = bucket
+
+    def _bucket(self, at: datetime) -> int:
+        return int((at - _EPOCH).total_seconds()) // self.bucket
+
+    def _oldest_bucket(self, now: datetime) -> int:
+        return self._bucket(now) - self.window // self.bucket + 1
+
+
+class TrendingCounter(_SlidingWindow):
+    """
+    Скользящее окно счетчиков хэштегов в памяти процесса (один воркер):
+    итоги по окну хранятся отдельно и уменьшаются, когда старый интервал
+    выходит из окна. Выдача трендов не обращается к базе; между
+    перезапусками счетчики переживают через контрольную точку.
+    """
+
+    def __init__(self, window: int = TRENDING_WINDOW, bucket: int = TRENDING_BUCKET):
+        super().__init__(window, bucket)
+        self.buckets: dict[int, Counter[str]] = {}
+        self.totals: Counter[str] = Counter()
+        # Наибольший учтенный id твита: после восстановления из контрольной
+        # точки догружаются только более новые твиты.
+        self.last_tweet_id = 0
+
+    def add(self, tags: Iterable[str], at: datetime, delta: int = 1) -> None:
+        key = self._bucket(at)
+        if key < self._oldest_bucket(datetime.utcnow()):
+            return
+        counts = self.buckets.setdefault(key, Counter())
+        for tag in tags:
+            counts[tag] += delta
+            self.totals[tag] += delta
+            if counts[tag] <= 0:
+                del counts[tag]
+            if self.totals[tag] <= 0:
+                del self.totals[tag]
+
+    def expire(self, now: Optional[datetime] = None) -> None:
+        oldest = self._oldest_bucket(now or datetime.utcnow())
+        for key in [key for key in self.buckets if key < oldest]:
+            self.totals.subtract(self.buckets.pop(key))
+        for tag in [tag for tag, total in self.totals.items() if total <= 0]:
+            del self.totals[tag]
+
+    def top(self, limit: int) -> list[tuple[str, int]]:
+        self.expire()
+        # Чаще встречающиеся теги первыми, при равенстве - по алфавиту.
+        return heapq.nsmallest(
+            limit, self.totals.items(), key=lambda item: (-item[1], item[0])
+        )
+
+    def snapshot(self) -> dict:
+        self.expire()
+        return {
+            "bucket": self.bucket,
+            "buckets": {str(key): dict(counts) for key, counts in self.buckets.items()},
+        }
+
+    def load(self, snapshot: dict, last_tweet_id: int) -> None:
+        self.clear()
+        if snapshot.get("bucket") == self.bucket:
+            for key, counts in snapshot["buckets"].items():
+                self.buckets[int(key)] = Counter(counts)
+                self.totals.update(counts)
+            self.expire()
+        self.last_tweet_id = last_tweet_id
+
+    def clear(self) -> None:
+        self.buckets.clear()
+        self.totals.clear()
+        self.last_tweet_id = 0
+
+
+trending = TrendingCounter()
+
+
+class SharedTrending(_SlidingWindow):
+    """
+    Счетчики хэштегов в общем кэше воркеров: по одному набору счетчиков на
+    интервал, с временем жизни чуть больше окна. Каждый воркер прибавляет
+    свои изменения, тренды суммируются хранилищем по интервалам окна,
+    поэтому все воркеры отдают одни и те же тренды. Контрольная точка не
+    нужна: счетчики переживают перезапуск воркеров вместе с хранилищем.
+    """
+
+    def __init__(
+        self,
+        cache: SharedCache,
+        window: int = TRENDING_WINDOW,
+        bucket: int = TRENDING_BUCKET,
+    ):
+        super().__init__(window, bucket)
+        self.cache = cache
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache.backend.shared
+
+    def _key(self, bucket: int) -> str:
+        return f"trending:{self.bucket}:{bucket}"
+
+    def add(self, tags: Iterable[str], at: datetime, delta: int = 1) -> None:
+        bucket = self._bucket(at)
+        if bucket < self._oldest_bucket(datetime.utcnow()):
+            return
+        self.cache.increment_scores_soon(
+            self._key(bucket), dict.fromkeys(tags, delta), self.window + self.bucket
+        )
+
+    async def top(self, limit: int) -> list[tuple[str, int]]:
+        now = datetime.utcnow()
+        buckets = range(self._oldest_bucket(now), self._bucket(now) + 1)
+        return await self.cache.top_scores([self._key(b) for b in buckets], limit)
+
+    async def restore(self, db: AsyncSession) -> None:
+        """
+        Заполняет пустое хранилище хэштегами твитов окна. Заполняет один
+        воркер - первым занявший ключ-отметку; отметка живет, пока живы
+        счетчики. Твит, закоммиченный другим воркером между отметкой и
+        чтением окна, учитывается дважды.
+        """
+        if not await self.cache.add(f"trending:{self.bucket}:restored", True):
+            return
+        since = datetime.utcnow() - timedelta(seconds=self.window)
+        result = await db.execute(
+            select(TweetTag.tag, Tweet.created_at)
+            .join(Tweet, Tweet.id == TweetTag.tweet_id)
+            .where(Tweet.created_at >= since)
+        )
+        buckets: dict[int, Counter[str]] = {}
+        for tag, created_at in result:
+            buckets.setdefault(self._bucket(created_at), Counter())[tag] += 1
+        for bucket, counts in buckets.items():
+            await self.cache.increment_scores(
+                self._key(bucket), dict(counts), self.window + self.bucket
+            )
+
+
+shared_trending = SharedTrending(shared_cache)
+
+
+async def top_trending(limit: int) -> list[tuple[str, int]]:
+    """
+    Самые частые хэштеги окна: из общего кэша, если он общий для воркеров,
+    иначе из счетчиков процесса.
+    """
+    if shared_trending.enabled:
+        return await shared_trending.top(limit)
+    return trending.top(limit)
+
+
+@dataclass
+class _TagChange:
+    tags: list[str]
+    at: datetime
+    delta: int
+    tweet_id: int
+
+
+def _pending(db: AsyncSession) -> list[_TagChange]:
+    return db.info.setdefault(_PENDING_KEY, [])
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed(session: Session) -> None:
+    for change in session.info.pop(_PENDING_KEY, []):
+        if shared_trending.enabled:
+            shared_trending.add(change.tags, change.at, change.delta)
+            continue
+        trending.add(change.tags, change.at, change.delta)
+        if change.delta > 0:
+            trending.last_tweet_id = max(trending.last_tweet_id, change.tweet_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+async def index_tags(
+    db: AsyncSession, tweets: Iterable[tuple[int, str]], created_at: datetime
+) -> None:
+    """
+    Заносит хэштеги и упоминания новых твитов в индексы. Счетчики трендов
+    обновятся после коммита.
+    """
+    tag_rows, mention_rows = [], []
+    for tweet_id, content in tweets:
+        tags = extract_tags(content)
+        tag_rows += [{"tag": tag, "tweet_id": tweet_id} for tag in tags]
+        mention_rows += [
+            {"handle": handle, "tweet_id": tweet_id}
+            for handle in extract_mentions(content)
+        ]
+        if tags:
+            _pending(db).append(_TagChange(tags, created_at, 1, tweet_id))
+    if tag_rows:
+        await db.execute(insert(TweetTag), tag_rows)
+    if mention_rows:
+        await db.execute(insert(TweetMention), mention_rows)
+
+
+async def unindex_tags(db: AsyncSession, tweet_id: int, created_at: datetime) -> None:
+    """
+    Удаляет хэштеги и упоминания твита из индексов и из счетчиков трендов.
+    """
+    removed = await db.execute(
+        delete(TweetTag).where(TweetTag.tweet_id == tweet_id).returning(TweetTag.tag)
+    )
+    tags = list(removed.scalars().all())
+    await db.execute(delete(TweetMention).where(TweetMention.tweet_id == tweet_id))
+    if tags:
+        _pending(db).append(_TagChange(tags, created_at, -1, tweet_id))
+
+
+async def tagged_tweet_ids(
+    db: AsyncSession, tag: str, limit: int, before_id: Optional[int] = None
+) -> list[int]:
+    """
+    Возвращает id твитов с хэштегом от новых к старым - диапазон первичного
+    ключа (tag, tweet_id), без чтения таблицы твитов.
+    """
+    query = select(TweetTag.tweet_id).where(TweetTag.tag == tag)
+    if before_id is not None:
+        query = query.where(TweetTag.tweet_id < before_id)
+    result = await db.execute(query.order_by(TweetTag.tweet_id.desc()).limit(limit))
+    return list(result.scalars().all())
+
+
+async def rebuild_tags(db: AsyncSession) -> None:
+    """
+    Пересобирает индексы хэштегов и упоминаний по таблице tweets
+    (после массовой загрузки или миграции).
+    """
+    await db.execute(delete(TweetTag))
+    await db.execute(delete(TweetMention))
+    result = await db.stream(select(Tweet.id, Tweet.content))
+    async for partition in result.partitions(5000):
+        tag_rows, mention_rows = [], []
+        for tweet_id, content in partition:
+            tag_rows += [
+                {"tag": tag, "tweet_id": tweet_id} for tag in extract_tags(content)
+            ]
+            mention_rows += [
+                {"handle": handle, "tweet_id": tweet_id}
+                for handle in extract_mentions(content)
+            ]
+        if tag_rows:
+            await db.execute(insert(TweetTag), tag_rows)
+        if mention_rows:
+            await db.execute(insert(TweetMention), mention_rows)
+
+
+async def save_checkpoint(db: AsyncSession) -> None:
+    """
+    Сохраняет счетчики процесса. Счетчики в общем кэше не сохраняются.
+    """
+    if shared_trending.enabled:
+        return
+    await db.merge(
+        TrendingCheckpoint(
+            id=_CHECKPOINT_ID,
+            saved_at=datetime.utcnow(),
+            last_tweet_id=trending.last_tweet_id,
+            buckets=json.dumps(trending.snapshot()),
+        )
+    )
+
+
+async def restore_trending(db: AsyncSession) -> None:
+    """
+    Загружает счетчики из контрольной точки и догружает хэштеги твитов,
+    созданных после нее. Удаления после контрольной точки не учитываются:
+    такие твиты выйдут из окна сами. С общим кэшем контрольная точка не
+    используется: см. SharedTrending.restore.
+    """
+    if shared_trending.enabled:
+        await shared_trending.restore(db)
+        return
+    checkpoint: Optional[TrendingCheckpoint] = await db.get(
+        TrendingCheckpoint, _CHECKPOINT_ID
+    )
+    if checkpoint is None:
+        trending.clear()
+    else:
+        trending.load(json.loads(checkpoint.buckets), checkpoint.last_tweet_id)
+
+    since = datetime.utcnow() - timedelta(seconds=trending.window)
+    result = await db.execute(
+        select(TweetTag.tweet_id, TweetTag.tag, Tweet.created_at)
+        .join(Tweet, Tweet.id == TweetTag.tweet_id)
+        .where(TweetTag.tweet_id > trending.last_tweet_id, Tweet.created_at >= since)
+    )
+    for tweet_id, tag, created_at in result:
+        trending.add([tag], created_at)
+        trending.last_tweet_id = max(trending.last_tweet_id, tweet_id)
+    latest = await db.scalar(select(func.max(Tweet.id)))
+    trending.last_tweet_id = max(trending.last_tweet_id, latest or 0)
+
+
+async def checkpoint_periodically(
+    session_factory: async_sessionmaker, interval: int = TRENDING_CHECKPOINT_INTERVAL
+) -> None:
+    """
+    Фоновая задача: сохраняет счетчики трендов каждые interval секунд.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as session:
+                await save_checkpoint(session)
+                await session.commit()
+        except SQLAlchemyError:
+            logger.exception("Failed to save trending checkpoint")
@@ -0,0 +1,373 @@
+import asyncio
+import logging
+import os
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import (
+    ColumnElement,
+    Select,
+    delete,
+    event,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    true,
+    tuple_,
+    update,
+)
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+from app.models.follow import Follower
+from app.models.timeline import TimelineEntry
+from app.models.tweet import Tweet
+from app.models.user import User
+from app.services.follow_graph import follow_graph
+
+# Авторы с большим числом подписчиков не раскладываются по лентам при записи,
+# их твиты подтягиваются при чтении ленты (гибридный pull-режим).
+FANOUT_FOLLOWER_LIMIT = int(os.environ.get("FANOUT_FOLLOWER_LIMIT", 10000))
+# Сколько последних твитов автора добавляется в ленту при подписке или ремонте.
+TIMELINE_BACKFILL_SIZE = int(os.environ.get("TIMELINE_BACKFILL_SIZE", 200))
+# Сколько последних записей ленты участвует в выдаче; более старые удаляются.
+FEED_WINDOW_SIZE = int(os.environ.get("FEED_WINDOW_SIZE", 800))
+# Как часто фоновая задача обрезает пополненные ленты.
+TIMELINE_TRIM_INTERVAL = float(os.environ.get("TIMELINE_TRIM_INTERVAL", 5))
+# Сколько лент обрезается одним запросом.
+TIMELINE_TRIM_BATCH_SIZE = int(os.environ.get("TIMELINE_TRIM_BATCH_SIZE", 100))
+
+_PENDING_KEY = "pending_timeline_trims"
+
+logger = logging.getLogger(__name__)
+
+
+async def is_pull_author(db: AsyncSession, author_id: int) -> bool:
+    """
+    Проверяет, читаются ли твиты автора в pull-режиме.
+    """
+    followers_count = await db.scalar(
+        select(User.followers_count).where(User.id == author_id)
+    )
+    return (followers_count or 0) > FANOUT_FOLLOWER_LIMIT
+
+
+async def get_pull_authors(db: AsyncSession, user_id: int) -> list[int]:
+    """
+    Возвращает авторов из подписок пользователя, работающих в pull-режиме.
+    """
+    result = await db.execute(
+        select(User.id)
+        .join(Follower, Follower.followed_id == User.id)
+        .where(
+            Follower.follower_id == user_id,
+            User.followers_count > FANOUT_FOLLOWER_LIMIT,
+        )
+    )
+    return list(result.scalars().all())
+
+
+async def fan_out_tweets(
+    db: AsyncSession, tweet_ids: Sequence[int], author_id: int
+) -> None:
+    """
+    Раскладывает новые твиты автора в его ленту и в ленты его подписчиков.
+    """
+    if not tweet_ids:
+        return
+    await db.execute(
+        insert(TimelineEntry),
+        [{"user_id": author_id, "tweet_id": tweet_id} for tweet_id in tweet_ids],
+    )
+    mark_for_trimming(db, author_id)
+    if await is_pull_author(db, author_id):
+        return
+    result = await db.execute(
+        insert(TimelineEntry)
+        .from_select(
+            ["user_id", "tweet_id"],
+            # Каждый подписчик x каждый новый твит: декартово произведение явное.
+            select(Follower.follower_id, Tweet.id)
+            .join(Tweet, true())
+            .where(
+                Follower.followed_id == author_id,
+                Follower.follower_id != author_id,
+                Tweet.id.in_(tweet_ids),
+            ),
+        )
+        .returning(TimelineEntry.user_id)
+    )
+    mark_for_trimming(db, *result.scalars().all())
+
+
+async def backfill_author(db: AsyncSession, user_id: int, author_id: int) -> None:
+    """
+    Добавляет последние твиты автора в ленту нового подписчика.
+    """
+    if await is_pull_author(db, author_id):
+        return
+    recent = (
+        select(literal(user_id), Tweet.id)
+        .where(
+            Tweet.author_id == author_id,
+            ~exists().where(
+                TimelineEntry.user_id == user_id, TimelineEntry.tweet_id == Tweet.id
+            ),
+        )
+        .order_by(Tweet.id.desc())
+        .limit(TIMELINE_BACKFILL_SIZE)
+    )
+    await db.execute(insert(TimelineEntry).from_select(["user_id", "tweet_id"], recent))
+    mark_for_trimming(db, user_id)
+
+
+async def remove_author(db: AsyncSession, user_id: int, author_id: int) -> None:
+    """
+    Убирает твиты автора из ленты пользователя после отписки.
+    """
+    await db.execute(
+        delete(TimelineEntry).where(
+            TimelineEntry.user_id == user_id,
+            TimelineEntry.tweet_id.in_(
+                select(Tweet.id).where(Tweet.author_id == author_id)
+            ),
+        )
+    )
+
+
+async def remove_tweet(db: AsyncSession, tweet_id: int) -> None:
+    """
+    Убирает удаленный твит из всех лент.
+    """
+    await db.execute(delete(TimelineEntry).where(TimelineEntry.tweet_id == tweet_id))
+
+
+async def rebuild_timeline(db: AsyncSession, user_id: int) -> None:
+    """
+    Пересобирает ленту пользователя из последних твитов его подписок.
+    """
+    pull_authors = set(await get_pull_authors(db, user_id))
+    followees = await follow_graph.following(db, user_id)
+    authors = [author_id for author_id in followees if author_id not in pull_authors]
+    recent = (
+        select(literal(user_id), Tweet.id)
+        .where(or_(Tweet.author_id == user_id, Tweet.author_id.in_(authors)))
+        .order_by(Tweet.id.desc())
+        .limit(FEED_WINDOW_SIZE)
+    )
+    await db.execute(delete(TimelineEntry).where(TimelineEntry.user_id == user_id))
+    await db.execute(insert(TimelineEntry).from_select(["user_id", "tweet_id"], recent))
+    await db.execute(
+        update(User).where(User.id == user_id).values(timeline_built_at=func.now())
+    )
+
+
+async def build_missing_timelines(db: AsyncSession, user_ids: Iterable[int]) -> None:
+    """
+    Собирает еще не собранные ленты пользователей. Пустая собранная лента
+    не пересобирается.
+    """
+    result = await db.execute(
+        select(User.id).where(
+            User.id.in_(list(user_ids)), User.timeline_built_at.is_(None)
+        )
+    )
+    for user_id in result.scalars().all():
+        await rebuild_timeline(db, user_id)
+
+
+def _recent(query: Select, before_id: Optional[int]) -> ColumnElement[bool]:
+    if before_id is not None:
+        query = query.where(Tweet.id < before_id)
+    query = query.order_by(Tweet.id.desc()).limit(FEED_WINDOW_SIZE)
+    return Tweet.id.in_(query.scalar_subquery())
+
+
+async def feed_condition(
+    db: AsyncSession, user_id: int, before_id: Optional[int] = None
+) -> ColumnElement[bool]:
+    """
+    Возвращает условие отбора твитов ленты: окно - FEED_WINDOW_SIZE последних
+    записей материализованной ленты, плюс столько же последних твитов авторов
+    в pull-режиме. При before_id окно начинается с твитов старше указанного
+    (хронологическая пагинация); порядки по лайкам и горячести окно не
+    сдвигают, и более старые твиты в них не попадают.
+
+    Еще не собранная лента читается целиком в pull-режиме и отмечается для
+    фоновой сборки: запрос чтения ничего не пишет.
+    """
+    built_at = await db.scalar(select(User.timeline_built_at).where(User.id == user_id))
+    if built_at is None:
+        timeline_builder.mark([user_id])
+        followees = await follow_graph.following(db, user_id)
+        return _recent(
+            select(Tweet.id).where(
+                or_(Tweet.author_id == user_id, Tweet.author_id.in_(followees))
+            ),
+            before_id,
+        )
+
+    window = select(TimelineEntry.tweet_id).where(TimelineEntry.user_id == user_id)
+    if before_id is not None:
+        window = window.where(TimelineEntry.tweet_id < before_id)
+    window = window.order_by(TimelineEntry.tweet_id.desc()).limit(FEED_WINDOW_SIZE)
+    condition: ColumnElement[bool] = Tweet.id.in_(window.scalar_subquery())
+
+    pull_authors = await get_pull_authors(db, user_id)
+    if pull_authors:
+        pulled = select(Tweet.id).where(Tweet.author_id.in_(pull_authors))
+        condition = or_(condition, _recent(pulled, before_id))
+    return condition
+
+
+async def trim_timelines(
+    db: AsyncSession, user_ids: Iterable[int], size: Optional[int] = None
+) -> None:
+    """
+    Оставляет в лентах пользователей только size последних записей
+    (по умолчанию FEED_WINDOW_SIZE): более старые в выдачу не попадают.
+    """
+    size = FEED_WINDOW_SIZE if size is None else size
+    ranked = (
+        select(
+            TimelineEntry.user_id,
+            TimelineEntry.tweet_id,
+            func.row_number()
+            .over(
+                partition_by=TimelineEntry.user_id,
+                order_by=TimelineEntry.tweet_id.desc(),
+            )
+            .label("position"),
+        )
+        .where(TimelineEntry.user_id.in_(list(user_ids)))
+        .subquery()
+    )
+    await db.execute(
+        delete(TimelineEntry).where(
+            tuple_(TimelineEntry.user_id, TimelineEntry.tweet_id).in_(
+                select(ranked.c.user_id, ranked.c.tweet_id).where(
+                    ranked.c.position > size
+                )
+            )
+        )
+    )
+
+
+class TimelineTrimmer:
+    """
+    Фоновая обрезка лент. Раскладка отмечает пополненные ленты после
+    коммита, задача раз в TIMELINE_TRIM_INTERVAL секунд обрезает отмеченные
+    пачками по TIMELINE_TRIM_BATCH_SIZE. Отметки живут в памяти: лента,
+    не обрезанная до перезапуска, обрежется при следующем пополнении.
+    """
+
+    failure = "Failed to trim timelines"
+
+    def __init__(self) -> None:
+        self._dirty: set[int] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def mark(self, user_ids: Iterable[int]) -> None:
+        self._dirty.update(user_ids)
+
+    def clear(self) -> None:
+        self._dirty.clear()
+
+    async def run_once(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: int = TIMELINE_TRIM_BATCH_SIZE,
+    ) -> int:
+        """
+        Обрабатывает одну пачку отмеченных лент. Возвращает ее размер.
+        """
+        batch = [self._dirty.pop() for _ in range(min(batch_size, len(self._dirty)))]
+        if not batch:
+            return 0
+        try:
+            async with session_factory() as session:
+                await self.process(session, batch)
+                await session.commit()
+        except SQLAlchemyError:
+            self._dirty.update(batch)
+            logger.exception(self.failure)
+        return len(batch)
+
+    async def process(self, db: AsyncSession, user_ids: list[int]) -> None:
+        await trim_timelines(db, user_ids)
+
+    async def run(
+        self,
+        session_factory: async_sessionmaker,
+        interval: float = TIMELINE_TRIM_INTERVAL,
+        batch_size: int = TIMELINE_TRIM_BATCH_SIZE,
+    ) -> None:
+        while True:
+            while self._dirty:
+                await self.run_once(session_factory, batch_size)
+                await asyncio.sleep(0)
+            await asyncio.sleep(interval)
+
+
+timeline_trimmer = TimelineTrimmer()
+
+
+class TimelineBuilder(TimelineTrimmer):
+    """
+    Фоновая сборка лент, которые еще не собраны: чтение такой ленты
+    отмечает ее, задача собирает отмеченные на primary. До сборки лента
+    читается в pull-режиме; отметка, потерянная при перезапуске, появится
+    при следующем чтении.
+    """
+
+    failure = "Failed to build timelines"
+
+    async def process(self, db: AsyncSession, user_ids: list[int]) -> None:
+        await build_missing_timelines(db, user_ids)
+
+
+timeline_builder = TimelineBuilder()
+
+
+def mark_for_trimming(db: AsyncSession, *user_ids: int) -> None:
+    """
+    Отмечает ленты, пополненные текущей транзакцией.
+    Они обрежутся после коммита.
+    """
+    db.info.setdefault(_PENDING_KEY, set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_committed(session: Session) -> None:
+    timeline_trimmer.mark(session.info.pop(_PENDING_KEY, ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+async def rebuild_all_timelines(db: AsyncSession) -> None:
+    """
+    Пересобирает ленты всех пользователей (ремонт после сбоев и первичное заполнение).
+    """
+    user_ids = (await db.execute(select(User.id))).scalars().all()
+    for user_id in user_ids:
+        await rebuild_timeline(db, user_id)
+
+
+if __name__ == "__main__":
+    from app.database.database import AsyncSessionLocal
+
+    async def main() -> None:
+        async with AsyncSessionLocal() as session:
+            await rebuild_all_timelines(session)
+            await session.commit()
+
+    asyncio.run(main())
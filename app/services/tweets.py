@@ -0,0 +1,82 @@
+from datetime import datetime
+from typing import Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import case, insert, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.media import Media
+from app.models.tweet import Tweet
+from app.schemas.tweet_schemas import TweetCreate
+from app.services import search, tags, timeline
+from app.services.ranking import hot_score
+from app.services.versions import touch_authors
+
+
+async def attach_media(
+    db: AsyncSession, author_id: int, media_by_tweet: dict[int, list[int]]
+) -> None:
+    """
+    Привязывает медиа к твитам одним UPDATE. Медиа должны принадлежать автору
+    (или быть загружены до появления владельцев) и еще не быть привязанными.
+    """
+    tweet_by_media: dict[int, int] = {}
+    for tweet_id, media_ids in media_by_tweet.items():
+        for media_id in media_ids:
+            if tweet_by_media.setdefault(media_id, tweet_id) != tweet_id:
+                raise HTTPException(status_code=400, detail="Media is not available")
+    if not tweet_by_media:
+        return
+
+    result = await db.execute(
+        update(Media)
+        .where(
+            Media.id.in_(tweet_by_media),
+            Media.tweet_id.is_(None),
+            or_(Media.owner_id == author_id, Media.owner_id.is_(None)),
+        )
+        .values(tweet_id=case(tweet_by_media, value=Media.id))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(tweet_by_media):  # type: ignore[attr-defined]
+        raise HTTPException(status_code=400, detail="Media is not available")
+
+
+async def create_tweets(
+    db: AsyncSession, author_id: int, tweets: Sequence[TweetCreate]
+) -> list[int]:
+    """
+    Создает твиты автора одним INSERT, привязывает медиа, добавляет твиты
+    в поисковый индекс и индекс хэштегов и раскладывает их по лентам.
+    Возвращает идентификаторы в порядке входных данных.
+    """
+    created_at = datetime.utcnow()
+    result = await db.execute(
+        insert(Tweet).returning(Tweet.id, sort_by_parameter_order=True),
+        [
+            {
+                "content": tweet.tweet_data,
+                "author_id": author_id,
+                "created_at": created_at,
+                "hot_score": hot_score(0, created_at),
+            }
+            for tweet in tweets
+        ],
+    )
+    tweet_ids = list(result.scalars().all())
+
+    await attach_media(
+        db,
+        author_id,
+        {
+            tweet_id: tweet.tweet_media_ids
+            for tweet_id, tweet in zip(tweet_ids, tweets)
+            if tweet.tweet_media_ids
+        },
+    )
+    contents = list(zip(tweet_ids, (tweet.tweet_data for tweet in tweets)))
+    await search.index_tweets(db, contents)
+    await tags.index_tags(db, contents, created_at)
+    await timeline.fan_out_tweets(db, tweet_ids, author_id)
+    touch_authors(db, author_id)
+    return tweet_ids
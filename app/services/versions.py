@@ -0,0 +1,327 @@
+import hashlib
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterable, Optional, Union
+
+from fastapi.responses import Response
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from app.database.replicas import synced_at, written_at
+from app.models.user import User
+from app.services.cache import SharedCache, shared_cache
+from app.services.follow_graph import follow_graph
+
+# Сколько версий авторов и пользователей держим в памяти.
+VERSION_TRACKER_MAX_KEYS = int(os.environ.get("VERSION_TRACKER_MAX_KEYS", 100000))
+# Сколько общий кэш хранит глобальную версию после последнего сдвига.
+VERSION_EPOCH_TTL = float(os.environ.get("VERSION_EPOCH_TTL", 30 * 86400))
+
+# Клиенты и прокси обязаны переспрашивать сервер перед повторным использованием
+# ответа; ответы разных пользователей кэшируются раздельно.
+REVALIDATE_HEADERS = {"Cache-Control": "no-cache", "Vary": "api-key"}
+
+_PENDING_KEY = "pending_versions"
+_EPOCH_KEY = "versions:everything"
+
+
+class _Versions:
+    """
+    LRU-набор версий. Отсутствующий ключ получает нижнюю границу - максимум
+    вытесненных версий, поэтому вытеснение может лишь сменить токен, но
+    никогда не вернуть старый. Граница своя у каждого воркера: токены
+    вытесненного ключа у воркеров могут расходиться до его изменения.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.values: OrderedDict[int, int] = OrderedDict()
+        self.floor = 0
+
+    def get(self, key: int) -> int:
+        return self.values.get(key, self.floor)
+
+    def set(self, key: int, version: int) -> None:
+        self.values[key] = version
+        self.values.move_to_end(key)
+        while len(self.values) > self.max_keys:
+            _, evicted = self.values.popitem(last=False)
+            self.floor = max(self.floor, evicted)
+
+
+class VersionTracker:
+    """
+    Дешевые версии данных для ETag: у каждого автора - версия его твитов,
+    лайков к ним и вложений, у каждого пользователя - версия его подписок
+    и подписчиков. Версии обновляются после коммита изменивших их
+    транзакций.
+
+    Версия - время выдачи в наносекундах, строго возрастающее в процессе.
+    Изменения рассылаются другим воркерам через общий кэш, и они принимают
+    ту же версию; из нескольких версий ключа действует наибольшая, поэтому
+    порядок доставки событий не важен. Версия ключа не меньше глобальной
+    версии global_version, которая сдвигается массовыми изменениями и
+    запуском или переподключением воркера (он мог пропустить события).
+    Глобальная версия хранится в общем кэше (см. share_epoch), поэтому
+    при одинаковых событиях токены воркеров совпадают. Версии сравниваются
+    как время, поэтому часы воркеров должны совпадать (воркеры одного
+    сервера).
+
+    Токен ответа вычисляется до чтения данных, поэтому устаревший ответ
+    всегда получает старый токен. Пока событие о записи клиента не дошло
+    до воркера, его чтения идут без токена (см. _visible).
+    """
+
+    def __init__(self, max_keys: int = VERSION_TRACKER_MAX_KEYS):
+        self.max_keys = max_keys
+        self._last = 0
+        self.clear()
+
+    def _next_version(self) -> int:
+        self._last = max(self._last + 1, time.time_ns())
+        return self._last
+
+    def _received(self, version: int, current: int) -> int:
+        """
+        Версия ключа после изменения из другого воркера: наибольшая из
+        известных. Следующие версии процесса будут больше нее.
+        """
+        self._last = max(self._last, version)
+        return max(version, current)
+
+    def bumped_at(self, version: int) -> float:
+        """
+        Возвращает время выдачи версии. Версия запуска не соответствует
+        изменениям.
+        """
+        if version <= self.started:
+            return -math.inf
+        return version / 1e9
+
+    def author(self, author_id: int) -> int:
+        return max(self._authors.get(author_id), self.global_version)
+
+    def user(self, user_id: int) -> int:
+        return max(self._users.get(user_id), self.global_version)
+
+    def authors(self, author_ids: Iterable[int]) -> int:
+        """
+        Возвращает максимальную версию среди авторов. Любое изменение у
+        одного из них выдает версию, большую всех прежних.
+        """
+        return max(
+            (self.author(author_id) for author_id in author_ids),
+            default=self.global_version,
+        )
+
+    def bump_authors(self, author_ids: Iterable[int]) -> dict[int, int]:
+        bumped = {author_id: self._next_version() for author_id in author_ids}
+        for author_id, version in bumped.items():
+            self._authors.set(author_id, version)
+        return bumped
+
+    def bump_users(self, user_ids: Iterable[int]) -> dict[int, int]:
+        bumped = {user_id: self._next_version() for user_id in user_ids}
+        for user_id, version in bumped.items():
+            self._users.set(user_id, version)
+        return bumped
+
+    def bump_all(self, after: int = 0) -> int:
+        """
+        Сдвигает глобальную версию за все известные версии и за after.
+        """
+        self._last = max(self._last, after)
+        self.global_version = self._next_version()
+        return self.global_version
+
+    async def share_epoch(self, cache: SharedCache) -> int:
+        """
+        Сдвигает глобальную версию за сохраненную в общем кэше и сохраняет
+        новую: воркер, запущенный позже всех рассылок, узнает ее отсюда.
+        Возвращает новую версию для рассылки другим воркерам.
+        """
+        stored = await cache.get(_EPOCH_KEY)
+        version = self.bump_all(after=stored or 0)
+        await cache.set(_EPOCH_KEY, version, VERSION_EPOCH_TTL)
+        return version
+
+    def apply(self, event: dict) -> None:
+        """
+        Принимает изменения, закоммиченные другим воркером.
+        """
+        for key, version in event.get("authors", {}).items():
+            author_id = int(key)
+            self._authors.set(
+                author_id, self._received(version, self._authors.get(author_id))
+            )
+        for key, version in event.get("users", {}).items():
+            user_id = int(key)
+            self._users.set(user_id, self._received(version, self._users.get(user_id)))
+        if event.get("everything") is not None:
+            self.global_version = self._received(
+                event["everything"], self.global_version
+            )
+
+    def etag(self, *parts: object) -> str:
+        token = ":".join(str(part) for part in (self.global_version, *parts))
+        return '"' + hashlib.sha1(token.encode()).hexdigest()[:24] + '"'
+
+    def clear(self) -> None:
+        self.started = self._next_version()
+        self._authors = _Versions(self.max_keys)
+        self._users = _Versions(self.max_keys)
+        self.global_version = self.started
+
+
+version_tracker = VersionTracker()
+
+
+@dataclass
+class _Pending:
+    authors: set[int] = field(default_factory=set)
+    users: set[int] = field(default_factory=set)
+    everything: bool = False
+
+
+def _pending(session: Union[AsyncSession, Session]) -> _Pending:
+    return session.info.setdefault(_PENDING_KEY, _Pending())
+
+
+def touch_authors(db: AsyncSession, *author_ids: Optional[int]) -> None:
+    """
+    Отмечает авторов, чьи твиты изменила текущая транзакция.
+    Версии обновятся после коммита.
+    """
+    _pending(db).authors.update(aid for aid in author_ids if aid is not None)
+
+
+def touch_users(db: AsyncSession, *user_ids: int) -> None:
+    """
+    Отмечает пользователей, чьи подписки изменила текущая транзакция.
+    """
+    _pending(db).users.update(user_ids)
+
+
+def touch_all(db: AsyncSession) -> None:
+    """
+    Отмечает массовое изменение: после коммита меняются все токены.
+    """
+    _pending(db).everything = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed(session: Session) -> None:
+    pending: Optional[_Pending] = session.info.pop(_PENDING_KEY, None)
+    if pending is None:
+        return
+    changes: dict = {
+        "authors": version_tracker.bump_authors(pending.authors),
+        "users": version_tracker.bump_users(pending.users),
+    }
+    if pending.everything:
+        changes["everything"] = version_tracker.bump_all()
+        shared_cache.set_soon(_EPOCH_KEY, changes["everything"], VERSION_EPOCH_TTL)
+    shared_cache.publish_soon(changes)
+
+
+async def _share_epoch() -> None:
+    shared_cache.publish_soon(
+        {"everything": await version_tracker.share_epoch(shared_cache)}
+    )
+
+
+@shared_cache.on_event
+def _apply_remote_changes(event: Optional[dict]) -> None:
+    if event is None:
+        # События могли потеряться: меняем все токены и сбрасываем граф.
+        # Новую глобальную версию получат и другие воркеры.
+        version_tracker.bump_all()
+        follow_graph.clear()
+        if shared_cache.backend.shared:
+            shared_cache.spawn(_share_epoch())
+        return
+    version_tracker.apply(event)
+    # Подписки изменил другой воркер: списки перечитаются из базы.
+    for user_id in event.get("users", {}):
+        follow_graph.evict(int(user_id))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _touch_renamed_user(mapper, connection, target: User) -> None:
+    # Имена пользователей встречаются в чужих лентах и профилях.
+    session = object_session(target)
+    if session is not None:
+        _pending(session).everything = True
+
+
+def make_etag(*parts: object) -> str:
+    return version_tracker.etag(*parts)
+
+
+def _visible(db: AsyncSession, *versions: int) -> bool:
+    """
+    Проверяет, что данные сессии содержат изменения, выдавшие эти версии.
+    Реплика может отставать от версий, которые обновляются после коммита
+    на primary.
+
+    Версии также должны быть не старше последней записи клиента: запись в
+    другом воркере доходит сюда событием с задержкой, и до него токен
+    совпал бы с прежним - клиент получил бы 304 или страницу из кэша без
+    своего изменения. Глобальная версия тоже годится: токены с ней
+    выдаются только после ее выдачи.
+    """
+    latest = max(versions + (version_tracker.global_version,))
+    if written_at(db) > latest / 1e9:
+        return False
+    return version_tracker.bumped_at(latest) < synced_at(db)
+
+
+def is_not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Проверяет заголовок If-None-Match (список ETag или "*") по слабому сравнению.
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, **REVALIDATE_HEADERS})
+
+
+def etag_headers(etag: Optional[str]) -> dict[str, str]:
+    return {**REVALIDATE_HEADERS, **({"ETag": etag} if etag is not None else {})}
+
+
+async def feed_etag(db: AsyncSession, user_id: int, *params: object) -> Optional[str]:
+    """
+    ETag ленты: версия подписок пользователя и максимальная версия среди
+    него самого и авторов, на которых он подписан. Список подписок берется
+    из графа подписок, поэтому база обычно не затрагивается.
+    Если сессия читает реплику, еще не получившую последнее из этих
+    изменений, токен не выдается (None).
+    """
+    following = await follow_graph.following(db, user_id)
+    user_version = version_tracker.user(user_id)
+    authors_version = version_tracker.authors([user_id, *following])
+    if not _visible(db, user_version, authors_version):
+        return None
+    return make_etag("feed", user_id, user_version, authors_version, *params)
+
+
+def profile_etag(db: AsyncSession, user_id: int) -> Optional[str]:
+    user_version = version_tracker.user(user_id)
+    if not _visible(db, user_version):
+        return None
+    return make_etag("profile", user_id, user_version)
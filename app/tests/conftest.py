@@ -1,50 +1,275 @@
+import asyncio
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
 import pytest
 from fastapi import FastAPI
 from httpx import ASGITransport, AsyncClient
-from sqlalchemy import delete
+from sqlalchemy import delete, event, func, update
 from sqlalchemy.ext.asyncio import (  # type: ignore
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
+from sqlalchemy.orm import Session
 
-from app.database.database import Base, get_db
-from app.models.follow import Follower  # noqa
-from app.models.like import Like  # noqa
+from app.database import profiles
+from app.database.database import (
+    Base,
+    get_db,
+    get_read_db,
+    get_replica_router,
+    session_dependencies,
+)
+from app.database.replicas import ReplicaRouter, heartbeat
+from app.models.follow import Follower
+from app.models.like import Like
 from app.models.media import Media
+from app.models.media_variant import MediaVariant
+from app.models.tag import TweetMention, TweetTag
+from app.models.timeline import TimelineEntry
 from app.models.tweet import Tweet
 from app.models.user import User
+from app.services import media_storage
+from app.services.auth import auth_cache
+from app.services.cache import MemoryBackend, shared_cache
+from app.services.follow_graph import follow_graph
+from app.services.like_buffer import like_buffer
+from app.services.media_pipeline import media_pipeline
+from app.services.ranking import hot_scorer
+from app.services.search import rebuild_index
+from app.services.tags import trending
+from app.services.timeline import fan_out_tweets, timeline_builder, timeline_trimmer
+from app.services.versions import version_tracker
+
+# Два файла SQLite изображают primary и реплику.
+PRIMARY_DATABASE_FILE = "primary.db"
+REPLICA_DATABASE_FILE = "replica.db"
+
+
+class SQLiteReplication:
+    """
+    Репликация для тестов: после каждого коммита файл primary копируется
+    в файл реплики, а маршрутизатор узнает время копии (как от пульса).
+    Пока paused=True, реплика отстает.
+    """
+
+    def __init__(self, primary: Path, replica: Path, router: ReplicaRouter):
+        self.primary = primary
+        self.replica = replica
+        self.router = router
+        self.paused = False
+
+    def sync(self) -> None:
+        synced_at = time.time()
+        with closing(sqlite3.connect(self.primary)) as source, closing(
+            sqlite3.connect(self.replica)
+        ) as target:
+            source.backup(target)
+        self.router.observe(0, synced_at)
+
+    def after_commit(self, session: Session) -> None:
+        if not self.paused:
+            self.sync()
+
 
-TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
-# TEST_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+class FakeRedisServer:
+    """
+    Минимальный сервер RESP2 для тестов: GET, SET с NX и PX, DEL, ZINCRBY,
+    PEXPIRE, ZUNIONSTORE, ZRANGE BYSCORE, MULTI/EXEC, PUBLISH, SUBSCRIBE
+    и PING. Время жизни сортированных множеств не учитывается.
+    """
+
+    def __init__(self):
+        self.values: dict[bytes, tuple[bytes, float]] = {}
+        self.zsets: dict[bytes, dict[bytes, float]] = {}
+        self.transactions: dict[asyncio.StreamWriter, list[list[bytes]]] = {}
+        self.subscribers: dict[bytes, list[asyncio.StreamWriter]] = {}
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        for writers in self.subscribers.values():
+            for writer in writers:
+                writer.close()
+
+    @staticmethod
+    def _bulk(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    async def _serve(self, reader, writer) -> None:
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    return
+                args = []
+                for _ in range(int(header[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self._execute(args, writer))
+        finally:
+            writer.close()
+
+    def _execute(self, args: list[bytes], writer) -> bytes:
+        command = args[0].upper()
+        queued = self.transactions.get(writer)
+        if command == b"MULTI":
+            self.transactions[writer] = []
+            return b"+OK\r\n"
+        if command == b"EXEC":
+            commands = self.transactions.pop(writer)
+            replies = [self._execute(queued_args, writer) for queued_args in commands]
+            return b"*%d\r\n" % len(replies) + b"".join(replies)
+        if queued is not None:
+            queued.append(args)
+            return b"+QUEUED\r\n"
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command == b"GET":
+            value, expires_at = self.values.get(args[1], (None, 0))
+            return self._bulk(value if expires_at > time.monotonic() else None)
+        if command == b"SET":
+            options = [arg.upper() for arg in args[3:]]
+            if b"NX" in options and self._execute([b"GET", args[1]], writer) != (
+                b"$-1\r\n"
+            ):
+                return b"$-1\r\n"
+            ttl = 3600.0
+            if b"PX" in options:
+                ttl = int(args[3 + options.index(b"PX") + 1]) / 1000
+            self.values[args[1]] = (args[2], time.monotonic() + ttl)
+            return b"+OK\r\n"
+        if command == b"DEL":
+            deleted = sum(
+                (self.values.pop(key, None) or self.zsets.pop(key, None)) is not None
+                for key in args[1:]
+            )
+            return b":%d\r\n" % deleted
+        if command == b"ZINCRBY":
+            scores = self.zsets.setdefault(args[1], {})
+            scores[args[3]] = scores.get(args[3], 0) + float(args[2])
+            return self._bulk(b"%g" % scores[args[3]])
+        if command == b"PEXPIRE":
+            return b":%d\r\n" % (args[1] in self.zsets)
+        if command == b"ZUNIONSTORE":
+            union: dict[bytes, float] = {}
+            keys = args[3:][: int(args[2])]
+            for key in keys:
+                for member, score in self.zsets.get(key, {}).items():
+                    union[member] = union.get(member, 0) + score
+            self.zsets[args[1]] = union
+            return b":%d\r\n" % len(union)
+        if command == b"ZRANGE":
+            # Только форма ZRANGE key -inf (max BYSCORE LIMIT 0 n WITHSCORES
+            upper = float(args[3].lstrip(b"("))
+            ranked = sorted(
+                (score, member)
+                for member, score in self.zsets.get(args[1], {}).items()
+                if score < upper
+            )[: int(args[7])]
+            items = [
+                part for score, member in ranked for part in (member, b"%g" % score)
+            ]
+            return b"*%d\r\n" % len(items) + b"".join(map(self._bulk, items))
+        if command == b"PUBLISH":
+            receivers = self.subscribers.get(args[1], [])
+            for receiver in receivers:
+                receiver.write(
+                    b"*3\r\n"
+                    + self._bulk(b"message")
+                    + self._bulk(args[1])
+                    + self._bulk(args[2])
+                )
+            return b":%d\r\n" % len(receivers)
+        if command == b"SUBSCRIBE":
+            self.subscribers.setdefault(args[1], []).append(writer)
+            return (
+                b"*3\r\n" + self._bulk(b"subscribe") + self._bulk(args[1]) + b":1\r\n"
+            )
+        return b"-ERR unknown command\r\n"
+
+
+@pytest.fixture
+async def redis_server():
+    server = FakeRedisServer()
+    server.port = await server.start()
+    yield server
+    await server.stop()
+
+
+@pytest.fixture(autouse=True)
+def strict_query_budget(monkeypatch):
+    monkeypatch.setattr(profiles, "QUERY_BUDGET_STRICT", True)
+
+
+@pytest.fixture(autouse=True)
+def empty_shared_cache(monkeypatch):
+    monkeypatch.setattr(shared_cache, "backend", MemoryBackend())
 
 
 @pytest.fixture(scope="session")
-async def engine():
-    engine = create_async_engine(TEST_DATABASE_URL)
+def database_dir(tmp_path_factory) -> Path:
+    return tmp_path_factory.mktemp("databases")
+
+
+@pytest.fixture(scope="session")
+async def engine(database_dir):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_dir / PRIMARY_DATABASE_FILE}"
+    )
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(heartbeat.create)
 
     yield engine
     await engine.dispose()
 
 
+@pytest.fixture(scope="session")
+async def replica_engine(database_dir, engine):
+    replica_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_dir / REPLICA_DATABASE_FILE}"
+    )
+    yield replica_engine
+    await replica_engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def replication(database_dir, engine, replica_engine):
+    replication = SQLiteReplication(
+        database_dir / PRIMARY_DATABASE_FILE,
+        database_dir / REPLICA_DATABASE_FILE,
+        ReplicaRouter(engine, [replica_engine], shared=shared_cache),
+    )
+    replication.sync()
+    event.listen(Session, "after_commit", replication.after_commit)
+    yield replication
+    event.remove(Session, "after_commit", replication.after_commit)
+
+
 @pytest.fixture
-async def session(engine):
+async def session(engine, replication):
     async with async_sessionmaker(engine)() as session:
         yield session
 
 
 @pytest.fixture
-async def app(engine):
+async def app(replication):
     app = FastAPI()
 
-    async def override_get_db():
-        async with async_sessionmaker(engine)() as session:
-            yield session
-
+    override_get_db, override_get_read_db = session_dependencies(replication.router)
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    app.dependency_overrides[get_replica_router] = lambda: replication.router
 
     from main import app as main_app
 
@@ -62,8 +287,15 @@ async def client(app):
 
 @pytest.fixture
 async def test_users(session: AsyncSession):
+    await session.execute(delete(Follower))
+    await session.execute(delete(Like))
+    await session.execute(delete(TimelineEntry))
     await session.execute(delete(User))
     await session.commit()
+    auth_cache.clear()
+    follow_graph.clear()
+    version_tracker.clear()
+    timeline_builder.clear()
     user1 = User(name="Test User 1", api_key="api-key-1")
     user2 = User(name="Test User 2", api_key="api-key-2")
 
@@ -73,6 +305,7 @@ async def test_users(session: AsyncSession):
 
 @pytest.fixture
 async def test_media(session: AsyncSession):
+    await session.execute(delete(MediaVariant))
     await session.execute(delete(Media))
     await session.commit()
     media1 = Media(file_path="test1.jpg")
@@ -84,10 +317,30 @@ async def test_media(session: AsyncSession):
 
 @pytest.fixture
 async def test_tweets(session: AsyncSession, test_users, test_media):
+    await session.execute(delete(TimelineEntry))
+    await session.execute(delete(TweetTag))
+    await session.execute(delete(TweetMention))
     await session.execute(delete(Tweet))
     await session.commit()
+    trending.clear()
+    hot_scorer.clear()
+    like_buffer.clear()
+    timeline_trimmer.clear()
     tweet1 = Tweet(content="Test Tweet 1", author_id=1)
     tweet2 = Tweet(content="Test Tweet 2", author_id=2)
 
     session.add_all([tweet1, tweet2])
+    await session.flush()
+    for tweet in (tweet1, tweet2):
+        await fan_out_tweets(session, [tweet.id], tweet.author_id)
+    # Ленты уже собраны раскладкой
+    await session.execute(update(User).values(timeline_built_at=func.now()))
+    await rebuild_index(session)
     await session.commit()
+
+
+@pytest.fixture
+async def media_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_storage, "MEDIA_ROOT", str(tmp_path))
+    yield tmp_path
+    await media_pipeline.drain()
@@ -0,0 +1,144 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app.services import admission
+from app.services.admission import (
+    AdmissionController,
+    AdmissionMiddleware,
+    RouteLimit,
+    TokenBucket,
+)
+from app.services.auth import AuthCache, Principal
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0])
+    assert [bucket.take("a") for _ in range(3)] == [0, 0, 0]
+    # Запас исчерпан: следующий токен появится через 1 / rate секунд
+    assert bucket.take("a") == pytest.approx(0.5)
+    # Другой ключ не затронут
+    assert bucket.take("b") == 0
+
+    now[0] = 1.0
+    assert bucket.take("a") == 0
+    assert bucket.take("a") == 0
+    assert bucket.take("a") > 0
+
+
+def _admission_app(controller: AdmissionController, release: asyncio.Event) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+
+    @app.get("/expensive")
+    async def expensive():
+        await release.wait()
+        return {"result": True}
+
+    @app.get("/cheap")
+    async def cheap():
+        return {"result": True}
+
+    return app
+
+
+@pytest.mark.asyncio
+async def test_route_concurrency_and_queue_deadline():
+    release = asyncio.Event()
+    controller = AdmissionController(
+        limits={("GET", "/expensive"): RouteLimit(1, 0.05, expensive=True)},
+        default=RouteLimit(10, 1),
+        pool_saturated=lambda: False,
+    )
+    transport = ASGITransport(app=_admission_app(controller, release))
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        first = asyncio.create_task(client.get("/expensive"))
+        while controller.stats()["routes"].get("GET /expensive", {}).get("active") != 1:
+            await asyncio.sleep(0.001)
+
+        # Место занято: второй запрос не дожидается его и получает 503
+        response = await client.get("/expensive")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+        # Дешевые маршруты продолжают обслуживаться
+        assert (await client.get("/cheap")).status_code == 200
+
+        release.set()
+        assert (await first).status_code == 200
+        assert (await client.get("/expensive")).status_code == 200
+
+    stats = controller.stats()["routes"]["GET /expensive"]
+    assert stats == {"concurrency": 1, "active": 0, "queued": 0, "shed": 1}
+
+
+@pytest.mark.asyncio
+async def test_expensive_routes_shed_when_pool_saturated():
+    release = asyncio.Event()
+    release.set()
+    saturated = [True]
+    controller = AdmissionController(
+        limits={("GET", "/expensive"): RouteLimit(10, 1, expensive=True)},
+        default=RouteLimit(10, 1),
+        pool_saturated=lambda: saturated[0],
+    )
+    transport = ASGITransport(app=_admission_app(controller, release))
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        assert (await client.get("/expensive")).status_code == 503
+        assert (await client.get("/cheap")).status_code == 200
+
+        saturated[0] = False
+        assert (await client.get("/expensive")).status_code == 200
+
+
+def test_pool_saturated_checks_replicas(monkeypatch):
+    replica = SimpleNamespace(pool=SimpleNamespace(waiting=0))
+    monkeypatch.setattr(admission, "read_engines", [replica])
+    assert not admission._pool_saturated()
+
+    # Соединения ждут только в пуле реплики
+    replica.pool.waiting = 1
+    assert admission._pool_saturated()
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_per_user(monkeypatch):
+    known = AuthCache()
+    known.set("noisy", Principal(id=1, name="Noisy"))
+    known.set("quiet", Principal(id=2, name="Quiet"))
+    monkeypatch.setattr(admission, "auth_cache", known)
+    release = asyncio.Event()
+    controller = AdmissionController(
+        default=RouteLimit(10, 1),
+        rate_limiter=TokenBucket(rate=0.5, burst=2),
+        address_limiter=TokenBucket(rate=0.5, burst=2),
+        pool_saturated=lambda: False,
+    )
+    transport = ASGITransport(app=_admission_app(controller, release))
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        noisy = {"api-key": "noisy"}
+        assert (await client.get("/cheap", headers=noisy)).status_code == 200
+        assert (await client.get("/cheap", headers=noisy)).status_code == 200
+
+        response = await client.get("/cheap", headers=noisy)
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "2"
+
+        # Остальные клиенты не страдают
+        response = await client.get("/cheap", headers={"api-key": "quiet"})
+        assert response.status_code == 200
+
+        # Непроверенные ключи делят счетчик адреса клиента и не заводят своих
+        statuses = [
+            (await client.get("/cheap", headers={"api-key": f"random-{i}"})).status_code
+            for i in range(3)
+        ]
+        assert statuses == [200, 200, 429]
+
+    assert len(controller.rate_limiter._buckets) == 2
+    assert len(controller.address_limiter._buckets) == 1
+    assert controller.stats()["rate_limited"] == 2
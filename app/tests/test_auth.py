@@ -0,0 +1,92 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User
+from app.services.auth import AuthCache, Principal, auth_cache
+from app.services.cache import shared_cache
+
+
+def test_auth_cache_lru_and_ttl():
+    now = [0.0]
+    cache = AuthCache(max_size=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", Principal(id=1, name="A"))
+    cache.set("b", Principal(id=2, name="B"))
+    assert cache.get("a") == Principal(id=1, name="A")
+
+    # Вытесняется давно не использованная запись
+    cache.set("c", Principal(id=3, name="C"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    # Истекшие записи не возвращаются
+    now[0] = 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 1, "max_size": 2, "hits": 2, "misses": 2}
+
+
+@pytest.mark.asyncio
+async def test_auth_cache_hit_skips_database(
+    client: AsyncClient, engine, replica_engine, session: AsyncSession, test_users
+):
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        if "FROM users" in statement:
+            statements.append(statement)
+
+    # Аутентификация читает реплику, поэтому слушаем обе базы
+    for database in (engine, replica_engine):
+        event.listen(database.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        headers = {"api-key": "api-key-1"}
+        await client.get("/api/users/me", headers=headers)
+        await client.get("/api/users/me", headers=headers)
+        auth_statements = [s for s in statements if "WHERE users.api_key" in s]
+        assert len(auth_statements) == 1
+    finally:
+        for database in (engine, replica_engine):
+            event.remove(database.sync_engine, "before_cursor_execute", count_statement)
+
+    # Изменение пользователя сбрасывает запись кэша
+    user = (await session.execute(select(User).where(User.id == 1))).scalar_one()
+    user.name = "Renamed"
+    await session.commit()
+    assert auth_cache.get("api-key-1") is None
+    response = await client.get("/api/users/me", headers=headers)
+    assert response.json()["user"]["name"] == "Renamed"
+
+
+@pytest.mark.asyncio
+async def test_auth_cache_hit_skips_shared_cache_and_session(
+    client: AsyncClient, replication, test_users, monkeypatch
+):
+    headers = {"api-key": "api-key-1"}
+    await client.post("/api/tweets/", json={"tweet_data": "warm up"}, headers=headers)
+    assert auth_cache.peek("api-key-1") is not None
+
+    calls = []
+
+    def track(name, method):
+        async def wrapper(*args, **kwargs):
+            calls.append(name)
+            return await method(*args, **kwargs)
+
+        return wrapper
+
+    # Запись открывает свою сессию, но аутентификация не добавляет ни сессии
+    # чтения, ни обращения к общему кэшу
+    monkeypatch.setattr(
+        replication.router,
+        "last_write",
+        track("read_session", replication.router.last_write),
+    )
+    monkeypatch.setattr(
+        shared_cache, "get_or_load", track("shared_cache", shared_cache.get_or_load)
+    )
+    response = await client.post(
+        "/api/tweets/", json={"tweet_data": "cached"}, headers=headers
+    )
+    assert response.status_code == 200
+    assert calls == []
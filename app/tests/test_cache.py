@@ -0,0 +1,243 @@
+import asyncio
+import time
+
+import pytest
+from httpx import AsyncClient
+from pydantic_core import from_json, to_json
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tweet import Tweet
+from app.services.cache import (
+    CacheError,
+    MemoryBackend,
+    RedisBackend,
+    SharedCache,
+    shared_cache,
+)
+from app.services.versions import VersionTracker, version_tracker
+
+
+@pytest.mark.asyncio
+async def test_single_flight_loads_once():
+    cache = SharedCache(MemoryBackend())
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"items": [1, 2]}
+
+    results = await asyncio.gather(
+        *(cache.get_or_load("page", loader, ttl=60) for _ in range(5))
+    )
+    assert len(calls) == 1
+    assert results == [{"items": [1, 2]}] * 5
+    # Каждый вызов получает свою копию значения
+    assert len({id(result) for result in results}) == 5
+    assert cache.stats()["coalesced"] == 4
+
+    assert await cache.get_or_load("page", loader, ttl=60) == {"items": [1, 2]}
+    assert len(calls) == 1
+
+    # Ошибку загрузки получают все ожидающие, и она не кэшируется
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    outcomes = await asyncio.gather(
+        *(cache.get_or_load("broken", failing, ttl=60) for _ in range(3)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert cache.stats()["inflight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_commands(redis_server):
+    backend = RedisBackend(f"redis://127.0.0.1:{redis_server.port}/0")
+    try:
+        assert await backend.get("missing") is None
+        await backend.set("key", b"value", ttl=60)
+        await backend.set("short", b"value", ttl=0.001)
+        # Команды идут конвейером по одному соединению
+        values = await asyncio.gather(*(backend.get("key") for _ in range(10)))
+        assert values == [b"value"] * 10
+        await asyncio.sleep(0.01)
+        assert await backend.get("short") is None
+        await backend.delete("key")
+        assert await backend.get("key") is None
+        with pytest.raises(CacheError):
+            await backend.execute("UNKNOWN")
+    finally:
+        await backend.close()
+
+    # Недоступный сервер не ломает чтение: данные берутся из загрузчика
+    await redis_server.stop()
+    cache = SharedCache(RedisBackend(f"redis://127.0.0.1:{redis_server.port}"))
+
+    async def loader():
+        return {"fresh": True}
+
+    assert await cache.get_or_load("key", loader, ttl=60) == {"fresh": True}
+    assert cache.stats()["errors"] == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["memory", "redis"])
+async def test_backend_counters(kind, redis_server):
+    backend = (
+        MemoryBackend()
+        if kind == "memory"
+        else RedisBackend(f"redis://127.0.0.1:{redis_server.port}")
+    )
+    try:
+        # Значение без срока жизни записывается только один раз
+        assert await backend.add("marker", b"1") is True
+        assert await backend.add("marker", b"2") is False
+        assert await backend.get("marker") == b"1"
+
+        await backend.increment_scores("a", {"python": 2, "rust": 1}, ttl=60)
+        await backend.increment_scores("b", {"rust": 1, "go": 1}, ttl=60)
+        await backend.increment_scores("b", {"go": -1}, ttl=60)
+        # Суммы по ключам: по убыванию, равные - по имени, без нулевых
+        assert await backend.top_scores(["a", "b"], 10) == [("python", 2), ("rust", 2)]
+        assert await backend.top_scores(["a", "b", "missing"], 1) == [("python", 2)]
+        assert await backend.top_scores([], 10) == []
+    finally:
+        await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_events_reach_other_workers(redis_server):
+    url = f"redis://127.0.0.1:{redis_server.port}"
+    first, second = SharedCache(RedisBackend(url)), SharedCache(RedisBackend(url))
+    received: dict[str, list] = {"first": [], "second": []}
+    delivered = asyncio.Event()
+
+    first.on_event(received["first"].append)
+
+    @second.on_event
+    def _receive(event):
+        received["second"].append(event)
+        if event is not None:
+            delivered.set()
+
+    tasks = [asyncio.create_task(cache.run()) for cache in (first, second)]
+    try:
+        while len(redis_server.subscribers.get(first.channel.encode(), [])) < 2:
+            await asyncio.sleep(0.001)
+        first.publish_soon({"authors": {"1": 5}})
+        await first.drain()
+        await asyncio.wait_for(delivered.wait(), timeout=1)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await first.close()
+        await second.close()
+
+    # Подключение сообщает о возможной потере событий, свои события не приходят
+    assert received["first"] == [None]
+    assert received["second"] == [None, {"authors": {"1": 5}, "origin": first.origin}]
+
+
+@pytest.mark.asyncio
+async def test_workers_agree_on_etags(redis_server):
+    url = f"redis://127.0.0.1:{redis_server.port}"
+    first_cache, second_cache = SharedCache(RedisBackend(url)), SharedCache(
+        RedisBackend(url)
+    )
+    first, second = VersionTracker(), VersionTracker()
+    assert first.global_version != second.global_version
+
+    def feed_etags() -> list[str]:
+        return [
+            tracker.etag("feed", 2, tracker.user(2), tracker.authors([1, 2, 3]))
+            for tracker in (first, second)
+        ]
+
+    try:
+        # Подключившись, воркер сдвигает глобальную версию из общего кэша и
+        # рассылает ее; порядок доставки событий не важен
+        first_epoch = await first.share_epoch(first_cache)
+        second_epoch = await second.share_epoch(second_cache)
+        assert second_epoch > first_epoch
+        first.apply({"everything": second_epoch})
+        second.apply({"everything": first_epoch})
+        assert first.global_version == second.global_version
+        etags = feed_etags()
+        assert etags[0] == etags[1]
+
+        # Изменения другого воркера принимаются с той же версией
+        changes = {"authors": first.bump_authors([1]), "users": first.bump_users([2])}
+        second.apply(from_json(to_json(changes)))
+        changed = feed_etags()
+        assert changed[0] == changed[1] != etags[0]
+        assert first.author(3) == second.author(3)
+
+        # Воркер, запущенный позже всех рассылок, узнает версию из общего кэша
+        third = VersionTracker()
+        third_epoch = await third.share_epoch(first_cache)
+        assert third_epoch > second_epoch
+    finally:
+        await first_cache.close()
+        await second_cache.close()
+
+
+@pytest.mark.asyncio
+async def test_remote_change_invalidates_cached_feed(
+    client: AsyncClient, session: AsyncSession, test_tweets
+):
+    headers = {"api-key": "api-key-1"}
+    response = await client.get("/api/tweets/?order=recent", headers=headers)
+    assert response.json()["tweets"][-1]["content"] == "Test Tweet 1"
+
+    # Другой воркер меняет твит: до его события страница берется из кэша
+    await session.execute(
+        update(Tweet).where(Tweet.author_id == 1).values(content="Edited elsewhere")
+    )
+    await session.commit()
+    response = await client.get("/api/tweets/?order=recent", headers=headers)
+    assert response.json()["tweets"][-1]["content"] == "Test Tweet 1"
+    assert shared_cache.stats()["hits"] >= 1
+
+    remote_version = version_tracker.author(1) + 1
+    shared_cache._dispatch(
+        to_json({"origin": "other-worker", "authors": {"1": remote_version}})
+    )
+    assert version_tracker.author(1) == remote_version
+    response = await client.get("/api/tweets/?order=recent", headers=headers)
+    assert response.json()["tweets"][-1]["content"] == "Edited elsewhere"
+
+
+@pytest.mark.asyncio
+async def test_writer_bypasses_cache_until_event_arrives(
+    client: AsyncClient, session: AsyncSession, replication, test_tweets
+):
+    headers = {"api-key": "api-key-1"}
+    response = await client.get("/api/tweets/?order=recent", headers=headers)
+    etag = response.headers["ETag"]
+
+    # Пользователь записал через другой воркер, событие сюда еще не дошло
+    await session.execute(
+        update(Tweet).where(Tweet.author_id == 1).values(content="Written elsewhere")
+    )
+    await session.commit()
+    await replication.router.share_write("api-key-1", time.time())
+
+    response = await client.get(
+        "/api/tweets/?order=recent", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert response.json()["tweets"][-1]["content"] == "Written elsewhere"
+
+    # Событие о записи дошло: токены снова выдаются
+    shared_cache._dispatch(
+        to_json({"origin": "other-worker", "authors": {"1": time.time_ns()}})
+    )
+    replication.sync()
+    response = await client.get("/api/tweets/?order=recent", headers=headers)
+    assert response.headers["ETag"] != etag
+    assert response.json()["tweets"][-1]["content"] == "Written elsewhere"
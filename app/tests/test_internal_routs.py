@@ -0,0 +1,107 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database.pool import InstrumentedQueuePool
+from app.routs import internal_routs
+from app.services.instrumentation import MetricsMiddleware
+from app.services.metrics import MetricsRegistry
+
+INTERNAL_HEADERS = {"Authorization": "Bearer internal-token"}
+
+
+@pytest.fixture(autouse=True)
+def internal_token(monkeypatch):
+    monkeypatch.setattr(internal_routs, "INTERNAL_TOKEN", "internal-token")
+
+
+@pytest.mark.asyncio
+async def test_internal_routes_require_token(client: AsyncClient, monkeypatch):
+    for path in ("/internal/pool", "/metrics"):
+        assert (await client.get(path)).status_code == 401
+        response = await client.get(
+            path, headers={"Authorization": "Bearer wrong-token"}
+        )
+        assert response.status_code == 401
+
+    # Без настроенного токена маршрутов нет
+    monkeypatch.setattr(internal_routs, "INTERNAL_TOKEN", "")
+    response = await client.get("/metrics", headers=INTERNAL_HEADERS)
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_pool_stats_endpoint(client: AsyncClient):
+    response = await client.get("/internal/pool", headers=INTERNAL_HEADERS)
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["max_connections"] == stats["size"] + stats["max_overflow"]
+    assert "+Inf" in stats["wait_seconds"]["buckets"]
+
+
+@pytest.mark.asyncio
+async def test_pool_wait_histogram(tmp_path):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    pool = engine.pool
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            assert pool.stats()["checked_out"] == 1
+            # Открытие нового соединения не считается ожиданием
+            assert pool.stats()["wait_seconds"]["count"] == 0
+
+            # Пул исчерпан: вторая выдача ждет и завершается таймаутом
+            with pytest.raises(exc.TimeoutError):
+                async with engine.connect():
+                    pass
+
+        stats = pool.stats()
+        assert stats["timeouts"] == 1
+        assert stats["checked_out"] == 0
+        assert stats["waiting"] == 0
+        assert stats["wait_seconds"]["count"] == 1
+        assert stats["wait_seconds"]["buckets"]["0.01"] == 0
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_request_metrics(app, test_users):
+    registry = MetricsRegistry()
+    app.add_middleware(MetricsMiddleware, registry=registry, server_timing=True)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/api/users/me", headers={"api-key": "api-key-1"})
+        await client.get("/api/users/2", headers={"api-key": "api-key-1"})
+        await client.get("/api/unknown")
+
+    # Server-Timing содержит время приложения и базы данных
+    assert "db;dur=" in response.headers["Server-Timing"]
+
+    metrics = registry.routes[("GET", "/api/users/{user_id}")]
+    assert metrics.responses == {200: 1}
+    assert metrics.db_statements.sum >= 2
+    assert metrics.db_time.sum > 0
+    assert metrics.response_bytes.sum > 0
+    assert ("GET", "<unmatched>") in registry.routes
+
+    text = registry.render()
+    assert (
+        'http_requests_total{method="GET",route="/api/users/me",status="200"} 1' in text
+    )
+    assert 'http_request_db_statements_bucket{method="GET"' in text
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client: AsyncClient):
+    response = await client.get("/metrics", headers=INTERNAL_HEADERS)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE db_pool_wait_seconds histogram" in response.text
@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import io
+import struct
+import zlib
+
+import httpx
+import pytest
+from fastapi import Request
+from httpx import AsyncClient
+from PIL import Image
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette import formparsers
+
+from app.models.media import Media
+from app.routs import media_routs
+from app.services import media_storage
+from app.services.media_pipeline import media_pipeline
+
+
+@pytest.mark.asyncio
+async def test_upload_media(client: AsyncClient, media_root, monkeypatch, test_users):
+    user1_headers = {"api-key": "api-key-1"}
+    monkeypatch.setattr(media_storage, "UPLOAD_CHUNK_SIZE", 4)
+
+    # Тело не разбирается Starlette во временный файл: оно пишется на диск
+    # один раз, сразу в MEDIA_ROOT
+    def not_spooled(*args, **kwargs):
+        raise AssertionError("Upload must not be spooled")
+
+    monkeypatch.setattr(formparsers, "SpooledTemporaryFile", not_spooled)
+    content = b"0123456789" * 10
+    stored_name = hashlib.sha256(content).hexdigest()
+
+    response = await client.post(
+        "/api/medias/",
+        files={"file": ("photo.JPG", content, "image/jpeg")},
+        headers=user1_headers,
+    )
+    assert response.status_code == 200
+    assert "media_id" in response.json()
+    assert (media_root / stored_name).read_bytes() == content
+
+    # Превышение лимита прерывает загрузку и не оставляет временных файлов
+    monkeypatch.setattr(media_storage, "MEDIA_MAX_SIZE", 50)
+    response = await client.post(
+        "/api/medias/",
+        files={"file": ("big.jpg", content, "image/jpeg")},
+        headers=user1_headers,
+    )
+    assert response.status_code == 413
+    assert [path.name for path in media_root.iterdir()] == [stored_name]
+
+    # Форма без файла или без имени файла отклоняется
+    response = await client.post(
+        "/api/medias/", data={"other": "value"}, files={"x": b""}, headers=user1_headers
+    )
+    assert response.status_code == 400
+    response = await client.post(
+        "/api/medias/", files={"file": ("", b"data")}, headers=user1_headers
+    )
+    assert response.status_code == 400
+    assert [path.name for path in media_root.iterdir()] == [stored_name]
+
+
+@pytest.mark.asyncio
+async def test_upload_rejected_before_parsing(
+    client: AsyncClient, media_root, monkeypatch, test_users
+):
+    user1_headers = {"api-key": "api-key-1"}
+    monkeypatch.setattr(media_storage, "MEDIA_MAX_SIZE", 50)
+    monkeypatch.setattr(media_storage, "MEDIA_FORM_OVERHEAD", 200)
+
+    async def not_called(*args):
+        raise AssertionError("Body must not be parsed")
+
+    save_upload = media_routs.save_upload
+    monkeypatch.setattr(media_routs, "save_upload", not_called)
+
+    # Content-Length сверх лимита: тело не читается
+    response = await client.post(
+        "/api/medias/",
+        files={"file": ("big.jpg", b"0" * 1000, "image/jpeg")},
+        headers=user1_headers,
+    )
+    assert response.status_code == 413
+    monkeypatch.setattr(media_routs, "save_upload", save_upload)
+
+    # Без Content-Length загрузка прерывается на превысившем лимит куске
+    async def chunks():
+        yield b"--boundary\r\nContent-Disposition: form-data; name=file; "
+        yield b'filename="big.jpg"\r\nContent-Type: image/jpeg\r\n\r\n'
+        for _ in range(10):
+            yield b"0" * 100
+
+    response = await client.post(
+        "/api/medias/",
+        content=chunks(),
+        headers={
+            **user1_headers,
+            "Content-Type": "multipart/form-data; boundary=boundary",
+        },
+    )
+    assert response.status_code == 413
+    assert list(media_root.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_media_deduplication(client: AsyncClient, media_root, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    content = b"same bytes"
+    stored_name = hashlib.sha256(content).hexdigest()
+
+    # Одинаковые байты с разными расширениями хранятся одним файлом
+    media_ids = []
+    for name in ("a.png", "b.jpg"):
+        response = await client.post(
+            "/api/medias/",
+            files={"file": (name, content, "image/png")},
+            headers=user1_headers,
+        )
+        media_ids.append(response.json()["media_id"])
+    assert [path.name for path in media_root.iterdir()] == [stored_name]
+
+    tweet_ids = []
+    for media_id in media_ids:
+        response = await client.post(
+            "/api/tweets/",
+            json={"tweet_data": "Shared", "tweet_media_ids": [media_id]},
+            headers=user1_headers,
+        )
+        tweet_ids.append(response.json()["tweet_id"])
+
+    # Файл удаляется только вместе с последней ссылкой на него
+    await client.delete(f"/api/tweets/{tweet_ids[0]}", headers=user1_headers)
+    assert (media_root / stored_name).exists()
+    await client.delete(f"/api/tweets/{tweet_ids[1]}", headers=user1_headers)
+    assert not (media_root / stored_name).exists()
+
+
+@pytest.mark.asyncio
+async def test_release_waits_for_upload(engine, media_root, test_media):
+    content_hash = hashlib.sha256(b"raced").hexdigest()
+    (media_root / content_hash).write_bytes(b"raced")
+    sessions = async_sessionmaker(engine)
+
+    # Удаление последней ссылки ждет, пока загрузка того же содержимого
+    # закоммитит свою запись Media, и видит ее
+    async with sessions() as upload, sessions() as release:
+        async with media_storage.content_lock(upload, content_hash):
+            task = asyncio.create_task(
+                media_storage.release_files(
+                    release, [(content_hash, f"/media/{content_hash}.png")]
+                )
+            )
+            await asyncio.sleep(0)
+            assert not task.done()
+            upload.add(Media(file_path="raced.png", content_hash=content_hash))
+            await upload.commit()
+        await task
+    assert (media_root / content_hash).exists()
+
+
+def _upload_request(content: bytes) -> Request:
+    encoded = httpx.Request("POST", "http://test", files={"file": ("a.png", content)})
+    body = encoded.read()
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    headers = [(b"content-type", encoded.headers["content-type"].encode())]
+    return Request({"type": "http", "headers": headers}, receive)
+
+
+@pytest.mark.asyncio
+async def test_failed_upload_removes_published_file(
+    client: AsyncClient, engine, media_root, test_users
+):
+    sessions = async_sessionmaker(engine)
+    content = b"never committed"
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    # Запись Media не закоммичена: опубликованный файл удаляется
+    async with sessions() as db:
+        with pytest.raises(RuntimeError):
+            async with media_storage.save_upload(db, _upload_request(content)):
+                assert (media_root / content_hash).exists()
+                raise RuntimeError("commit failed")
+    assert list(media_root.iterdir()) == []
+
+    # Файл, на который уже ссылается другая запись, остается
+    response = await client.post(
+        "/api/medias/",
+        files={"file": ("b.jpg", content)},
+        headers={"api-key": "api-key-1"},
+    )
+    assert response.status_code == 200
+    async with sessions() as db:
+        with pytest.raises(RuntimeError):
+            async with media_storage.save_upload(db, _upload_request(content)):
+                raise RuntimeError("commit failed")
+    assert [path.name for path in media_root.iterdir()] == [content_hash]
+
+
+@pytest.mark.asyncio
+async def test_media_variants(client: AsyncClient, media_root, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    image = io.BytesIO()
+    Image.new("RGB", (2000, 1000), color="red").save(image, format="PNG")
+
+    response = await client.post(
+        "/api/medias/",
+        files={"file": ("big.png", image.getvalue(), "image/png")},
+        headers=user1_headers,
+    )
+    media_id = response.json()["media_id"]
+    await media_pipeline.drain()
+
+    content_hash = hashlib.sha256(image.getvalue()).hexdigest()
+    for kind, size in (("thumbnail", 200), ("feed", 1080), ("original", 2000)):
+        with Image.open(media_root / f"{content_hash}_{kind}.jpg") as variant:
+            assert max(variant.size) == size
+
+    # В ленте вложение указывает на вариант для ленты
+    await client.post(
+        "/api/tweets/",
+        json={"tweet_data": "Picture", "tweet_media_ids": [media_id]},
+        headers=user1_headers,
+    )
+    response = await client.get(
+        "/api/tweets/", params={"order": "recent", "limit": 1}, headers=user1_headers
+    )
+    attachments = response.json()["tweets"][0]["attachments"]
+    assert attachments == [f"/media/{content_hash}_feed.jpg"]
+
+
+def _png_header(width: int, height: int) -> bytes:
+    # Только заголовок PNG: размеры видны Pillow до декодирования.
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunks = b""
+    for kind, data in ((b"IHDR", header), (b"IEND", b"")):
+        chunks += struct.pack(">I", len(data)) + kind + data
+        chunks += struct.pack(">I", zlib.crc32(kind + data))
+    return b"\x89PNG\r\n\x1a\n" + chunks
+
+
+@pytest.mark.asyncio
+async def test_variants_discarded(
+    client: AsyncClient, engine, media_root, test_tweets, caplog
+):
+    user1_headers = {"api-key": "api-key-1"}
+    image = io.BytesIO()
+    Image.new("RGB", (300, 300), color="blue").save(image, format="PNG")
+    content_hash = hashlib.sha256(image.getvalue()).hexdigest()
+    stored = media_storage.StoredMedia(f"/media/{content_hash}.png", content_hash)
+    (media_root / content_hash).write_bytes(image.getvalue())
+
+    # Медиа удалено до окончания обработки: варианты не сохраняются
+    media_pipeline.submit(10_000, stored, async_sessionmaker(engine))
+    await media_pipeline.drain()
+    assert [path.name for path in media_root.iterdir()] == [content_hash]
+
+    # Декомпрессионная бомба отклоняется без вариантов
+    response = await client.post(
+        "/api/medias/",
+        files={"file": ("bomb.png", _png_header(20_000, 20_000), "image/png")},
+        headers=user1_headers,
+    )
+    assert response.status_code == 200
+    await media_pipeline.drain()
+    assert "DecompressionBombError" in caplog.text
+    assert not list(media_root.glob("*_*.jpg"))
@@ -0,0 +1,148 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import migrations
+from app.database.database import Base
+from app.database.replicas import heartbeat
+from app.models.tweet import FTS_TABLE
+from app.services.ranking import hot_score
+
+
+@pytest.fixture
+async def file_engine(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'schema.db'}")
+    yield engine
+    await engine.dispose()
+
+
+def _schema(conn):
+    inspector = inspect(conn)
+    return {
+        "likes_columns": {c["name"] for c in inspector.get_columns("likes")},
+        "users_columns": {c["name"] for c in inspector.get_columns("users")},
+        "tweets_indexes": {i["name"] for i in inspector.get_indexes("tweets")},
+        "likes_indexes": {i["name"] for i in inspector.get_indexes("likes")},
+    }
+
+
+@pytest.mark.asyncio
+async def test_upgrade_fresh_database(file_engine):
+    # Без миграций приложение не стартует
+    with pytest.raises(migrations.SchemaOutOfDate):
+        await migrations.verify(file_engine)
+
+    applied = await migrations.upgrade(file_engine)
+    assert applied == [m.version for m in migrations.MIGRATIONS]
+    assert await migrations.verify(file_engine) == migrations.LATEST_VERSION
+
+    # Повторный запуск ничего не делает
+    assert await migrations.upgrade(file_engine) == []
+
+    async with file_engine.connect() as conn:
+        schema = await conn.run_sync(_schema)
+    assert "ix_tweets_author_id_created_at" in schema["tweets_indexes"]
+    assert "ix_likes_tweet_id" in schema["likes_indexes"]
+
+
+@pytest.mark.asyncio
+async def test_upgrade_legacy_database(file_engine):
+    # Схема, созданная create_all до появления счетчиков и ограничений
+    async with file_engine.begin() as conn:
+        for statement in (
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, api_key VARCHAR, name VARCHAR)",
+            "CREATE TABLE tweets (id INTEGER PRIMARY KEY, content VARCHAR, "
+            "author_id INTEGER, created_at DATETIME)",
+            "CREATE TABLE likes (id INTEGER PRIMARY KEY, user_id INTEGER, "
+            "tweet_id INTEGER)",
+            "INSERT INTO users VALUES (1, 'key', 'Alice')",
+            "INSERT INTO tweets VALUES (1, 'Hello #World @bob', 1, '2025-01-01')",
+            "INSERT INTO likes VALUES (1, 1, 1), (2, 1, 1)",
+        ):
+            await conn.execute(text(statement))
+
+    await migrations.upgrade(file_engine)
+
+    async with file_engine.connect() as conn:
+        schema = await conn.run_sync(_schema)
+        like_count = await conn.scalar(text("SELECT like_count FROM tweets"))
+        likes = await conn.scalar(text("SELECT count(*) FROM likes"))
+        tags = await conn.scalar(text("SELECT tag FROM tweet_tags"))
+        handles = await conn.scalar(text("SELECT handle FROM tweet_mentions"))
+        score = await conn.scalar(text("SELECT hot_score FROM tweets"))
+        found = await conn.scalar(
+            text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH 'hello'")
+        )
+    assert {"followers_count", "following_count"} <= schema["users_columns"]
+    assert "uq_likes_user_id_tweet_id" in schema["likes_indexes"]
+    # Дубликат лайка удален, счетчик пересчитан
+    assert likes == 1
+    assert like_count == 1
+    # Данные заполнены без кода сервисов
+    assert (tags, handles, found) == ("world", "bob", 1)
+    assert score == pytest.approx(hot_score(1, datetime(2025, 1, 1)))
+
+
+def _tables(conn):
+    inspector = inspect(conn)
+    tables = {}
+    for name in inspector.get_table_names():
+        if name == migrations.schema_version.name:
+            continue
+        indexes = inspector.get_indexes(name)
+        # В SQLite уникальное ограничение миграции - это уникальный индекс
+        unique = {
+            tuple(c["column_names"]) for c in inspector.get_unique_constraints(name)
+        } | {tuple(i["column_names"]) for i in indexes if i["unique"]}
+        tables[name] = (
+            {c["name"] for c in inspector.get_columns(name)},
+            {i["name"] for i in indexes if not i["unique"]},
+            unique,
+        )
+    return tables
+
+
+@pytest.mark.asyncio
+async def test_migrations_match_models(file_engine, tmp_path):
+    # Замороженные миграции дают ту же схему, что и текущие модели
+    await migrations.upgrade(file_engine)
+    models_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'models.db'}")
+    try:
+        async with models_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(heartbeat.create)
+            expected = await conn.run_sync(_tables)
+    finally:
+        await models_engine.dispose()
+
+    async with file_engine.connect() as conn:
+        migrated = await conn.run_sync(_tables)
+    # Таблицу FTS5 полнотекстового поиска создают и миграция, и create_all
+    assert FTS_TABLE in migrated
+    assert migrated == expected
+
+
+@pytest.mark.asyncio
+async def test_media_files_renamed_to_hash(file_engine, tmp_path, monkeypatch):
+    media_root = tmp_path / "media"
+    media_root.mkdir()
+    monkeypatch.setattr(migrations, "MEDIA_ROOT", str(media_root))
+    await migrations.upgrade(file_engine)
+
+    # Файлы, сохраненные до миграции 10: <hash><ext> для каждого расширения
+    content_hash = "a" * 64
+    async with file_engine.begin() as conn:
+        for extension in (".png", ".jpg"):
+            await conn.execute(
+                text(
+                    "INSERT INTO media (file_path, content_hash) VALUES (:path, :hash)"
+                ),
+                {"path": f"/media/{content_hash}{extension}", "hash": content_hash},
+            )
+            (media_root / f"{content_hash}{extension}").write_bytes(b"same")
+        await conn.execute(text("DELETE FROM schema_version WHERE version = 10"))
+
+    assert await migrations.upgrade(file_engine) == [10]
+    assert [path.name for path in media_root.iterdir()] == [content_hash]
@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.profiles import PROFILES, QueryBudgetExceeded, loader_profile
+from app.models.user import User
+
+
+@pytest.mark.asyncio
+async def test_implicit_loads_are_forbidden(session: AsyncSession, test_users):
+    user = (await session.execute(select(User).where(User.id == 1))).scalar_one()
+    with pytest.raises(InvalidRequestError):
+        _ = user.followers
+
+
+@pytest.mark.asyncio
+async def test_query_budget_exceeded(session: AsyncSession, test_users):
+    budget = PROFILES["profile"].max_queries
+    dependency = loader_profile("profile")()
+    await dependency.__anext__()
+    try:
+        for _ in range(budget):
+            await session.execute(select(User.id))
+        with pytest.raises(QueryBudgetExceeded):
+            await session.execute(select(User.id))
+    finally:
+        await dependency.aclose()
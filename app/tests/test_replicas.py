@@ -0,0 +1,117 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import update
+
+from app.database.replicas import ReplicaRouter
+from app.models.user import User
+from app.services.cache import MemoryBackend, SharedCache
+
+
+@pytest.mark.asyncio
+async def test_choose_replica(engine, replica_engine):
+    now = [1000.0]
+    router = ReplicaRouter(engine, [replica_engine], max_lag=5, clock=lambda: now[0])
+
+    # Отставание неизвестно: все читают primary
+    assert router.choose("reader") is None
+
+    router.observe(0, 999.0)
+    assert router.choose("reader") == 0
+    assert router.choose(None) == 0
+
+    # Клиент, писавший позже пульса реплики, читает primary
+    now[0] = 1001.0
+    router.record_write("writer")
+    assert router.choose("writer") is None
+    router.observe(0, 1001.5)
+    assert router.choose("writer") == 0
+
+    # Реплика, отстающая сильнее max_lag, исключается
+    now[0] = 1010.0
+    assert router.choose("reader") is None
+    assert router.stats()[0]["lag_seconds"] == 8.5
+
+
+@pytest.mark.asyncio
+async def test_read_your_writes_across_workers(engine, replica_engine):
+    now = [1000.0]
+    shared = SharedCache(MemoryBackend())
+    workers = [
+        ReplicaRouter(
+            engine, [replica_engine], max_lag=5, clock=lambda: now[0], shared=shared
+        )
+        for _ in range(2)
+    ]
+    for worker in workers:
+        worker.observe(0, 999.0)
+
+    # Запись в одном воркере: до ответа время записи попадает в общий кэш
+    async with workers[0].write_session("writer") as session:
+        await session.execute(update(User).where(User.id == 0).values(name="None"))
+        await session.commit()
+
+    async with workers[1].read_session("writer") as session:
+        assert session.bind is engine
+    async with workers[1].read_session("reader") as session:
+        assert session.bind is replica_engine
+
+    for worker in workers:
+        worker.observe(0, 1000.5)
+    async with workers[1].read_session("writer") as session:
+        assert session.bind is replica_engine
+
+
+@pytest.mark.asyncio
+async def test_probe_reads_heartbeat(engine, replica_engine, replication):
+    router = ReplicaRouter(engine, [replica_engine], clock=lambda: 2000.0)
+    await router.heartbeat()
+
+    # Пульс еще не скопирован на реплику
+    await router.probe()
+    assert router.stats()[0]["lag_seconds"] != 0
+
+    replication.sync()
+    await router.probe()
+    assert router.stats()[0]["lag_seconds"] == 0
+    assert router.choose("reader") == 0
+
+
+@pytest.mark.asyncio
+async def test_read_your_writes(
+    client: AsyncClient, replication, monkeypatch, test_tweets
+):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+    await client.post("/api/users/1/follow", headers=user2_headers)
+    monkeypatch.setattr(replication, "paused", True)
+
+    response = await client.post(
+        "/api/tweets/", json={"tweet_data": "Fresh"}, headers=user1_headers
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    async def feed_ids(headers: dict) -> list[int]:
+        response = await client.get(
+            "/api/tweets/", params={"order": "recent"}, headers=headers
+        )
+        return [tweet["id"] for tweet in response.json()["tweets"]]
+
+    # Автор сразу видит свой твит (primary), подписчик читает отстающую реплику
+    assert tweet_id in await feed_ids(user1_headers)
+    response = await client.get(
+        "/api/tweets/", params={"order": "recent"}, headers=user2_headers
+    )
+    assert tweet_id not in [tweet["id"] for tweet in response.json()["tweets"]]
+    # Реплика не получила изменение: ответ без ETag, чтобы его не закэшировали
+    assert "ETag" not in response.headers
+
+    # Реплика отстала сильнее допустимого: все читают primary
+    monkeypatch.setattr(replication.router, "max_lag", -1)
+    assert tweet_id in await feed_ids(user2_headers)
+    monkeypatch.setattr(replication.router, "max_lag", 5)
+
+    # Реплика догнала primary
+    replication.sync()
+    assert tweet_id in await feed_ids(user2_headers)
+    response = await client.get("/api/tweets/", headers=user2_headers)
+    assert "ETag" in response.headers
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tag import TrendingCheckpoint, TweetMention
+from app.services.cache import RedisBackend, SharedCache, shared_cache
+from app.services.tags import (
+    SharedTrending,
+    TrendingCounter,
+    extract_mentions,
+    extract_tags,
+    restore_trending,
+    save_checkpoint,
+    trending,
+)
+
+
+def test_extract_tags_and_mentions():
+    content = "#Python и #python, @Bob: #FastAPI_tips! email@example.com #"
+    assert extract_tags(content) == ["python", "fastapi_tips"]
+    assert extract_mentions(content) == ["bob", "example"]
+
+
+def test_trending_counter_window():
+    counter = TrendingCounter(window=600, bucket=60)
+    now = datetime.utcnow()
+    counter.add(["python", "rust"], now)
+    counter.add(["python"], now - timedelta(seconds=300))
+    counter.add(["old"], now - timedelta(seconds=3600))
+    assert counter.top(10) == [("python", 2), ("rust", 1)]
+
+    # Интервалы, вышедшие из окна, вычитаются из итогов
+    counter.expire(now + timedelta(seconds=400))
+    assert counter.top(10) == [("python", 1), ("rust", 1)]
+
+    counter.add(["rust"], now, delta=-1)
+    assert counter.top(10) == [("python", 1)]
+
+
+@pytest.mark.asyncio
+async def test_tagged_tweets(client: AsyncClient, session: AsyncSession, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    contents = ["#Python one", "two #python @Test", "#rust three", "four #PYTHON"]
+    response = await client.post(
+        "/api/tweets/batch",
+        json={"tweets": [{"tweet_data": content} for content in contents]},
+        headers=user1_headers,
+    )
+    tweet_ids = response.json()["tweet_ids"]
+    assert (await session.scalars(select(TweetMention.tweet_id))).all() == [
+        tweet_ids[1]
+    ]
+
+    # Курсорная пагинация от новых к старым, тег нечувствителен к регистру и '#'
+    ids, cursor = [], None
+    while True:
+        params: dict = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = (
+            await client.get("/api/tags/PYTHON", params=params, headers=user1_headers)
+        ).json()
+        ids += [tweet["id"] for tweet in page["tweets"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == [tweet_ids[3], tweet_ids[1], tweet_ids[0]]
+
+    response = await client.get("/api/tags/trending", headers=user1_headers)
+    assert response.json()["tags"] == [
+        {"tag": "python", "count": 3},
+        {"tag": "rust", "count": 1},
+    ]
+
+    # Удаление твита убирает его из индекса и из трендов
+    await client.delete(f"/api/tweets/{tweet_ids[1]}", headers=user1_headers)
+    response = await client.get("/api/tags/python", headers=user1_headers)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [
+        tweet_ids[3],
+        tweet_ids[0],
+    ]
+    assert (await session.scalars(select(TweetMention.tweet_id))).all() == []
+    response = await client.get(
+        "/api/tags/trending", params={"limit": 1}, headers=user1_headers
+    )
+    assert response.json()["tags"] == [{"tag": "python", "count": 2}]
+
+
+@pytest.mark.asyncio
+async def test_trending_checkpoint(
+    client: AsyncClient, session: AsyncSession, test_tweets
+):
+    user1_headers = {"api-key": "api-key-1"}
+    await client.post(
+        "/api/tweets/", json={"tweet_data": "#alpha"}, headers=user1_headers
+    )
+    await session.execute(delete(TrendingCheckpoint))
+    await save_checkpoint(session)
+    await session.commit()
+
+    # Твит после контрольной точки догружается при восстановлении
+    await client.post(
+        "/api/tweets/", json={"tweet_data": "#alpha #beta"}, headers=user1_headers
+    )
+    trending.clear()
+    await restore_trending(session)
+    assert trending.top(10) == [("alpha", 2), ("beta", 1)]
+
+
+@pytest.mark.asyncio
+async def test_trending_shared_between_workers(
+    client: AsyncClient, session: AsyncSession, test_tweets, redis_server, monkeypatch
+):
+    user1_headers = {"api-key": "api-key-1"}
+    await client.post(
+        "/api/tweets/", json={"tweet_data": "#alpha before"}, headers=user1_headers
+    )
+    url = f"redis://127.0.0.1:{redis_server.port}"
+    monkeypatch.setattr(shared_cache, "backend", RedisBackend(url))
+    other_worker = SharedTrending(SharedCache(RedisBackend(url)))
+
+    # Первый запущенный воркер заполняет пустое хранилище твитами окна
+    await restore_trending(session)
+    await other_worker.restore(session)
+    assert await other_worker.top(10) == [("alpha", 1)]
+
+    # Счетчики общие: другой воркер видит те же тренды
+    for content in ("#alpha #beta", "#beta", "#beta"):
+        await client.post(
+            "/api/tweets/", json={"tweet_data": content}, headers=user1_headers
+        )
+    await shared_cache.drain()
+    response = await client.get("/api/tags/trending", headers=user1_headers)
+    assert response.json()["tags"] == [
+        {"tag": "beta", "count": 3},
+        {"tag": "alpha", "count": 2},
+    ]
+    assert await other_worker.top(10) == [("beta", 3), ("alpha", 2)]
+
+    # Контрольная точка в базу не пишется
+    await session.execute(delete(TrendingCheckpoint))
+    await save_checkpoint(session)
+    assert await session.get(TrendingCheckpoint, 1) is None
+    await shared_cache.close()
+    await other_worker.cache.close()
@@ -1,5 +1,22 @@
+import asyncio
+from datetime import datetime, timedelta
+
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.follow import Follower
+from app.models.like import Like
+from app.models.timeline import TimelineEntry
+from app.models.tweet import Tweet
+from app.models.user import User
+from app.schemas.tweet_schemas import FeedResponse
+from app.services import timeline
+from app.services.counters import reconcile_like_counts
+from app.services.like_buffer import LikeBuffer, like_buffer
+from app.services.pagination import encode_cursor
+from app.services.ranking import hot_scorer
 
 
 @pytest.mark.asyncio
@@ -53,14 +70,22 @@ async def test_likes(client: AsyncClient, test_tweets):
     # Добавление лайка
     response = await client.post("/api/tweets/1/likes", headers=user1_headers)
     assert response.status_code == 200
+    assert response.json() == {"result": True, "changed": True}
 
-    # Повторный лайк
+    # Повторный лайк идемпотентен
     response = await client.post("/api/tweets/1/likes", headers=user1_headers)
-    assert response.status_code == 400
+    assert response.status_code == 200
+    assert response.json() == {"result": True, "changed": False}
 
     # Удаление лайка
     response = await client.delete("/api/tweets/1/likes", headers=user1_headers)
     assert response.status_code == 200
+    assert response.json() == {"result": True, "changed": True}
+
+    # Повторное удаление лайка
+    response = await client.delete("/api/tweets/1/likes", headers=user1_headers)
+    assert response.status_code == 200
+    assert response.json() == {"result": True, "changed": False}
 
     # Лайк несуществующего твита
     response = await client.post("/api/tweets/999/likes", headers=user1_headers)
@@ -70,6 +95,7 @@ async def test_likes(client: AsyncClient, test_tweets):
 @pytest.mark.asyncio
 async def test_feed(client: AsyncClient, test_tweets, test_users):
     user1_headers = {"api-key": "api-key-1"}
+    await client.post("/api/users/2/follow", headers=user1_headers)
 
     # Проверка ленты
     response = await client.get("/api/tweets/", headers=user1_headers)
@@ -84,5 +110,564 @@ async def test_feed(client: AsyncClient, test_tweets, test_users):
     assert "author" in tweet
     assert "likes" in tweet
 
-    # Проверка медиавложений
-    assert len(tweet["attachments"]) == (1 if tweet["id"] == 2 else 0)
+    # Ответ без валидации на сервере все равно соответствует схеме
+    FeedResponse.model_validate(data)
+
+    # Проверка медиавложений (у твитов из фикстуры вложений нет)
+    assert all(tweet["attachments"] == [] for tweet in data["tweets"])
+
+
+@pytest.mark.asyncio
+async def test_feed_timeline(client: AsyncClient, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+
+    # Без подписок в ленте только свои твиты
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [1]
+
+    # Подписка добавляет твиты автора в ленту
+    await client.post("/api/users/2/follow", headers=user1_headers)
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    assert {tweet["id"] for tweet in response.json()["tweets"]} == {1, 2}
+
+    # Новый твит раскладывается подписчикам
+    response = await client.post(
+        "/api/tweets/", json={"tweet_data": "Fan-out"}, headers=user2_headers
+    )
+    new_tweet_id = response.json()["tweet_id"]
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    assert new_tweet_id in {tweet["id"] for tweet in response.json()["tweets"]}
+
+    # Удаленный твит пропадает из ленты
+    await client.delete(f"/api/tweets/{new_tweet_id}", headers=user2_headers)
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    assert {tweet["id"] for tweet in response.json()["tweets"]} == {1, 2}
+
+    # Отписка убирает твиты автора
+    await client.delete("/api/users/2/follow", headers=user1_headers)
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [1]
+
+
+@pytest.mark.asyncio
+async def test_unbuilt_timeline_built_in_background(
+    client: AsyncClient, session: AsyncSession, engine, test_tweets, monkeypatch
+):
+    user3 = User(name="Test User 3", api_key="api-key-3")
+    session.add(user3)
+    await session.flush()
+    user_id = user3.id
+    session.add(Follower(follower_id=user_id, followed_id=1))
+    await session.commit()
+    rebuilds = []
+    rebuild_timeline = timeline.rebuild_timeline
+
+    async def counting_rebuild(db, user_id):
+        rebuilds.append(user_id)
+        await rebuild_timeline(db, user_id)
+
+    monkeypatch.setattr(timeline, "rebuild_timeline", counting_rebuild)
+    # Несобранная лента читается в pull-режиме, чтение ничего не пишет
+    for _ in range(2):
+        response = await client.get("/api/tweets/", headers={"api-key": "api-key-3"})
+        assert [tweet["id"] for tweet in response.json()["tweets"]] == [1]
+    assert rebuilds == []
+    assert timeline.timeline_builder.pending == 1
+
+    # Ленту собирает фоновая задача, один раз
+    sessions = async_sessionmaker(engine)
+    assert await timeline.timeline_builder.run_once(sessions) == 1
+    timeline.timeline_builder.mark([user_id])
+    assert await timeline.timeline_builder.run_once(sessions) == 1
+    assert rebuilds == [user_id]
+    entries = await session.scalar(
+        select(func.count())
+        .select_from(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id)
+    )
+    assert entries == 1
+    response = await client.get("/api/tweets/", headers={"api-key": "api-key-3"})
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [1]
+    assert timeline.timeline_builder.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_feed_pulls_popular_authors(
+    client: AsyncClient, session: AsyncSession, test_tweets, monkeypatch
+):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+    await client.post("/api/users/2/follow", headers=user1_headers)
+
+    # Автор с подписчиками сверх лимита не раскладывается по лентам
+    monkeypatch.setattr(timeline, "FANOUT_FOLLOWER_LIMIT", 0)
+    response = await client.post(
+        "/api/tweets/", json={"tweet_data": "Pulled"}, headers=user2_headers
+    )
+    tweet_id = response.json()["tweet_id"]
+    entries = await session.scalar(
+        select(func.count())
+        .select_from(TimelineEntry)
+        .where(TimelineEntry.tweet_id == tweet_id)
+    )
+    assert entries == 1
+
+    # но его твит подтягивается в ленту подписчика при чтении
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    assert tweet_id in {tweet["id"] for tweet in response.json()["tweets"]}
+
+
+@pytest.mark.asyncio
+async def test_timelines_trimmed_to_window(
+    client: AsyncClient, session: AsyncSession, engine, test_tweets, monkeypatch
+):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+    await client.post("/api/users/2/follow", headers=user1_headers)
+    monkeypatch.setattr(timeline, "FEED_WINDOW_SIZE", 3)
+    tweet_ids = []
+    for number in range(5):
+        response = await client.post(
+            "/api/tweets/",
+            json={"tweet_data": f"Tweet {number}"},
+            headers=user2_headers,
+        )
+        tweet_ids.append(response.json()["tweet_id"])
+
+    # Раскладка отмечает пополненные ленты, обрезает их фоновая задача
+    assert timeline.timeline_trimmer.pending == 2
+    assert await timeline.timeline_trimmer.run_once(async_sessionmaker(engine)) == 2
+    result = await session.execute(
+        select(TimelineEntry.user_id, func.count()).group_by(TimelineEntry.user_id)
+    )
+    assert {user_id: count for user_id, count in result} == {1: 3, 2: 3}
+
+    response = await client.get("/api/tweets/?order=recent", headers=user1_headers)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == tweet_ids[:1:-1]
+
+
+@pytest.mark.asyncio
+async def test_ranked_feeds_limited_to_window(
+    client: AsyncClient, test_tweets, monkeypatch
+):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+    await client.post("/api/users/2/follow", headers=user1_headers)
+    monkeypatch.setattr(timeline, "FEED_WINDOW_SIZE", 3)
+    tweet_ids = []
+    for number in range(4):
+        response = await client.post(
+            "/api/tweets/",
+            json={"tweet_data": f"Tweet {number}"},
+            headers=user2_headers,
+        )
+        tweet_ids.append(response.json()["tweet_id"])
+    await client.post(f"/api/tweets/{tweet_ids[0]}/likes", headers=user2_headers)
+
+    # Твит с лайком старше окна не попадает в ленты по лайкам и горячести
+    for order in ("likes", "hot"):
+        response = await client.get(
+            f"/api/tweets/?order={order}", headers=user1_headers
+        )
+        ids = {tweet["id"] for tweet in response.json()["tweets"]}
+        assert ids == set(tweet_ids[1:])
+
+    # но лента по времени доходит до него постранично
+    url = "/api/tweets/?order=recent&limit=2"
+    response = await client.get(url, headers=user1_headers)
+    cursor = response.json()["next_cursor"]
+    response = await client.get(f"{url}&cursor={cursor}", headers=user1_headers)
+    assert tweet_ids[0] in {tweet["id"] for tweet in response.json()["tweets"]}
+
+
+@pytest.mark.asyncio
+async def test_feed_pagination(client: AsyncClient, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    for number in range(5):
+        await client.post(
+            "/api/tweets/",
+            json={"tweet_data": f"Tweet {number}"},
+            headers=user1_headers,
+        )
+    await client.post("/api/tweets/4/likes", headers=user1_headers)
+
+    for order in ("likes", "recent", "hot"):
+        seen: list[int] = []
+        cursor = None
+        while True:
+            params = {"limit": 2, "order": order}
+            if cursor:
+                params["cursor"] = cursor
+            response = await client.get(
+                "/api/tweets/", params=params, headers=user1_headers
+            )
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page["tweets"]) <= 2
+            seen.extend(tweet["id"] for tweet in page["tweets"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+        # Каждый твит ленты встречается ровно один раз
+        assert sorted(seen) == [1, 3, 4, 5, 6, 7]
+        if order == "likes":
+            assert seen[0] == 4
+        else:
+            assert seen == sorted(seen, reverse=True)
+
+    # Некорректный курсор, в том числе с ключом сортировки не того типа
+    for order, cursor in (
+        ("recent", "garbage"),
+        ("recent", encode_cursor("1")),
+        ("recent", encode_cursor(True)),
+        ("hot", encode_cursor([1], 2)),
+        ("likes", encode_cursor(3, 2.5)),
+    ):
+        response = await client.get(
+            "/api/tweets/",
+            params={"order": order, "cursor": cursor},
+            headers=user1_headers,
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.asyncio
+async def test_like_counters(client: AsyncClient, session: AsyncSession, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+
+    await client.post("/api/tweets/1/likes", headers=user1_headers)
+    await client.post("/api/tweets/1/likes", headers=user2_headers)
+    await client.delete("/api/tweets/1/likes", headers=user1_headers)
+    assert await session.scalar(select(Tweet.like_count).where(Tweet.id == 1)) == 1
+
+    # Пересчет исправляет рассинхронизированные счетчики
+    await session.execute(update(Tweet).values(like_count=42))
+    assert await reconcile_like_counts(session) == 2
+    await session.commit()
+    counts = (await session.execute(select(Tweet.id, Tweet.like_count))).all()
+    assert sorted(counts) == [(1, 1), (2, 0)]
+
+
+@pytest.mark.asyncio
+async def test_tweet_media_attachment(client: AsyncClient, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+
+    response = await client.post(
+        "/api/tweets/",
+        json={"tweet_data": "Two files", "tweet_media_ids": [1, 2]},
+        headers=user1_headers,
+    )
+    assert response.status_code == 200
+
+    # Уже привязанное медиа повторно не используется
+    response = await client.post(
+        "/api/tweets/",
+        json={"tweet_data": "Stolen", "tweet_media_ids": [1]},
+        headers=user2_headers,
+    )
+    assert response.status_code == 400
+
+    # Несуществующее медиа
+    response = await client.post(
+        "/api/tweets/",
+        json={"tweet_data": "Missing", "tweet_media_ids": [999]},
+        headers=user1_headers,
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_tweets_batch(client: AsyncClient, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+    await client.post("/api/users/1/follow", headers=user2_headers)
+
+    response = await client.post(
+        "/api/tweets/batch",
+        json={
+            "tweets": [
+                {"tweet_data": "First", "tweet_media_ids": [1]},
+                {"tweet_data": "Second", "tweet_media_ids": [2]},
+                {"tweet_data": "Third"},
+            ]
+        },
+        headers=user1_headers,
+    )
+    assert response.status_code == 200
+    tweet_ids = response.json()["tweet_ids"]
+    assert len(tweet_ids) == 3
+
+    # Твиты пакета попадают в ленты подписчиков
+    response = await client.get(
+        "/api/tweets/", params={"order": "recent"}, headers=user2_headers
+    )
+    feed = {tweet["id"]: tweet for tweet in response.json()["tweets"]}
+    assert set(tweet_ids) <= set(feed)
+    assert feed[tweet_ids[0]]["attachments"] == ["test1.jpg"]
+    assert feed[tweet_ids[1]]["attachments"] == ["test2.jpg"]
+
+    # Ошибка в одном твите откатывает весь пакет
+    response = await client.post(
+        "/api/tweets/batch",
+        json={
+            "tweets": [
+                {"tweet_data": "Ok"},
+                {"tweet_data": "Bad", "tweet_media_ids": [1]},
+            ]
+        },
+        headers=user1_headers,
+    )
+    assert response.status_code == 400
+    response = await client.get(
+        "/api/tweets/", params={"order": "recent"}, headers=user1_headers
+    )
+    assert len(response.json()["tweets"]) == 4
+
+
+@pytest.mark.asyncio
+async def test_concurrent_likes(
+    client: AsyncClient, session: AsyncSession, test_tweets
+):
+    user1_headers = {"api-key": "api-key-1"}
+
+    responses = await asyncio.gather(
+        *(client.post("/api/tweets/2/likes", headers=user1_headers) for _ in range(5))
+    )
+    assert [response.json()["changed"] for response in responses].count(True) == 1
+    assert await session.scalar(select(func.count(Like.id))) == 1
+    assert await session.scalar(select(Tweet.like_count).where(Tweet.id == 2)) == 1
+
+
+@pytest.mark.asyncio
+async def test_feed_etag(client: AsyncClient, engine, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+    await client.post("/api/users/2/follow", headers=user1_headers)
+
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    # Совпадающий If-None-Match дает 304 без тела и без запроса ленты
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+    try:
+        response = await client.get(
+            "/api/tweets/", headers={**user1_headers, "If-None-Match": etag}
+        )
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+    assert response.status_code == 304
+    assert response.content == b""
+    assert not any("FROM tweets" in statement for statement in statements)
+
+    # Токен зависит от параметров запроса
+    response = await client.get(
+        "/api/tweets/",
+        params={"order": "recent"},
+        headers={**user1_headers, "If-None-Match": etag},
+    )
+    assert response.status_code == 200
+
+    # Лайк к твиту автора из подписок меняет ETag
+    await client.post("/api/tweets/2/likes", headers=user2_headers)
+    response = await client.get(
+        "/api/tweets/", headers={**user1_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    # Твит постороннего автора ленту не меняет
+    etag = response.headers["ETag"]
+    await client.delete("/api/users/2/follow", headers=user1_headers)
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    etag = response.headers["ETag"]
+    await client.post(
+        "/api/tweets/", json={"tweet_data": "Unrelated"}, headers=user2_headers
+    )
+    response = await client.get(
+        "/api/tweets/", headers={**user1_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_search_tweets(client: AsyncClient, test_tweets):
+    user1_headers = {"api-key": "api-key-1"}
+    contents = [
+        "Python asyncio tips",
+        "Python python python",
+        "Rust ownership",
+        "Ещё про Python и поиск",
+    ]
+    response = await client.post(
+        "/api/tweets/batch",
+        json={"tweets": [{"tweet_data": content} for content in contents]},
+        headers=user1_headers,
+    )
+    tweet_ids = response.json()["tweet_ids"]
+
+    # Самый релевантный твит первый, несовпадающие не попадают в выдачу
+    response = await client.get(
+        "/api/tweets/search", params={"q": "python"}, headers=user1_headers
+    )
+    found = [tweet["id"] for tweet in response.json()["tweets"]]
+    assert found[0] == tweet_ids[1]
+    assert sorted(found) == sorted([tweet_ids[0], tweet_ids[1], tweet_ids[3]])
+
+    # Все слова запроса обязательны, регистр и пунктуация не важны
+    response = await client.get(
+        "/api/tweets/search", params={"q": "PYTHON, поиск!"}, headers=user1_headers
+    )
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [tweet_ids[3]]
+
+    # Курсорная пагинация проходит всю выдачу без повторов
+    ids, cursor = [], None
+    while True:
+        params: dict = {"q": "python", "limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        page = (
+            await client.get("/api/tweets/search", params=params, headers=user1_headers)
+        ).json()
+        ids += [tweet["id"] for tweet in page["tweets"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == found
+
+    # Удаленный твит исчезает из индекса
+    await client.delete(f"/api/tweets/{tweet_ids[1]}", headers=user1_headers)
+    response = await client.get(
+        "/api/tweets/search", params={"q": "python"}, headers=user1_headers
+    )
+    assert tweet_ids[1] not in [tweet["id"] for tweet in response.json()["tweets"]]
+
+
+@pytest.mark.asyncio
+async def test_hot_feed(
+    client: AsyncClient, session: AsyncSession, engine, test_tweets
+):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+    response = await client.post(
+        "/api/tweets/batch",
+        json={"tweets": [{"tweet_data": text} for text in ("Old", "Fresh", "Liked")]},
+        headers=user1_headers,
+    )
+    old, fresh, liked = response.json()["tweet_ids"]
+    await session.execute(
+        update(Tweet)
+        .where(Tweet.id == old)
+        .values(created_at=datetime.utcnow() - timedelta(days=2))
+    )
+    await session.commit()
+    for tweet_id in (old, liked):
+        for headers in (user1_headers, user2_headers):
+            await client.post(f"/api/tweets/{tweet_id}/likes", headers=headers)
+
+    # Оценки пересчитывает фоновая задача, лайкнутые твиты ждут ее в очереди
+    assert hot_scorer.pending == 2
+    assert await hot_scorer.run_once(async_sessionmaker(engine)) == 2
+    assert hot_scorer.pending == 0
+
+    async def positions(order: str) -> list[int]:
+        response = await client.get(
+            "/api/tweets/", params={"order": order}, headers=user1_headers
+        )
+        ids = [tweet["id"] for tweet in response.json()["tweets"]]
+        return [tweet_id for tweet_id in ids if tweet_id in (old, fresh, liked)]
+
+    # По всем лайкам старый твит выше свежего, по "горячести" - ниже
+    assert await positions("likes") == [liked, old, fresh]
+    assert await positions("hot") == [liked, fresh, old]
+
+
+@pytest.mark.asyncio
+async def test_buffered_likes(
+    client: AsyncClient, session: AsyncSession, engine, monkeypatch, test_tweets
+):
+    monkeypatch.setattr(like_buffer, "enabled", True)
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+    await client.post("/api/users/2/follow", headers=user1_headers)
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    etag = response.headers["ETag"]
+
+    # Повторы и пары лайк/снятие схлопываются в последнее намерение
+    changes = [
+        (await client.post("/api/tweets/2/likes", headers=user1_headers)).json(),
+        (await client.post("/api/tweets/2/likes", headers=user1_headers)).json(),
+        (await client.post("/api/tweets/1/likes", headers=user2_headers)).json(),
+        (await client.delete("/api/tweets/1/likes", headers=user2_headers)).json(),
+        (await client.post("/api/tweets/999/likes", headers=user2_headers)).json(),
+    ]
+    assert [change["changed"] for change in changes] == [True, False, True, True, True]
+    assert len(like_buffer) == 3
+    assert await session.scalar(select(func.count(Like.id))) == 0
+
+    # Пользователь видит свои незаписанные лайки, ETag его ленты меняется
+    response = await client.get(
+        "/api/tweets/", headers={**user1_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    likes = {tweet["id"]: tweet["likes"] for tweet in response.json()["tweets"]}
+    assert likes[2] == [{"user_id": 1, "name": "Test User 1"}]
+    response = await client.get("/api/tweets/", headers=user2_headers)
+    assert all(not tweet["likes"] for tweet in response.json()["tweets"])
+
+    # Сброс пишет намерения пачкой и обновляет счетчики
+    assert await like_buffer.flush(async_sessionmaker(engine)) == 3
+    assert len(like_buffer) == 0
+    rows = (await session.execute(select(Like.user_id, Like.tweet_id))).all()
+    assert [tuple(row) for row in rows] == [(1, 2)]
+    counts = (await session.execute(select(Tweet.id, Tweet.like_count))).all()
+    assert sorted(counts) == [(1, 0), (2, 1)]
+    assert hot_scorer.pending == 1
+
+    # Снятие после записи применяется следующим сбросом
+    await client.delete("/api/tweets/2/likes", headers=user1_headers)
+    response = await client.get("/api/tweets/", headers=user1_headers)
+    likes = {tweet["id"]: tweet["likes"] for tweet in response.json()["tweets"]}
+    assert likes[2] == []
+    await like_buffer.flush(async_sessionmaker(engine))
+    assert await session.scalar(select(func.count(Like.id))) == 0
+    assert await session.scalar(select(Tweet.like_count).where(Tweet.id == 2)) == 0
+
+
+@pytest.mark.asyncio
+async def test_buffered_like_compares_with_database(
+    client: AsyncClient, session: AsyncSession, engine, monkeypatch, test_tweets
+):
+    monkeypatch.setattr(like_buffer, "enabled", True)
+    user1_headers = {"api-key": "api-key-1"}
+    await client.post("/api/tweets/2/likes", headers=user1_headers)
+    await like_buffer.flush(async_sessionmaker(engine))
+    mark = like_buffer.user_mark(1)
+
+    # Лайк уже записан: повтор ничего не меняет и не попадает в буфер
+    response = await client.post("/api/tweets/2/likes", headers=user1_headers)
+    assert response.json()["changed"] is False
+    assert len(like_buffer) == 0
+    assert like_buffer.user_mark(1) == mark
+    response = await client.delete("/api/tweets/1/likes", headers=user1_headers)
+    assert response.json()["changed"] is False
+
+    # Другой воркер не видит незаписанное намерение до сброса
+    other_worker = LikeBuffer(enabled=True)
+    response = await client.delete("/api/tweets/2/likes", headers=user1_headers)
+    assert response.json()["changed"] is True
+    assert await other_worker.add(session, 1, 2, True) is False
+    await like_buffer.flush(async_sessionmaker(engine))
+    await session.commit()
+    assert await other_worker.add(session, 1, 2, False) is False
+    assert other_worker.state(1, 2) is None
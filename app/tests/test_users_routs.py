@@ -1,5 +1,12 @@
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User
+from app.routs import user_routs
+from app.services.counters import reconcile_follow_counts
+from app.services.follow_graph import follow_graph
 
 
 @pytest.mark.asyncio
@@ -69,3 +76,101 @@ async def test_followers_logic(client: AsyncClient, test_users):
     # Проверяем взаимные подписки
     profile_user1 = await client.get("/api/users/1", headers=user1_headers)
     assert len(profile_user1.json()["user"]["followers"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_follow_graph(client: AsyncClient, session: AsyncSession, test_users):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+
+    await client.post("/api/users/2/follow", headers=user1_headers)
+    await client.get("/api/tweets/", headers=user1_headers)
+    misses = follow_graph.misses
+
+    # Повторное чтение ленты (ETag) не обращается к таблице followers
+    await client.get("/api/tweets/", headers=user1_headers)
+    assert follow_graph.misses == misses
+
+    # Подписка и отписка обновляют загруженные списки
+    await client.post("/api/users/1/follow", headers=user2_headers)
+    assert list(await follow_graph.followers(session, 1)) == [2]
+    await client.delete("/api/users/2/follow", headers=user1_headers)
+    misses = follow_graph.misses
+    assert list(await follow_graph.following(session, 1)) == []
+    assert follow_graph.misses == misses
+
+    stats = follow_graph.stats()
+    assert stats["memory_bytes"] > 0
+    assert stats["hits"] > 0
+
+
+@pytest.mark.asyncio
+async def test_profile_etag(client: AsyncClient, test_users):
+    user1_headers = {"api-key": "api-key-1"}
+    user2_headers = {"api-key": "api-key-2"}
+
+    response = await client.get("/api/users/me", headers=user1_headers)
+    etag = response.headers["ETag"]
+    response = await client.get(
+        "/api/users/me", headers={**user1_headers, "If-None-Match": f"W/{etag}"}
+    )
+    assert response.status_code == 304
+
+    # Профиль по id имеет тот же ETag, что и собственный
+    response = await client.get("/api/users/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Новый подписчик меняет профиль
+    await client.post("/api/users/1/follow", headers=user2_headers)
+    response = await client.get(
+        "/api/users/me", headers={**user1_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert [user["id"] for user in response.json()["user"]["followers"]] == [2]
+
+
+@pytest.mark.asyncio
+async def test_follow_lists(
+    client: AsyncClient, session: AsyncSession, monkeypatch, test_users
+):
+    monkeypatch.setattr(user_routs, "PROFILE_PREVIEW_SIZE", 2)
+    api_keys = [f"reader-{i}" for i in range(5)]
+    session.add_all([User(name=key, api_key=key) for key in api_keys])
+    await session.commit()
+    reader_ids = (
+        await session.scalars(
+            select(User.id).where(User.api_key.in_(api_keys)).order_by(User.id)
+        )
+    ).all()
+    for key in api_keys:
+        await client.post("/api/users/1/follow", headers={"api-key": key})
+    await client.delete("/api/users/1/follow", headers={"api-key": api_keys[0]})
+
+    # Профиль содержит счетчики и только первую страницу подписчиков
+    profile = (await client.get("/api/users/1")).json()["user"]
+    assert profile["followers_count"] == 4
+    assert profile["following_count"] == 0
+    assert [user["id"] for user in profile["followers"]] == reader_ids[1:3]
+
+    # Полный список выдается постранично
+    ids, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        page = (await client.get("/api/users/1/followers", params=params)).json()
+        ids += [user["id"] for user in page["users"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == reader_ids[1:]
+
+    following = (await client.get(f"/api/users/{reader_ids[1]}/following")).json()
+    assert following["users"] == [{"id": 1, "name": "Test User 1"}]
+    response = await client.get("/api/users/999/followers")
+    assert response.status_code == 404
+
+    # Сверка счетчиков с таблицей followers
+    await session.execute(update(User).values(followers_count=0))
+    assert await reconcile_follow_counts(session) == 1
+    await session.commit()
+    profile = (await client.get("/api/users/1")).json()["user"]
+    assert profile["followers_count"] == 4
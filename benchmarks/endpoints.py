@@ -0,0 +1,302 @@
+"""
+Бенчмарк эндпоинтов на синтетическом наборе данных: задержка (последовательные
+запросы) и пропускная способность (параллельные запросы) для ленты, профиля,
+лайка, подписки, публикации, поиска, хэштегов и загрузки медиа. Приложение вызывается в
+процессе через ASGI, база - SQLite или локальный Postgres.
+
+    python -m benchmarks.endpoints --url sqlite+aiosqlite:///benchmark.db \\
+        --output results.json --baseline previous.json
+
+Результат - JSON с коммитом, диалектом, параметрами набора и метриками по
+сценариям; --baseline печатает сравнение с прошлым прогоном.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient, Response
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.database.database import get_db, get_read_db, session_dependencies
+from app.database.replicas import ReplicaRouter
+from benchmarks.seed import (
+    Dataset,
+    add_dataset_arguments,
+    api_key,
+    dataset_from_arguments,
+    seed,
+    tag_name,
+)
+
+Scenario = Callable[[AsyncClient, random.Random, Dataset], Awaitable[Response]]
+
+
+def _headers(rng: random.Random, dataset: Dataset) -> dict[str, str]:
+    return {"api-key": api_key(rng.randint(1, dataset.users))}
+
+
+async def feed(client: AsyncClient, rng: random.Random, dataset: Dataset) -> Response:
+    return await client.get("/api/tweets/", headers=_headers(rng, dataset))
+
+
+async def profile(
+    client: AsyncClient, rng: random.Random, dataset: Dataset
+) -> Response:
+    return await client.get("/api/users/me", headers=_headers(rng, dataset))
+
+
+async def like(client: AsyncClient, rng: random.Random, dataset: Dataset) -> Response:
+    tweet_id = rng.randint(1, dataset.tweets)
+    return await client.post(
+        f"/api/tweets/{tweet_id}/likes", headers=_headers(rng, dataset)
+    )
+
+
+async def follow(client: AsyncClient, rng: random.Random, dataset: Dataset) -> Response:
+    # Подписка и отписка измеряются парой, чтобы граф не менялся между прогонами.
+    headers = _headers(rng, dataset)
+    user_id = rng.randint(1, dataset.users)
+    await client.delete(f"/api/users/{user_id}/follow", headers=headers)
+    return await client.post(f"/api/users/{user_id}/follow", headers=headers)
+
+
+async def post(client: AsyncClient, rng: random.Random, dataset: Dataset) -> Response:
+    return await client.post(
+        "/api/tweets/",
+        json={"tweet_data": f"Benchmark tweet {rng.random()}"},
+        headers=_headers(rng, dataset),
+    )
+
+
+async def search(client: AsyncClient, rng: random.Random, dataset: Dataset) -> Response:
+    term = f"{rng.randint(1, dataset.tweets)}"
+    return await client.get(
+        "/api/tweets/search",
+        params={"q": f"synthetic {term}"},
+        headers=_headers(rng, dataset),
+    )
+
+
+async def tag(client: AsyncClient, rng: random.Random, dataset: Dataset) -> Response:
+    return await client.get(
+        f"/api/tags/{tag_name(rng.randint(1, dataset.tags))}",
+        headers=_headers(rng, dataset),
+    )
+
+
+async def trending(
+    client: AsyncClient, rng: random.Random, dataset: Dataset
+) -> Response:
+    return await client.get("/api/tags/trending", headers=_headers(rng, dataset))
+
+
+async def upload(client: AsyncClient, rng: random.Random, dataset: Dataset) -> Response:
+    from PIL import Image
+
+    image = io.BytesIO()
+    color = tuple(rng.randrange(256) for _ in range(3))
+    Image.new("RGB", (64, 64), color=color).save(image, format="PNG")
+    return await client.post(
+        "/api/medias/",
+        files={"file": ("bench.png", image.getvalue(), "image/png")},
+        headers=_headers(rng, dataset),
+    )
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "feed": feed,
+    "profile": profile,
+    "like": like,
+    "follow": follow,
+    "post": post,
+    "search": search,
+    "tag": tag,
+    "trending": trending,
+    "upload": upload,
+}
+
+
+def build_app(engine: AsyncEngine) -> FastAPI:
+    from main import app as main_app
+
+    bench_get_db, bench_get_read_db = session_dependencies(ReplicaRouter(engine))
+    app = FastAPI()
+    app.dependency_overrides[get_db] = bench_get_db
+    app.dependency_overrides[get_read_db] = bench_get_read_db
+    app.include_router(main_app.router)
+    return app
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+async def run_scenario(
+    client: AsyncClient,
+    scenario: Scenario,
+    dataset: Dataset,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    seed_value: int,
+) -> dict:
+    rng = random.Random(seed_value)
+    for _ in range(warmup):
+        await scenario(client, rng, dataset)
+
+    latencies, errors = [], 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await scenario(client, rng, dataset)
+        latencies.append((time.perf_counter() - started) * 1000)
+        errors += response.status_code >= 400
+
+    remaining = requests
+    lock = asyncio.Lock()
+
+    async def worker(worker_rng: random.Random) -> int:
+        nonlocal remaining
+        failed = 0
+        while True:
+            async with lock:
+                if remaining == 0:
+                    return failed
+                remaining -= 1
+            response = await scenario(client, worker_rng, dataset)
+            failed += response.status_code >= 400
+
+    started = time.perf_counter()
+    failures = await asyncio.gather(
+        *(worker(random.Random(seed_value + index)) for index in range(concurrency))
+    )
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": errors + sum(failures),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies), 3),
+            "p50": round(_percentile(latencies, 50), 3),
+            "p95": round(_percentile(latencies, 95), 3),
+            "p99": round(_percentile(latencies, 99), 3),
+            "max": round(max(latencies), 3),
+        },
+        "concurrency": concurrency,
+        "throughput_rps": round(requests / elapsed, 1),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict) -> list[str]:
+    """
+    Сравнивает p95 и пропускную способность с прошлым прогоном.
+    """
+    lines = [f"{'scenario':<10} {'p95 ms':>18} {'rps':>20}"]
+    for name, result in current["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        p95_old, p95_new = previous["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        rps_old, rps_new = previous["throughput_rps"], result["throughput_rps"]
+        lines.append(
+            f"{name:<10} {p95_old:>8.2f} -> {p95_new:<8.2f}"
+            f" {rps_old:>9.1f} -> {rps_new:<9.1f}"
+        )
+    return lines
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from app.services import media_storage
+    from app.services.media_pipeline import media_pipeline
+
+    dataset = dataset_from_arguments(args)
+    engine = create_async_engine(args.url)
+    media_storage.MEDIA_ROOT = tempfile.mkdtemp(prefix="bench-media-")
+    try:
+        counts = None if args.reuse else await seed(engine, dataset)
+        transport = ASGITransport(app=build_app(engine))
+        results = {}
+        async with AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.scenarios:
+                results[name] = await run_scenario(
+                    client,
+                    SCENARIOS[name],
+                    dataset,
+                    args.requests,
+                    args.concurrency,
+                    args.warmup,
+                    dataset.seed,
+                )
+                await media_pipeline.drain()
+        await media_pipeline.shutdown()
+        return {
+            "benchmark": "endpoints",
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "dialect": engine.dialect.name,
+            "dataset": {**vars(dataset), "rows": counts},
+            "results": results,
+        }
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="sqlite+aiosqlite:///benchmark.db")
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--reuse", action="store_true", help="не пересоздавать набор данных"
+    )
+    parser.add_argument("--output", help="файл для JSON-результата")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print("\n".join(compare(baseline, report)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
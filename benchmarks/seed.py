@@ -0,0 +1,238 @@
+"""
+Генерация синтетического набора данных для бенчмарков: пользователи,
+степенной граф подписок, твиты, лайки и медиа. Данные вставляются пачками
+в пустую (пересоздаваемую) базу; при одинаковом --seed набор повторяется.
+
+    python -m benchmarks.seed --url sqlite+aiosqlite:///benchmark.db --users 10000
+"""
+
+import argparse
+import asyncio
+import hashlib
+import random
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Any, Iterable
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+
+from app.database.database import Base
+from app.database.migrations import schema_version, upgrade
+from app.database.replicas import heartbeat
+from app.models.follow import Follower
+from app.models.like import Like
+from app.models.media import Media
+from app.models.media_variant import MediaVariant  # noqa: F401
+from app.models.timeline import TimelineEntry  # noqa: F401
+from app.models.tweet import Tweet
+from app.models.user import User
+from app.services.counters import reconcile_follow_counts, reconcile_like_counts
+from app.services.ranking import rescore_all
+from app.services.search import rebuild_index
+from app.services.tags import rebuild_tags
+from app.services.timeline import rebuild_all_timelines
+
+INSERT_CHUNK_SIZE = 5000
+
+
+@dataclass
+class Dataset:
+    users: int = 1000
+    # Среднее число подписок на пользователя.
+    follows: int = 20
+    tweets: int = 10000
+    likes: int = 50000
+    # Доля твитов с медиавложением.
+    media_ratio: float = 0.2
+    # Число различных хэштегов; у каждого твита один тег.
+    tags: int = 100
+    # Показатель степенного закона популярности: вес пользователя ранга r равен r^-alpha.
+    alpha: float = 1.1
+    seed: int = 42
+
+
+def api_key(user_id: int) -> str:
+    return f"bench-key-{user_id}"
+
+
+def tag_name(rank: int) -> str:
+    return f"topic{rank}"
+
+
+def _popularity(count: int, alpha: float) -> list[float]:
+    return list(accumulate(rank**-alpha for rank in range(1, count + 1)))
+
+
+def _follow_edges(dataset: Dataset, rng: random.Random) -> set[tuple[int, int]]:
+    weights = _popularity(dataset.users, dataset.alpha)
+    user_ids = range(1, dataset.users + 1)
+    edges = set()
+    for follower_id in user_ids:
+        wanted = min(int(rng.expovariate(1 / dataset.follows)), dataset.users - 1)
+        for followed_id in rng.choices(user_ids, cum_weights=weights, k=wanted):
+            if followed_id != follower_id:
+                edges.add((follower_id, followed_id))
+    return edges
+
+
+async def _insert(db: AsyncSession, model: Any, rows: Iterable[dict]) -> None:
+    chunk: list[dict] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            await db.execute(insert(model), chunk)
+            chunk = []
+    if chunk:
+        await db.execute(insert(model), chunk)
+
+
+async def _sync_sequences(db: AsyncSession) -> None:
+    # Идентификаторы заданы явно: счетчики SERIAL в Postgres нужно догнать.
+    for table in ("users", "tweets", "likes", "media"):
+        await db.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+            )
+        )
+
+
+async def seed(engine: AsyncEngine, dataset: Dataset) -> dict[str, int]:
+    """
+    Пересоздает схему и заполняет ее набором данных. Возвращает число строк
+    по таблицам.
+    """
+    rng = random.Random(dataset.seed)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(schema_version.drop, checkfirst=True)
+        await conn.run_sync(heartbeat.drop, checkfirst=True)
+    await upgrade(engine)
+
+    author_weights = _popularity(dataset.users, dataset.alpha)
+    user_ids = range(1, dataset.users + 1)
+    authors = rng.choices(user_ids, cum_weights=author_weights, k=dataset.tweets)
+    tag_ranks = rng.choices(
+        range(1, dataset.tags + 1),
+        cum_weights=_popularity(dataset.tags, dataset.alpha),
+        k=dataset.tweets,
+    )
+    started = datetime.utcnow() - timedelta(days=30)
+    edges = _follow_edges(dataset, rng)
+
+    likes: set[tuple[int, int]] = set()
+    tweet_ids = range(1, dataset.tweets + 1)
+    attempts = 0
+    while len(likes) < dataset.likes and attempts < dataset.likes * 3:
+        likes.add((rng.choice(user_ids), rng.choice(tweet_ids)))
+        attempts += 1
+    media_tweets = [
+        tweet_id for tweet_id in tweet_ids if rng.random() < dataset.media_ratio
+    ]
+
+    async with AsyncSession(engine) as db:
+        await _insert(
+            db,
+            User,
+            (
+                {"id": user_id, "name": f"User {user_id}", "api_key": api_key(user_id)}
+                for user_id in user_ids
+            ),
+        )
+        await _insert(
+            db,
+            Follower,
+            (
+                {"follower_id": follower_id, "followed_id": followed_id}
+                for follower_id, followed_id in sorted(edges)
+            ),
+        )
+        await _insert(
+            db,
+            Tweet,
+            (
+                {
+                    "id": tweet_id,
+                    "content": f"Synthetic tweet {tweet_id} #{tag_name(rank)}",
+                    "author_id": author_id,
+                    "created_at": started + timedelta(seconds=tweet_id),
+                }
+                for tweet_id, author_id, rank in zip(tweet_ids, authors, tag_ranks)
+            ),
+        )
+        await _insert(
+            db,
+            Like,
+            (
+                {"id": like_id, "user_id": user_id, "tweet_id": tweet_id}
+                for like_id, (user_id, tweet_id) in enumerate(sorted(likes), start=1)
+            ),
+        )
+        await _insert(
+            db,
+            Media,
+            (
+                {
+                    "id": media_id,
+                    "file_path": f"/media/{content_hash}.jpg",
+                    "content_hash": content_hash,
+                    "tweet_id": tweet_id,
+                    "owner_id": authors[tweet_id - 1],
+                }
+                for media_id, tweet_id in enumerate(media_tweets, start=1)
+                for content_hash in [hashlib.sha256(str(tweet_id).encode()).hexdigest()]
+            ),
+        )
+        if db.get_bind().dialect.name == "postgresql":
+            await _sync_sequences(db)
+
+        await reconcile_like_counts(db)
+        await reconcile_follow_counts(db)
+        await rebuild_all_timelines(db)
+        await rebuild_index(db)
+        await rebuild_tags(db)
+        await rescore_all(db)
+        await db.commit()
+
+    return {
+        "users": dataset.users,
+        "follows": len(edges),
+        "tweets": dataset.tweets,
+        "likes": len(likes),
+        "media": len(media_tweets),
+    }
+
+
+def add_dataset_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = Dataset()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=type(value), default=value
+        )
+
+
+def dataset_from_arguments(args: argparse.Namespace) -> Dataset:
+    return Dataset(**{name: getattr(args, name) for name in asdict(Dataset())})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="sqlite+aiosqlite:///benchmark.db")
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+
+    async def run() -> None:
+        engine = create_async_engine(args.url)
+        try:
+            counts = await seed(engine, dataset_from_arguments(args))
+        finally:
+            await engine.dispose()
+        print(counts)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Сравнение стоимости сериализации ленты на один твит: стандартный путь
+FastAPI (валидация response_model + jsonable-преобразование + json.dumps)
+против быстрого пути (словари по форме схемы + сериализация в pydantic-core).
+
+    python -m benchmarks.serialization --tweets 500 --likes 20
+"""
+
+import argparse
+import json
+import timeit
+from typing import Any
+
+from app.schemas.tweet_schemas import FeedResponse
+from app.services.responses import TrustedJSONResponse
+
+
+def make_feed(tweets: int, likes: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "id": tweet_id,
+            "content": f"Tweet number {tweet_id} " * 4,
+            "attachments": [f"/media/{tweet_id:064x}_feed.jpg"],
+            "author": {"id": tweet_id % 97, "name": f"Author {tweet_id % 97}"},
+            "likes": [
+                {"user_id": user_id, "name": f"User {user_id}"}
+                for user_id in range(likes)
+            ],
+        }
+        for tweet_id in range(tweets)
+    ]
+
+
+def standard_path(feed: list[dict[str, Any]]) -> bytes:
+    # То же, что делает FastAPI для обычного return dict с response_model.
+    response = FeedResponse.model_validate({"result": True, "tweets": feed})
+    content = response.model_dump(mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def fast_path(feed: list[dict[str, Any]]) -> bytes:
+    # Маршрут собирает словари по форме TweetInFeed сам и отдает их как есть.
+    tweets = [
+        {
+            "id": tweet["id"],
+            "content": tweet["content"],
+            "attachments": tweet["attachments"],
+            "author": {"id": tweet["author"]["id"], "name": tweet["author"]["name"]},
+            "likes": [
+                {"user_id": like["user_id"], "name": like["name"]}
+                for like in tweet["likes"]
+            ],
+        }
+        for tweet in feed
+    ]
+    return TrustedJSONResponse(
+        {"result": True, "tweets": tweets, "next_cursor": None}
+    ).body
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tweets", type=int, default=500)
+    parser.add_argument("--likes", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    feed = make_feed(args.tweets, args.likes)
+    assert json.loads(standard_path(feed)) == json.loads(fast_path(feed))
+
+    results = {}
+    for name, path in (("standard", standard_path), ("fast", fast_path)):
+        seconds = min(timeit.repeat(lambda: path(feed), number=1, repeat=args.repeat))
+        results[name] = seconds / args.tweets * 1e6
+    print(
+        json.dumps(
+            {
+                "benchmark": "feed_serialization",
+                "tweets": args.tweets,
+                "likes_per_tweet": args.likes,
+                "us_per_tweet": {
+                    name: round(cost, 2) for name, cost in results.items()
+                },
+                "speedup": round(results["standard"] / results["fast"], 2),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
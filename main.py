@@ -1,34 +1,62 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import FastAPI
-from sqlalchemy.exc import SQLAlchemyError
 
-from app.database.database import AsyncSessionLocal, Base, engine
-from app.database.utils import populate_database
-from app.routs import media_routs, tweet_routs, user_routs
-
-# from sqlalchemy.sql import text
+from app.database.database import AsyncSessionLocal, engine, replica_router
+from app.database.migrations import verify
+from app.routs import internal_routs, media_routs, tag_routs, tweet_routs, user_routs
+from app.services.admission import AdmissionMiddleware
+from app.services.cache import shared_cache
+from app.services.instrumentation import MetricsMiddleware
+from app.services.like_buffer import like_buffer
+from app.services.media_pipeline import media_pipeline
+from app.services.ranking import hot_scorer, mark_recent
+from app.services.tags import checkpoint_periodically, restore_trending, save_checkpoint
+from app.services.timeline import timeline_builder, timeline_trimmer
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with engine.begin() as conn:
-        # await conn.run_sync(Base.metadata.drop_all)
-        # await conn.execute(text("DROP SCHEMA public CASCADE"))
-        # await conn.execute(text("CREATE SCHEMA public"))
-        await conn.run_sync(Base.metadata.create_all)
-
+    # Схему создает и обновляет python -m app.database.migrations upgrade;
+    # воркер только проверяет, что версия схемы совпадает с кодом.
+    await verify(engine)
     async with AsyncSessionLocal() as session:
-        try:
-            await populate_database(session)
-        except SQLAlchemyError as e:
-            print(f"Error during database population: {e}")
+        await restore_trending(session)
+        await mark_recent(session)
+    background = [
+        asyncio.create_task(checkpoint_periodically(AsyncSessionLocal)),
+        asyncio.create_task(hot_scorer.run(AsyncSessionLocal)),
+        asyncio.create_task(timeline_trimmer.run(AsyncSessionLocal)),
+        asyncio.create_task(timeline_builder.run(AsyncSessionLocal)),
+        asyncio.create_task(like_buffer.run(AsyncSessionLocal)),
+        asyncio.create_task(shared_cache.run()),
+    ]
+    if replica_router.replicas:
+        background.append(asyncio.create_task(replica_router.run()))
 
     yield
 
+    for task in background:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    # Подтвержденные, но не записанные лайки не должны потеряться.
+    await like_buffer.flush(AsyncSessionLocal)
+    async with AsyncSessionLocal() as session:
+        await save_checkpoint(session)
+        await session.commit()
+    await shared_cache.close()
+    await media_pipeline.shutdown()
+
 
 app = FastAPI(lifespan=lifespan)
+# Метрики снаружи: отклоненные запросы тоже попадают в них.
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(media_routs.router)
 app.include_router(tweet_routs.router)
 app.include_router(user_routs.router)
+app.include_router(tag_routs.router)
+app.include_router(internal_routs.router)